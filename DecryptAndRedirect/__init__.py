@@ -1,25 +1,28 @@
 """Azure Function HTTP trigger para manejar la notificación de RedSys."""
 
 import base64
-import json
 import logging
 import os
-from datetime import datetime, timezone
-from decimal import Decimal
-from typing import Any, Dict, Optional
+from typing import Any, Dict
 import hmac
-from urllib.parse import unquote
 
 import azure.functions as func
-from requests import HTTPError
 
-from utils.bc_client import BusinessCentralError, call_business_central, split_bc_url
-from utils.crypto import decrypt_secret
-from utils.crypto import (
-    compute_redsys_signature,
-    decode_redsys_parameters,
+from utils import codec, merchants, notification_guard, profiling, timing
+from utils.bc_client import circuit_open
+from utils.crypto import get_signer
+from utils.notification_delivery import (  # noqa: F401  (build_bc_payload, parse_amount y parse_datetime se reexportan)
+    CredentialsError,
+    build_bc_payload,
+    decode_notification_parameters,
+    parse_amount,
+    parse_datetime,
 )
-from utils.table_storage_sdk import get_entity_by_order_code
+from utils.notification_delivery_aio import deliver_notification
+from utils.idempotency import fingerprint, idempotency_enabled
+from utils.idempotency_aio import get_processed, run_once
+from utils.notification_queue import build_message, enqueue_notification_async, queue_mode_enabled
+from utils.table_storage_aio import get_entity_by_order_code
 
 def parse_request(req: func.HttpRequest) -> Dict[str, Any]:
     """Extrae parámetros relevantes de la petición RedSys.
@@ -41,7 +44,7 @@ def parse_request(req: func.HttpRequest) -> Dict[str, Any]:
 
     # Intentar leer JSON
     try:
-        body_json = req.get_json()
+        body_json = codec.loads(req.get_body())
         if isinstance(body_json, dict):
             payload.update(body_json)
     except ValueError:
@@ -61,315 +64,254 @@ def parse_request(req: func.HttpRequest) -> Dict[str, Any]:
     return payload
 
 
-def parse_amount(amount_value: str | None) -> float | None:
-    if not amount_value:
-        return None
-    try:
-        return float(Decimal(amount_value) / Decimal("100"))
-    except Exception:  # pylint: disable=broad-except
-        logging.warning("No se pudo convertir Ds_Amount='%s'", amount_value)
-        return None
+def _with_echo(body: Dict[str, Any], **echo: Any) -> Dict[str, Any]:
+    """Añade a la respuesta los datos recibidos, salvo con `RESPONSE_PROFILE=compact`."""
+    if not codec.compact_profile():
+        body.update(echo)
+    return body
+
+
+def _signature_matches(signer, ds_params_b64: str, ds_signature: str, ds_order: str) -> bool:
+    expected_signature = signer.sign(ds_params_b64, ds_order)
 
+    normalized_signature = ds_signature.replace("-", "+").replace("_", "/")
+    padding = len(normalized_signature) % 4
+    if padding:
+        normalized_signature += "=" * (4 - padding)
 
-def parse_datetime(date_value: str | None, hour_value: str | None) -> str | None:
-    if not date_value or not hour_value:
-        return None
     try:
-        dt = datetime.strptime(f"{date_value} {hour_value}", "%d/%m/%Y %H:%M")
-        return dt.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z")
-    except ValueError:
-        logging.warning("No se pudo convertir fecha/hora '%s' '%s'", date_value, hour_value)
-        return None
-
-
-def build_bc_payload(decoded_params: Dict[str, Any], signature: str, order: str) -> Dict[str, Any]:
-    """Construye el payload para Business Central.
-    
-    Envía exactamente lo que RedSys manda (decoded_params) como un string JSON
-    en el campo 'paymentInfo'. Esto hace la solución transparente a cambios
-    en los campos de RedSys.
-    
-    Args:
-        decoded_params: Parámetros decodificados de RedSys (tal cual los envía)
-        signature: Firma recibida de RedSys
-        order: Número de pedido
-        
-    Returns:
-        Diccionario con un único campo 'paymentInfo' conteniendo el JSON string
-    """
-    # Enviar exactamente lo que RedSys manda, sin transformaciones
-    # Esto hace la AF transparente a cambios en los campos de RedSys
-    return {
-        "paymentInfo": json.dumps(decoded_params, ensure_ascii=False)
-    }
+        expected_bytes = base64.b64decode(expected_signature)
+        received_bytes = base64.b64decode(normalized_signature)
+        return hmac.compare_digest(expected_bytes, received_bytes)
+    except Exception as exc:  # pylint: disable=broad-except
+        # Firma mal formada: tráfico basura, no merece una traza completa
+        logging.warning("Error al normalizar firmas RedSys: %s", exc)
+        return False
+
+
+def _throttled(retry_after: float) -> func.HttpResponse:
+    return func.HttpResponse(
+        codec.dumps({"error": "Demasiadas notificaciones rechazadas"}),
+        mimetype="application/json",
+        status_code=429,
+        headers={"Retry-After": str(max(1, round(retry_after)))},
+    )
+
+
+def _rejected(source: str | None, body: Dict[str, Any], status_code: int) -> func.HttpResponse:
+    """Respuesta a una petición rechazada; cuenta para el límite de su origen."""
+    notification_guard.record_rejection(source)
+    return func.HttpResponse(codec.dumps(body), mimetype="application/json", status_code=status_code)
 
 
-def escape_odata_key(value: str) -> str:
-    return value.replace("'", "''")
-
-
-def upload_stream_property(
-    entity: Dict[str, Any],
-    relative_resource: Optional[str],
-    order: str,
-    stream_name: str,
-    content: str,
-    content_type: str,
-) -> None:
-    if not relative_resource:
-        return
-    escaped_order = escape_odata_key(order)
-    normalized_resource = relative_resource.strip("/")
-    if not normalized_resource:
-        return
-    stream_path = f"{normalized_resource}" f"('{escaped_order}')/{stream_name}/$value"
-    call_business_central(
-        entity,
-        method="PUT",
-        relative_path=stream_path,
-        payload=content,
-        headers={"Content-Type": content_type},
+def _forged_response(source: str | None, ds_order: str | None, **echo: Any) -> func.HttpResponse:
+    return _rejected(
+        source,
+        _with_echo({"error": "Firma no válida", "order": ds_order, "signatureValid": False}, **echo),
+        401,
     )
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+@profiling.profiled("DecryptAndRedirect")
+@timing.instrumented("DecryptAndRedirect")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("DecryptAndRedirect recibido: procesando notificación RedSys")
 
-    data = parse_request(req)
+    # Un origen que ha agotado su cupo de rechazos se corta antes de parsear nada
+    source = notification_guard.source_address(req.headers)
+    retry_after = notification_guard.throttled(source)
+    if retry_after:
+        return _throttled(retry_after)
+
+    with timing.stage("parse"):
+        data = parse_request(req)
 
     ds_params_b64 = data.get("Ds_MerchantParameters")
     ds_signature = data.get("Ds_Signature")
 
     if not ds_params_b64 or not ds_signature:
-        return func.HttpResponse(
-            json.dumps(
-                {
-                    "error": "Faltan Ds_MerchantParameters o Ds_Signature",
-                    "received": data,
-                },
-                ensure_ascii=False,
-            ),
-            mimetype="application/json",
-            status_code=400,
-        )
+        return _rejected(source, _with_echo({"error": "Faltan Ds_MerchantParameters o Ds_Signature"}, received=data), 400)
 
-    terminal_key = os.environ.get("REDSYS_SHA256_KEY")
-    if not terminal_key:
-        logging.error("Variable de entorno REDSYS_SHA256_KEY no configurada")
-        return func.HttpResponse(
-            json.dumps(
-                {
-                    "error": "Configuración incompleta en servidor",
-                },
-                ensure_ascii=False,
-            ),
-            mimetype="application/json",
-            status_code=500,
-        )
+    # La misma notificación falsificada repetida se rechaza sin decodificarla ni firmarla
+    if notification_guard.known_forgery(ds_params_b64, ds_signature):
+        return _forged_response(source, None)
 
     try:
-        decoded_params_raw = decode_redsys_parameters(ds_params_b64)
-        decoded_params = {
-            key: unquote(value) if isinstance(value, str) else value
-            for key, value in decoded_params_raw.items()
-        }
+        with timing.stage("decode"):
+            decoded_params = decode_notification_parameters(ds_params_b64)
     except Exception as exc:  # pylint: disable=broad-except
-        logging.exception("No se pudo decodificar Ds_MerchantParameters")
-        return func.HttpResponse(
-            json.dumps(
-                {
-                    "error": "Ds_MerchantParameters inválido",
-                    "detail": str(exc),
-                },
-                ensure_ascii=False,
-            ),
-            mimetype="application/json",
-            status_code=400,
-        )
+        logging.warning("No se pudo decodificar Ds_MerchantParameters: %s", exc)
+        return _rejected(source, {"error": "Ds_MerchantParameters inválido", "detail": str(exc)}, 400)
 
     ds_order = decoded_params.get("Ds_Order")
     if not ds_order:
-        return func.HttpResponse(
-            json.dumps(
-                {
-                    "error": "No se encontró Ds_Order en Ds_MerchantParameters",
-                    "decoded": decoded_params,
-                },
-                ensure_ascii=False,
-            ),
-            mimetype="application/json",
-            status_code=400,
+        return _rejected(
+            source,
+            _with_echo({"error": "No se encontró Ds_Order en Ds_MerchantParameters"}, decoded=decoded_params),
+            400,
         )
 
-    entity = get_entity_by_order_code(ds_order)
+    # Cada comercio/terminal registrado tiene su clave; si no, la de REDSYS_SHA256_KEY
+    await merchants.refresh_async()
+    merchant = merchants.lookup(decoded_params.get("Ds_MerchantCode"), decoded_params.get("Ds_Terminal"))
+    # El pedido se busca solo entre los del comercio cuya clave firma la notificación
+    owner = merchants.optional_merchant_key(decoded_params.get("Ds_MerchantCode"), decoded_params.get("Ds_Terminal"))
+    if merchant is not None:
+        signer = merchant.notification_signer
+    else:
+        terminal_key = os.environ.get("REDSYS_SHA256_KEY")
+        if not terminal_key:
+            logging.error("Variable de entorno REDSYS_SHA256_KEY no configurada")
+            return func.HttpResponse(
+                codec.dumps(
+                    {
+                        "error": "Configuración incompleta en servidor",
+                    },
+                ),
+                mimetype="application/json",
+                status_code=500,
+            )
+        signer = get_signer(terminal_key)
+
+    # La firma solo necesita la clave del terminal: se comprueba antes de leer
+    # el ledger o la tabla de pedidos, así una notificación falsa no cuesta E/S
+    with timing.stage("signature"):
+        signature_valid = _signature_matches(signer, ds_params_b64, ds_signature, ds_order)
+    if not signature_valid:
+        logging.warning("Firma no válida en la notificación del pedido %s", ds_order)
+        notification_guard.remember_forgery(ds_params_b64, ds_signature)
+        return _forged_response(source, ds_order, decoded=decoded_params)
+
+    # Reintento de RedSys de una notificación ya entregada: se devuelve el
+    # resultado registrado sin buscar el pedido ni volver a llamar a BC
+    notification = None
+    if idempotency_enabled():
+        notification = fingerprint(ds_order, ds_params_b64)
+        with timing.stage("ledger"):
+            previous_call = await get_processed(notification)
+        if previous_call is not None:
+            logging.info("Notificación del pedido %s ya procesada; se omite la entrega", ds_order)
+            return func.HttpResponse(
+                codec.dumps(
+                    {
+                        "message": "Notificación ya procesada",
+                        "order": ds_order,
+                        "signatureValid": True,
+                        "duplicate": True,
+                        "bcCall": previous_call,
+                    },
+                ),
+                mimetype="application/json",
+                status_code=200,
+            )
+
+    # Los registros sin comercio (anteriores a guardarlo) son de la clave por defecto
+    entity = None
+    if not notification_guard.unknown_order(owner, ds_order):
+        with timing.stage("lookup"):
+            entity = await get_entity_by_order_code(ds_order, owner, accept_untagged=merchant is None)
+        if not entity:
+            notification_guard.remember_unknown_order(owner, ds_order)
     if not entity:
         logging.warning("No se encontró entidad asociada a Ds_Merchant_Order", extra={"Ds_Order": ds_order})
         return func.HttpResponse(
-            json.dumps(
-                {
-                    "error": "Id no registrado",
-                    "decoded": decoded_params,
-                },
-                ensure_ascii=False,
+            codec.dumps(
+                _with_echo(
+                    {"error": "Id no registrado"},
+                    decoded=decoded_params,
+                ),
             ),
             mimetype="application/json",
             status_code=404,
         )
 
-    expected_signature = compute_redsys_signature(
-        merchant_parameters_b64=ds_params_b64,
-        order=ds_order,
-        terminal_key_b64=terminal_key,
-    )
-
-    normalized_signature = ds_signature.replace("-", "+").replace("_", "/")
-    padding = len(normalized_signature) % 4
-    if padding:
-        normalized_signature += "=" * (4 - padding)
+    # Con el circuito de BC abierto la entrega se difiere a la cola aunque el modo sea síncrono
+    bc_unavailable = circuit_open(entity.get("URLBC") or "")
+    if queue_mode_enabled() or bc_unavailable:
+        try:
+            with timing.stage("enqueue"):
+                await enqueue_notification_async(build_message(ds_params_b64, ds_signature, ds_order))
+            if bc_unavailable:
+                logging.warning("Business Central no disponible; notificación del pedido %s diferida a la cola", ds_order)
+            else:
+                logging.info("Notificación del pedido %s encolada para Business Central", ds_order)
+            return func.HttpResponse(
+                codec.dumps(
+                    {
+                        "message": "Notificación recibida",
+                        "order": ds_order,
+                        "signatureValid": True,
+                        "bcCall": {"status": "queued", "circuitOpen": True} if bc_unavailable else {"status": "queued"},
+                    },
+                ),
+                mimetype="application/json",
+                status_code=200,
+            )
+        except Exception:  # pylint: disable=broad-except
+            # Sin cola disponible se entrega en línea como en el modo síncrono (con el
+            # circuito abierto, la entrega falla al momento con 503 y RedSys reintenta)
+            logging.exception("No se pudo encolar la notificación; se entrega en línea")
 
     try:
-        expected_bytes = base64.b64decode(expected_signature)
-        received_bytes = base64.b64decode(normalized_signature)
-        signature_valid = hmac.compare_digest(expected_bytes, received_bytes)
-    except Exception as exc:  # pylint: disable=broad-except
-        logging.exception("Error al normalizar firmas RedSys")
-        signature_valid = False
-
-    bc_call_summary: Dict[str, Any] | None = None
-    if signature_valid:
-        bc_payload = build_bc_payload(decoded_params, ds_signature, ds_order)
-        endpoint_url = entity.get("URLBC", "")
-        base_url, relative_path = split_bc_url(endpoint_url)
-        legacy_path = entity.get("BCPath")
-        if not relative_path and legacy_path:
-            relative_path = legacy_path
-        bc_path = relative_path or legacy_path or ""
-        call_entity = dict(entity)
-        call_entity["URLBC"] = base_url or endpoint_url
-        bc_method = (entity.get("BCMethod") or "POST").upper()
-        if call_entity.get("PassEncrypted") and call_entity.get("Pass") and call_entity.get("EncryptKey"):
-            try:
-                call_entity["Pass"] = decrypt_secret(call_entity["Pass"], call_entity["EncryptKey"])
-            except Exception as exc:
-                logging.exception("No se pudo descifrar las credenciales de Business Central")
-                return func.HttpResponse(
-                    json.dumps(
-                        {
-                            "error": "No se pudieron descifrar las credenciales de Business Central",
-                            "detail": str(exc),
-                        },
-                        ensure_ascii=False,
-                    ),
-                    mimetype="application/json",
-                    status_code=500,
-                )
-        final_url = endpoint_url
-        if relative_path and (base_url or endpoint_url):
-            base_for_summary = base_url or endpoint_url
-            final_url = f"{base_for_summary.rstrip('/')}/{relative_path.lstrip('/')}"
-
-        try:
-            bc_response = call_business_central(
-                call_entity,
-                method=bc_method,
-                relative_path=relative_path,
-                payload=bc_payload,
+        if notification is not None:
+            bc_call_summary, _ = await run_once(
+                notification,
+                lambda: deliver_notification(entity, decoded_params, ds_params_b64, ds_signature, ds_order),
             )
-            bc_status = bc_response.status_code
-            try:
-                bc_content = bc_response.json()
-            except ValueError:
-                bc_content = {"raw": bc_response.text}
-
-            bc_call_summary = {
-                "status": bc_status,
-                "method": bc_method,
-                "url": final_url,
-                "payload": bc_content,
-            }
-            bc_response.raise_for_status()
-
-            if bc_method == "POST" and bc_status < 400:
-                try:
-                    upload_stream_property(
-                        call_entity,
-                        relative_path,
-                        ds_order,
-                        "jsonPayload",
-                        json.dumps(decoded_params, ensure_ascii=False),
-                        "application/json; charset=utf-8",
-                    )
-                except Exception:  # pylint: disable=broad-except
-                    logging.exception("No se pudo subir jsonPayload a Business Central")
-                try:
-                    upload_stream_property(
-                        call_entity,
-                        relative_path,
-                        ds_order,
-                        "rawParameters",
-                        ds_params_b64,
-                        "text/plain; charset=utf-8",
-                    )
-                except Exception:  # pylint: disable=broad-except
-                    logging.exception("No se pudo subir rawParameters a Business Central")
-        except HTTPError as http_error:
-            status_code = http_error.response.status_code if http_error.response else 502
-            body = http_error.response.text if http_error.response else str(http_error)
-            logging.error("Business Central devolvió error %s: %s", status_code, body)
-            bc_call_summary = {
-                "status": status_code,
-                "method": bc_method,
-                "path": bc_path,
-                "error": body,
-                "sentPayload": bc_payload,
-            }
-        except BusinessCentralError as bc_error:
-            logging.error("Error de configuración para Business Central: %s", bc_error)
-            bc_call_summary = {
-                "status": 400,
-                "method": bc_method,
-                "path": bc_path,
-                "error": str(bc_error),
-                "sentPayload": bc_payload,
-            }
-        except Exception as exc:  # pylint: disable=broad-except
-            logging.exception("Error llamando a Business Central desde DecryptAndRedirect")
-            bc_call_summary = {
-                "status": 500,
-                "method": bc_method,
-                "path": bc_path,
-                "error": str(exc),
-                "sentPayload": bc_payload,
-            }
+        else:
+            bc_call_summary = await deliver_notification(entity, decoded_params, ds_params_b64, ds_signature, ds_order)
+    except CredentialsError as exc:
+        return func.HttpResponse(
+            codec.dumps(
+                {
+                    "error": "No se pudieron descifrar las credenciales de Business Central",
+                    "detail": str(exc),
+                },
+            ),
+            mimetype="application/json",
+            status_code=500,
+        )
 
     response: Dict[str, Any] = {
         "message": "Notificación procesada",
         "received": data,
         "decodedParameters": decoded_params,
-        "signatureValid": signature_valid,
+        "signatureValid": True,
         "bcCall": bc_call_summary,
-        "expectedSignature": expected_signature if not signature_valid else None,
     }
 
+    compact = codec.compact_profile()
+    if compact:
+        # Sin eco de la entrada: RedSys ya conoce lo que ha enviado
+        del response["received"], response["decodedParameters"]
+        response["order"] = ds_order
+
     try:
-        logging.info(json.dumps(response, ensure_ascii=False))
-        status_code = 200 if signature_valid else 401
-        if signature_valid and bc_call_summary and bc_call_summary.get("status", 200) >= 400:
+        status_code = 200
+        if bc_call_summary and bc_call_summary.get("status", 200) >= 400:
             status_code = bc_call_summary["status"]
+        body = codec.dumps(response, indent=not compact)
+        if compact:
+            logging.info(
+                "Notificación del pedido %s procesada (BC: %s)",
+                ds_order,
+                (bc_call_summary or {}).get("status"),
+            )
+        else:
+            logging.info(body)
         return func.HttpResponse(
-            json.dumps(response, ensure_ascii=False, indent=2),
+            body,
             mimetype="application/json",
             status_code=status_code,
         )
     except Exception as exc:  # pylint: disable=broad-except
         logging.exception("Error enviando respuesta DecryptAndRedirect")
         return func.HttpResponse(
-            json.dumps(
-                {
-                    "error": str(exc),
-                    "received": data,
-                },
-                ensure_ascii=False,
+            codec.dumps(
+                _with_echo(
+                    {"error": str(exc)},
+                    received=data,
+                ),
             ),
             mimetype="application/json",
             status_code=500,
@@ -0,0 +1,94 @@
+"""Azure Function queue trigger que entrega a Business Central las notificaciones encoladas."""
+
+import json
+import logging
+import random
+
+import azure.functions as func
+
+from utils import merchants
+from utils.bc_client import circuit_open, circuit_retry_after
+from utils.idempotency import fingerprint, get_processed, idempotency_enabled, run_once
+from utils.notification_delivery import (
+    CredentialsError,
+    decode_notification_parameters,
+    deliver_notification,
+    is_retryable,
+)
+from utils.notification_queue import schedule_deferral, schedule_retry, send_to_poison
+from utils.table_storage_sdk import get_entity_by_order_code
+
+
+def main(msg: func.QueueMessage) -> None:
+    try:
+        message = json.loads(msg.get_body().decode("utf-8"))
+        ds_params_b64 = message["merchantParameters"]
+        ds_signature = message["signature"]
+        ds_order = message["order"]
+    except (ValueError, KeyError, TypeError) as exc:
+        logging.error("Mensaje de notificación inválido (%s): %s", msg.id, exc)
+        send_to_poison({"raw": msg.get_body().decode("utf-8", "replace")}, f"Mensaje inválido: {exc}")
+        return
+
+    logging.info("DeliverNotification: entregando pedido %s (intento %s)", ds_order, message.get("attempt", 0) + 1)
+
+    try:
+        decoded_params = decode_notification_parameters(ds_params_b64)
+    except Exception as exc:  # pylint: disable=broad-except
+        # Reintentarlo no lo arregla: va a poison con el motivo en lugar de agotar los reintentos del host
+        logging.error("Ds_MerchantParameters inválido en el mensaje del pedido %s: %s", ds_order, exc)
+        send_to_poison(message, f"Ds_MerchantParameters inválido: {exc}")
+        return
+
+    notification = fingerprint(ds_order, ds_params_b64) if idempotency_enabled() else None
+    if notification is not None and get_processed(notification) is not None:
+        logging.info("Notificación del pedido %s ya entregada; se descarta el mensaje", ds_order)
+        return
+
+    try:
+        # Mismo criterio que DecryptAndRedirect: solo pedidos del comercio de la notificación
+        merchant_code, terminal = decoded_params.get("Ds_MerchantCode"), decoded_params.get("Ds_Terminal")
+        entity = get_entity_by_order_code(
+            ds_order,
+            merchants.optional_merchant_key(merchant_code, terminal),
+            accept_untagged=merchants.lookup(merchant_code, terminal) is None,
+        )
+    except Exception as exc:  # pylint: disable=broad-except
+        # Table Storage no disponible: se trata como fallo transitorio
+        logging.exception("No se pudo consultar la entidad del pedido %s", ds_order)
+        if not schedule_retry(message, {"error": str(exc)}):
+            send_to_poison(message, "Table Storage no disponible", {"error": str(exc)})
+        return
+
+    if not entity:
+        send_to_poison(message, "Id no registrado")
+        return
+
+    if circuit_open(entity.get("URLBC") or ""):
+        # BC no disponible: se aplaza sin gastar un intento hasta que el circuito admita pruebas
+        delay = int(circuit_retry_after(entity.get("URLBC") or "")) + random.randint(1, 15)
+        if not schedule_deferral(message, delay):
+            send_to_poison(message, f"Business Central no disponible tras {message.get('deferrals', 0)} aplazamientos")
+        return
+
+    try:
+        if notification is not None:
+            bc_call_summary, _ = run_once(
+                notification,
+                lambda: deliver_notification(entity, decoded_params, ds_params_b64, ds_signature, ds_order),
+            )
+        else:
+            bc_call_summary = deliver_notification(entity, decoded_params, ds_params_b64, ds_signature, ds_order)
+    except CredentialsError as exc:
+        send_to_poison(message, "No se pudieron descifrar las credenciales de Business Central", {"error": str(exc)})
+        return
+
+    status = bc_call_summary.get("status", 200)
+    if status < 400:
+        logging.info("Pedido %s entregado a Business Central (%s)", ds_order, status)
+        return
+
+    if is_retryable(bc_call_summary) and schedule_retry(message, bc_call_summary):
+        return
+
+    send_to_poison(message, f"Business Central devolvió {status}", bc_call_summary)
@@ -1,21 +1,29 @@
+import asyncio
 import base64
 import json
 import logging
 import os
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import azure.functions as func
 import requests
 
-from utils.crypto import compute_paygold_signature
-from utils.table_storage_sdk import save_to_table
+from utils import codec, http_pool_aio, merchants, profiling, timing
+from utils.crypto import RedsysSigner, compute_paygold_signature
+from utils.env import env_int
+from utils.table_storage_aio import mark_failed, save_entity, save_many_to_table, save_to_table
+from utils.table_storage_sdk import build_log_entity
 
 DEFAULT_REST_TEST_URL = "https://sis-t.redsys.es:25443/sis/rest/trataPeticionREST"
+DEFAULT_BULK_CONCURRENCY = 8
+DEFAULT_BULK_MAX_ORDERS = 500
+DEFAULT_TABLE_WRITE_ATTEMPTS = 3
+TABLE_WRITE_BACKOFF_SECONDS = 0.2
 
 
 def _load_body(req: func.HttpRequest) -> Dict[str, Any]:
     try:
-        return req.get_json()
+        return codec.loads(req.get_body())
     except ValueError as exc:
         raise ValueError("El cuerpo debe ser un JSON válido") from exc
 
@@ -66,9 +74,12 @@ def _resolve_config(payload: Dict[str, Any], merchant_parameters: Dict[str, Any]
         or merchant_parameters.get("DS_MERCHANT_TERMINAL")
         or os.environ.get("REDSYS_TERMINAL")
     )
+    # Los valores del comercio registrado tienen prioridad sobre las variables de entorno
+    merchant = merchants.lookup(merchant_code, terminal)
     currency = (
         payload.get("currency")
         or merchant_parameters.get("DS_MERCHANT_CURRENCY")
+        or (merchant.currency if merchant else None)
         or os.environ.get("REDSYS_CURRENCY")
         or os.environ.get("PAYGOLD_CURRENCY")
         or "978"
@@ -76,12 +87,14 @@ def _resolve_config(payload: Dict[str, Any], merchant_parameters: Dict[str, Any]
     secret_key = (
         payload.get("encryptKey")
         or payload.get("secretKey")
+        or (merchant.secret_key if merchant else None)
         or os.environ.get("PAYGOLD_SHA256_KEY")
         or os.environ.get("REDSYS_SHA256_KEY")
     )
     rest_url = (
         payload.get("redirectURL")
         or payload.get("restUrl")
+        or (merchant.rest_url if merchant else None)
         or os.environ.get("PAYGOLD_REST_URL")
         or os.environ.get("REDSYS_REST_URL")
         or DEFAULT_REST_TEST_URL
@@ -194,19 +207,23 @@ def _build_merchant_parameters(
 def _encode_parameters(merchant_parameters: Dict[str, str]) -> str:
     # Ordenar las claves para garantizar consistencia (RedSys puede ser estricto con el formato)
     sorted_params = dict(sorted(merchant_parameters.items()))
-    serialized = json.dumps(sorted_params, separators=(",", ":"), ensure_ascii=False)
-    return base64.b64encode(serialized.encode("utf-8")).decode("utf-8")
+    return base64.b64encode(codec.dumps_bytes(sorted_params)).decode("utf-8")
 
 
 def _build_request_payload(
     merchant_parameters: Dict[str, str],
     merchant_parameters_b64: str,
     secret_key_b64: str,
+    signer: Optional[RedsysSigner] = None,
 ) -> Dict[str, str]:
     order = merchant_parameters.get("DS_MERCHANT_ORDER")
     if not order:
         raise ValueError("Missing field 'DS_MERCHANT_ORDER' para firmar la petición.")
-    signature = compute_paygold_signature(merchant_parameters_b64, order, secret_key_b64)
+    with timing.stage("sign"):
+        if signer is not None:
+            signature = signer.sign(merchant_parameters_b64, order)
+        else:
+            signature = compute_paygold_signature(merchant_parameters_b64, order, secret_key_b64)
     return {
         "Ds_MerchantParameters": merchant_parameters_b64,
         "Ds_SignatureVersion": "HMAC_SHA256_V1",
@@ -214,9 +231,9 @@ def _build_request_payload(
     }
 
 
-def _send_request(rest_url: str, payload: Dict[str, str], timeout: Optional[float]) -> Dict[str, Any]:
+async def _send_request(rest_url: str, payload: Dict[str, str], timeout: Optional[float]) -> Dict[str, Any]:
     headers = {"Content-Type": "application/json"}
-    response = requests.post(rest_url, headers=headers, json=payload, timeout=timeout or 30)
+    response = await http_pool_aio.post(rest_url, headers=headers, data=codec.dumps_bytes(payload), timeout=timeout)
     response.raise_for_status()
 
     try:
@@ -225,86 +242,366 @@ def _send_request(rest_url: str, payload: Dict[str, str], timeout: Optional[floa
         return {"raw": response.text}
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
-    logging.info("PaygoldLink: procesando solicitud para generar Paygold")
+def _prepare_order(body: Dict[str, Any], state: Dict[str, Any]) -> None:
+    """Valida un pedido, compone sus parámetros y los firma.
+
+    Rellena `state` a medida que avanza (`seed`, `config`, `merchantParameters`,
+    `merchantParametersB64`, `requestPayload`, `order`), de modo que si falla
+    quien llama puede registrar el error con lo que se haya podido resolver.
+    """
+    encrypt_data = _normalize_encrypt_data(body.get("encryptData"))
+    state["seed"] = _collect_seed_parameters(body, encrypt_data)
+
+    parameter_payload = dict(body)
+    if state["seed"]:
+        parameter_payload["merchantParameters"] = state["seed"]
+    elif encrypt_data:
+        parameter_payload["merchantParameters"] = encrypt_data
+
+    state["config"] = _resolve_config(body, parameter_payload.get("merchantParameters") or {})
+    state["merchantParameters"] = _build_merchant_parameters(parameter_payload, state["config"])
+
+    auth_type = body.get("authType")
+    if not body.get("urlBC"):
+        raise ValueError("Missing field 'urlBC'")
+    if not auth_type:
+        raise ValueError("Missing field 'authType'")
+    if auth_type not in ("Basic", "oAuth"):
+        raise ValueError("Invalid 'authType'. Debe ser 'Basic' u 'oAuth'")
+    if not body.get("user"):
+        raise ValueError("Missing field 'user'")
+    if not body.get("pass"):
+        raise ValueError("Missing field 'pass'")
+
+    config = state["config"]
+    merchant = merchants.lookup(config["merchantCode"], config["terminal"])
+    state["merchantParametersB64"] = _encode_parameters(state["merchantParameters"])
+    state["requestPayload"] = _build_request_payload(
+        state["merchantParameters"],
+        state["merchantParametersB64"],
+        config["secretKey"],
+        # Firmador ya preparado del registro, salvo que la petición traiga otra clave
+        merchant.paygold_signer if merchant is not None and merchant.secret_key == config["secretKey"] else None,
+    )
+    state["order"] = state["merchantParameters"].get("DS_MERCHANT_ORDER")
 
-    body: Dict[str, Any] = {}
-    merchant_parameters_seed: Dict[str, Any] = {}
-    merchant_parameters: Dict[str, str] = {}
-    config: Dict[str, str] = {}
-    entity_id: Optional[str] = None
 
+def _table_fields(body: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+    """Argumentos de `save_to_table` para un pedido ya preparado."""
+    return {
+        "url_bc": body.get("urlBC"),
+        "auth_type": body.get("authType"),
+        "user": body.get("user"),
+        "password": body.get("pass"),
+        "encrypt_type": body.get("encryptType", "SHA-256"),
+        "encrypt_key": state["config"]["secretKey"],
+        "ds_merchant_order": state["order"],
+        "redirect_url": state["config"]["restUrl"],
+        "merchant_code": state["config"]["merchantCode"],
+        "terminal": state["config"]["terminal"],
+    }
+
+
+def _error_table_fields(body: Dict[str, Any], state: Dict[str, Any], error: str) -> Optional[Dict[str, Any]]:
+    """Argumentos de `save_to_table` para registrar un pedido fallido, si hay datos suficientes."""
+    config = state.get("config") or {}
+    encrypt_key = (
+        config.get("secretKey")
+        or body.get("encryptKey")
+        or os.environ.get("PAYGOLD_SHA256_KEY")
+        or os.environ.get("REDSYS_SHA256_KEY")
+    )
+    fields = {
+        "url_bc": body.get("urlBC"),
+        "auth_type": body.get("authType"),
+        "user": body.get("user"),
+        "password": body.get("pass"),
+        "encrypt_type": body.get("encryptType", "SHA-256"),
+        "encrypt_key": encrypt_key,
+        "ds_merchant_order": (state.get("merchantParameters") or {}).get("DS_MERCHANT_ORDER")
+        or (state.get("seed") or {}).get("DS_MERCHANT_ORDER"),
+        "redirect_url": config.get("restUrl"),
+        "error": error,
+        "merchant_code": config.get("merchantCode"),
+        "terminal": config.get("terminal"),
+    }
+    if all(fields[name] for name in ("url_bc", "auth_type", "user", "password", "encrypt_key")):
+        return fields
+    return None
+
+
+def _timeout_seconds(body: Dict[str, Any]) -> Optional[float]:
+    timeout_value = body.get("timeout")
+    if isinstance(timeout_value, (int, float)):
+        return float(timeout_value)
+    return None
+
+
+def _pipeline_enabled() -> bool:
+    return os.environ.get("PAYGOLD_PIPELINE", "false").lower() in ("true", "1", "yes")
+
+
+async def _persist_with_retries(entity: Dict[str, Any]) -> bool:
+    """Guarda el registro del pedido, reintentando con backoff si falla."""
+    attempts = max(1, env_int("PAYGOLD_TABLE_WRITE_ATTEMPTS", DEFAULT_TABLE_WRITE_ATTEMPTS))
+    with timing.stage("table_write"):
+        for attempt in range(1, attempts + 1):
+            if await save_entity(entity):
+                return True
+            if attempt < attempts:
+                logging.warning(
+                    "PaygoldLink: no se pudo guardar el pedido %s (intento %s de %s); se reintenta",
+                    entity.get("Ds_Merchant_Order"),
+                    attempt,
+                    attempts,
+                )
+                await asyncio.sleep(TABLE_WRITE_BACKOFF_SECONDS * 2 ** (attempt - 1))
+    return False
+
+
+async def _save_and_send(body: Dict[str, Any], state: Dict[str, Any], entity: Dict[str, Any]) -> Dict[str, Any]:
+    """Guarda el registro del pedido y llama a RedSys a la vez (`PAYGOLD_PIPELINE=true`).
+
+    La respuesta tarda lo que la más lenta de las dos operaciones y no su suma.
+    Si RedSys falla, el registro ya guardado se marca como fallido y se retira
+    del índice de pedidos. Si la escritura falla, se reintenta
+    (`PAYGOLD_TABLE_WRITE_ATTEMPTS`) y, si no se consigue, la petición termina
+    con error aunque RedSys haya respondido. Deja `state["entityId"]` cuando el
+    registro queda guardado.
+    """
+    save = asyncio.create_task(_persist_with_retries(entity))
     try:
-        body = _load_body(req)
-        encrypt_data = _normalize_encrypt_data(body.get("encryptData"))
-        merchant_parameters_seed = _collect_seed_parameters(body, encrypt_data)
-
-        parameter_payload = dict(body)
-        if merchant_parameters_seed:
-            parameter_payload["merchantParameters"] = merchant_parameters_seed
-        elif encrypt_data:
-            parameter_payload["merchantParameters"] = encrypt_data
-
-        config = _resolve_config(body, parameter_payload.get("merchantParameters") or {})
-        merchant_parameters = _build_merchant_parameters(parameter_payload, config)
-
-        url_bc = body.get("urlBC")
-        auth_type = body.get("authType")
-        user = body.get("user")
-        password = body.get("pass")
-        encrypt_type = body.get("encryptType", "SHA-256")
-        redirect_url = config["restUrl"]
-
-        if not url_bc:
-            raise ValueError("Missing field 'urlBC'")
-        if not auth_type:
-            raise ValueError("Missing field 'authType'")
-        if auth_type not in ("Basic", "oAuth"):
-            raise ValueError("Invalid 'authType'. Debe ser 'Basic' u 'oAuth'")
-        if not user:
-            raise ValueError("Missing field 'user'")
-        if not password:
-            raise ValueError("Missing field 'pass'")
-
-        merchant_parameters_b64 = _encode_parameters(merchant_parameters)
-        request_payload = _build_request_payload(merchant_parameters, merchant_parameters_b64, config["secretKey"])
-
-        ds_order = merchant_parameters.get("DS_MERCHANT_ORDER")
-
-        entity_id = save_to_table(
-            url_bc=url_bc,
-            auth_type=auth_type,
-            user=user,
-            password=password,
-            encrypt_type=encrypt_type,
-            encrypt_key=config["secretKey"],
-            ds_merchant_order=ds_order,
-            redirect_url=redirect_url,
+        with timing.stage("redsys_request"):
+            rest_response = await _send_request(
+                state["config"]["restUrl"], state["requestPayload"], _timeout_seconds(body)
+            )
+    except Exception as exc:
+        # RedSys no ha generado el pedido: su registro no debe resolver notificaciones
+        if await save:
+            state["entityId"] = entity["Id"]
+            await mark_failed(entity, f"Error en la llamada a RedSys: {str(exc) or type(exc).__name__}")
+        raise
+
+    if not await save:
+        logging.error(
+            "PaygoldLink: RedSys aceptó el pedido %s pero no se pudo guardar su configuración; respuesta: %s",
+            state["order"],
+            codec.dumps(rest_response),
         )
-        if not entity_id:
-            raise RuntimeError("No se pudo persistir la configuración en Table Storage")
+        raise RuntimeError("No se pudo persistir la configuración en Table Storage")
+    state["entityId"] = entity["Id"]
+    return rest_response
 
+
+def _log_dispatch(state: Dict[str, Any], entity_id: str, compact: bool) -> None:
+    if compact:
         logging.info(
-            "PaygoldLink debug: %s",
-            json.dumps(
-                {
-                    "order": ds_order,
-                    "entityId": entity_id,
-                    "restUrl": redirect_url,
-                    "merchantParameters": merchant_parameters,
-                    "merchantParametersB64": merchant_parameters_b64,
-                    "signature": request_payload["Ds_Signature"],
-                },
-                ensure_ascii=False,
+            "PaygoldLink: pedido %s (%s), enviando a %s", state["order"], entity_id, state["config"]["restUrl"]
+        )
+        return
+    logging.info(
+        "PaygoldLink debug: %s",
+        codec.dumps(
+            {
+                "order": state["order"],
+                "entityId": entity_id,
+                "restUrl": state["config"]["restUrl"],
+                "merchantParameters": state["merchantParameters"],
+                "merchantParametersB64": state["merchantParametersB64"],
+                "signature": state["requestPayload"]["Ds_Signature"],
+            },
+        ),
+    )
+
+
+def _is_bulk(body: Any) -> bool:
+    return isinstance(body, list) or (isinstance(body, dict) and isinstance(body.get("orders"), list))
+
+
+def _split_bulk_body(body: Any) -> Tuple[Dict[str, Any], List[Any]]:
+    """Separa los campos comunes de la lista de pedidos de una petición masiva."""
+    if isinstance(body, list):
+        return {}, body
+    shared = {key: value for key, value in body.items() if key != "orders"}
+    return shared, body["orders"]
+
+
+async def _send_bulk_order(
+    position: int,
+    order_body: Dict[str, Any],
+    state: Dict[str, Any],
+    entity_id: str,
+    semaphore: asyncio.Semaphore,
+) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"index": position, "order": state["order"], "entityId": entity_id}
+    try:
+        async with semaphore:
+            rest_response = await _send_request(
+                state["config"]["restUrl"], state["requestPayload"], _timeout_seconds(order_body)
+            )
+        result.update({"status": "ok", "response": rest_response})
+    except requests.HTTPError as http_error:
+        response = http_error.response
+        result.update(
+            {
+                "status": "error",
+                "error": "La API de RedSys devolvió un error",
+                "httpStatus": response.status_code if response is not None else 502,
+                "detail": response.text if response is not None else str(http_error),
+            }
+        )
+    except Exception as exc:  # pylint: disable=broad-except
+        result.update({"status": "error", "error": str(exc)})
+    return result
+
+
+async def _handle_bulk(body: Any) -> func.HttpResponse:
+    """Genera varios Paygold en una sola petición.
+
+    Acepta una lista de pedidos o `{"orders": [...], ...}`; los campos comunes
+    se combinan con los de cada pedido (prevalecen los del pedido). Se preparan
+    y firman todos, se guardan en Table Storage por transacciones y se llama a
+    RedSys con concurrencia limitada (`PAYGOLD_BULK_CONCURRENCY`). Un pedido
+    fallido no afecta al resto: la respuesta incluye el resultado de cada uno.
+    Un pedido repetido en la misma petición (mismo comercio, terminal y
+    DS_MERCHANT_ORDER) se rechaza con 400: solo se guarda y envía el primero.
+    """
+    shared, orders = _split_bulk_body(body)
+    max_orders = env_int("PAYGOLD_BULK_MAX_ORDERS", DEFAULT_BULK_MAX_ORDERS)
+    if not orders or len(orders) > max_orders:
+        return func.HttpResponse(
+            codec.dumps(
+                {"error": f"'orders' debe contener entre 1 y {max_orders} pedidos"},
             ),
+            mimetype="application/json",
+            status_code=400,
         )
 
-        timeout_value = body.get("timeout")
-        timeout_seconds: Optional[float] = None
-        if isinstance(timeout_value, (int, float)):
-            timeout_seconds = float(timeout_value)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(orders)
+    prepared: List[Tuple[int, Dict[str, Any], Dict[str, Any], Dict[str, Any]]] = []
+    error_entities: List[Dict[str, Any]] = []
+    # (comercio, terminal, pedido) -> posición de su primera aparición
+    first_positions: Dict[Tuple[merchants.MerchantKey, str], int] = {}
 
-        rest_response = _send_request(redirect_url, request_payload, timeout_seconds)
+    for position, order in enumerate(orders):
+        state: Dict[str, Any] = {}
+        order_body: Dict[str, Any] = {}
+        try:
+            if not isinstance(order, dict):
+                raise ValueError("Cada pedido debe ser un objeto JSON")
+            order_body = {**shared, **order}
+            _prepare_order(order_body, state)
+            config = state["config"]
+            order_key = (merchants.merchant_key(config["merchantCode"], config["terminal"]), state["order"])
+            first_position = first_positions.setdefault(order_key, position)
+            if first_position != position:
+                logging.warning(
+                    "PaygoldLink masivo: pedido %s repetido en las posiciones %s y %s",
+                    state["order"],
+                    first_position,
+                    position,
+                )
+                results[position] = {
+                    "index": position,
+                    "order": state["order"],
+                    "status": "error",
+                    "httpStatus": 400,
+                    "error": f"Pedido repetido en la petición (ya figura en la posición {first_position})",
+                }
+                continue
+            entity = build_log_entity(**_table_fields(order_body, state))
+            prepared.append((position, order_body, state, entity))
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.warning("PaygoldLink masivo: pedido %s inválido: %s", position, exc)
+            results[position] = {
+                "index": position,
+                "order": state.get("order") or (state.get("seed") or {}).get("DS_MERCHANT_ORDER"),
+                "status": "error",
+                "error": str(exc),
+            }
+            try:
+                error_fields = _error_table_fields(order_body, state, str(exc)) if order_body else None
+                if error_fields:
+                    error_entities.append(build_log_entity(**error_fields))
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("No se pudo preparar el registro de error del pedido %s", position)
+
+    with timing.stage("table_write"):
+        saved_ids = await save_many_to_table([entity for *_, entity in prepared] + error_entities)
+
+    to_send = []
+    for position, order_body, state, entity in prepared:
+        if entity["Id"] in saved_ids:
+            to_send.append((position, order_body, state, entity["Id"]))
+        else:
+            results[position] = {
+                "index": position,
+                "order": state["order"],
+                "status": "error",
+                "error": "No se pudo persistir la configuración en Table Storage",
+            }
+
+    if to_send:
+        concurrency = max(1, min(env_int("PAYGOLD_BULK_CONCURRENCY", DEFAULT_BULK_CONCURRENCY), len(to_send)))
+        semaphore = asyncio.Semaphore(concurrency)
+        with timing.stage("redsys_request"):
+            for result in await asyncio.gather(*(_send_bulk_order(*item, semaphore) for item in to_send)):
+                results[result["index"]] = result
+
+    succeeded = sum(1 for result in results if result and result["status"] == "ok")
+    logging.info("PaygoldLink masivo: %s de %s pedidos generados", succeeded, len(orders))
+    return func.HttpResponse(
+        codec.dumps(
+            {
+                "message": "Paygold masivo procesado",
+                "total": len(orders),
+                "succeeded": succeeded,
+                "failed": len(orders) - succeeded,
+                "results": results,
+            },
+            indent=not codec.compact_profile(),
+        ),
+        mimetype="application/json",
+        status_code=200 if succeeded == len(orders) else 207,
+    )
+
+
+@profiling.profiled("PaygoldLink")
+@timing.instrumented("PaygoldLink")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info("PaygoldLink: procesando solicitud para generar Paygold")
+
+    body: Dict[str, Any] = {}
+    state: Dict[str, Any] = {}
+    entity_id: Optional[str] = None
+
+    try:
+        with timing.stage("parse"):
+            body = _load_body(req)
+        await merchants.refresh_async()
+        if _is_bulk(body):
+            return await _handle_bulk(body)
+        with timing.stage("build"):
+            _prepare_order(body, state)
+
+        merchant_parameters = state["merchantParameters"]
+        merchant_parameters_b64 = state["merchantParametersB64"]
+        redirect_url = state["config"]["restUrl"]
+        compact = codec.compact_profile()
+
+        if _pipeline_enabled():
+            entity = build_log_entity(**_table_fields(body, state))
+            _log_dispatch(state, entity["Id"], compact)
+            rest_response = await _save_and_send(body, state, entity)
+            entity_id = entity["Id"]
+        else:
+            with timing.stage("table_write"):
+                entity_id = await save_to_table(**_table_fields(body, state))
+            if not entity_id:
+                raise RuntimeError("No se pudo persistir la configuración en Table Storage")
+            _log_dispatch(state, entity_id, compact)
+            with timing.stage("redsys_request"):
+                rest_response = await _send_request(redirect_url, state["requestPayload"], _timeout_seconds(body))
 
         result = {
             "message": "Paygold generado correctamente",
@@ -316,69 +613,52 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             },
             "response": rest_response,
         }
+        if compact:
+            # Los mismos parámetros ya van en claro en merchantParameters
+            del result["request"]["merchantParametersB64"]
 
         return func.HttpResponse(
-            json.dumps(result, ensure_ascii=False, indent=2),
+            codec.dumps(result, indent=not compact),
             mimetype="application/json",
             status_code=200,
         )
     except requests.HTTPError as http_error:
-        status_code = http_error.response.status_code if http_error.response else 502
-        content = http_error.response.text if http_error.response else str(http_error)
+        entity_id = entity_id or state.get("entityId")
+        # Una Response con 4xx/5xx es falsa en un if: hay que comparar con None
+        response = http_error.response
+        status_code = response.status_code if response is not None else 502
+        content = response.text if response is not None else str(http_error)
         logging.exception("Error HTTP al llamar a Paygold")
         return func.HttpResponse(
-            json.dumps(
+            codec.dumps(
                 {
                     "error": "La API de RedSys devolvió un error",
                     "detail": content,
                     "status": status_code,
                     "entityId": entity_id,
                 },
-                ensure_ascii=False,
             ),
             mimetype="application/json",
             status_code=status_code,
         )
     except Exception as exc:  # pylint: disable=broad-except
         logging.exception("Error generando Paygold")
+        entity_id = entity_id or state.get("entityId")
         try:
             if not entity_id and body:
-                url_bc = body.get("urlBC")
-                auth_type = body.get("authType")
-                user = body.get("user")
-                password = body.get("pass")
-                encrypt_type = body.get("encryptType", "SHA-256")
-                encrypt_key = (
-                    (config or {}).get("secretKey")
-                    or body.get("encryptKey")
-                    or os.environ.get("PAYGOLD_SHA256_KEY")
-                    or os.environ.get("REDSYS_SHA256_KEY")
-                )
-                if url_bc and auth_type and user and password and encrypt_key:
-                    save_to_table(
-                        url_bc=url_bc,
-                        auth_type=auth_type,
-                        user=user,
-                        password=password,
-                        encrypt_type=encrypt_type,
-                        encrypt_key=encrypt_key,
-                        ds_merchant_order=(merchant_parameters or {}).get("DS_MERCHANT_ORDER")
-                        or merchant_parameters_seed.get("DS_MERCHANT_ORDER"),
-                        redirect_url=(config or {}).get("restUrl"),
-                        error=str(exc),
-                    )
+                error_fields = _error_table_fields(body, state, str(exc))
+                if error_fields:
+                    await save_to_table(**error_fields)
         except Exception:  # pylint: disable=broad-except
             logging.exception("No se pudo registrar el error en Table Storage")
 
         return func.HttpResponse(
-            json.dumps(
+            codec.dumps(
                 {
                     "error": str(exc),
                     "entityId": entity_id,
                 },
-                ensure_ascii=False,
             ),
             mimetype="application/json",
             status_code=400,
         )
-
@@ -0,0 +1,16 @@
+"""Azure Function timer trigger que aplica la retención de EncryptDataLogs (ver `utils.retention`)."""
+
+import logging
+
+import azure.functions as func
+
+from utils import codec
+from utils.retention import run_retention
+
+
+def main(timer: func.TimerRequest) -> None:
+    if timer.past_due:
+        logging.warning("PurgeEncryptDataLogs se ejecuta con retraso")
+
+    state = run_retention()
+    logging.info("PurgeEncryptDataLogs: %s", codec.dumps(state))
@@ -0,0 +1,15 @@
+"""Azure Function warmup trigger: prepara cada instancia nueva antes de recibir tráfico (ver `utils.warmup`)."""
+
+import logging
+
+import azure.functions as func
+
+from utils import codec
+from utils.warmup import warm_up
+
+
+async def main(warmupContext: func.Context) -> None:  # pylint: disable=invalid-name,unused-argument
+    # async: los clientes asíncronos quedan ligados al bucle de eventos en el que
+    # se crean, que es el mismo que usan DecryptAndRedirect y PaygoldLink
+    state = await warm_up()
+    logging.info("Warmup: %s", codec.dumps(state))
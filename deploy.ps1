@@ -10,6 +10,30 @@ Write-Host "   Function App: $FunctionAppName" -ForegroundColor Gray
 Write-Host "   Resource Group: $ResourceGroup" -ForegroundColor Gray
 Write-Host ""
 
+# Paso 0 (opcional): Comprobar regresiones de rendimiento
+if ($env:BENCH_BASELINE) {
+    Write-Host "Comparando benchmarks con $env:BENCH_BASELINE..." -ForegroundColor Yellow
+    $benchCurrent = [System.IO.Path]::GetTempFileName()
+    python tools/benchmark.py run --output $benchCurrent | Out-Null
+    python tools/benchmark.py compare $env:BENCH_BASELINE $benchCurrent
+    if ($LASTEXITCODE -ne 0) {
+        Write-Host "   Regresion de rendimiento detectada; despliegue cancelado" -ForegroundColor Red
+        exit 1
+    }
+    Write-Host "   Sin regresiones de rendimiento" -ForegroundColor Green
+    Write-Host ""
+}
+
+if ($env:IMPORT_BUDGET_MS) {
+    Write-Host "Comprobando el tiempo de importacion de las funciones (presupuesto $env:IMPORT_BUDGET_MS ms)..." -ForegroundColor Yellow
+    python tools/import_budget.py --top 0
+    if ($LASTEXITCODE -ne 0) {
+        Write-Host "   Alguna funcion supera el presupuesto de importacion; despliegue cancelado" -ForegroundColor Red
+        exit 1
+    }
+    Write-Host ""
+}
+
 # Paso 1: Limpiar archivos locales de Python
 Write-Host "Limpiando archivos locales de Python..." -ForegroundColor Yellow
 Remove-Item -Recurse -Force .python_packages -ErrorAction SilentlyContinue
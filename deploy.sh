@@ -11,6 +11,28 @@ echo "   Function App: $FUNCTION_APP_NAME"
 echo "   Resource Group: $RESOURCE_GROUP"
 echo ""
 
+# Paso 0 (opcional): Comprobar regresiones de rendimiento
+if [ -n "$BENCH_BASELINE" ]; then
+    echo "⏱️  Comparando benchmarks con $BENCH_BASELINE..."
+    BENCH_CURRENT=$(mktemp)
+    python tools/benchmark.py run --output "$BENCH_CURRENT" > /dev/null
+    if ! python tools/benchmark.py compare "$BENCH_BASELINE" "$BENCH_CURRENT"; then
+        echo "   ❌ Regresión de rendimiento detectada; despliegue cancelado"
+        exit 1
+    fi
+    echo "   ✅ Sin regresiones de rendimiento"
+    echo ""
+fi
+
+if [ -n "$IMPORT_BUDGET_MS" ]; then
+    echo "⏱️  Comprobando el tiempo de importación de las funciones (presupuesto ${IMPORT_BUDGET_MS} ms)..."
+    if ! python tools/import_budget.py --top 0; then
+        echo "   ❌ Alguna función supera el presupuesto de importación; despliegue cancelado"
+        exit 1
+    fi
+    echo ""
+fi
+
 # Paso 1: Limpiar archivos locales de Python
 echo "🧹 Limpiando archivos locales de Python..."
 rm -rf .python_packages
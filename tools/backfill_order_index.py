@@ -0,0 +1,110 @@
+"""Rellena la tabla índice de pedidos a partir de los registros de EncryptDataLogs.
+
+Uso:
+    python tools/backfill_order_index.py [--dry-run] [--from-partition YYYY-MM-DD]
+
+Necesita `AzureWebJobsStorage` en el entorno. Recorre EncryptDataLogs por
+particiones en orden ascendente, de modo que el registro más reciente de cada
+pedido es el que queda indexado. Los registros antiguos sin `Ds_Merchant_Order`
+se indexan por su `Id`, que es el código que usaban las notificaciones.
+
+Las entradas se reemplazan enteras: volver a ejecutarlo limpia los campos
+(credenciales incluidas) que copiaban las versiones anteriores del índice.
+"""
+
+import argparse
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from utils.table_storage_sdk import (  # noqa: E402
+    INDEX_WRITE_MODE,
+    ORDER_INDEX_TABLE_NAME,
+    build_order_index_entity,
+    get_table_client,
+)
+
+BATCH_SIZE = 100
+
+
+def _index_candidates(entities: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+    # Dentro de una misma partición gana la fila con Timestamp más reciente
+    latest: Dict[str, Dict[str, Any]] = {}
+    current_partition = None
+
+    for entity in entities:
+        if entity.get("Error"):
+            continue
+        order_code = entity.get("Ds_Merchant_Order") or entity.get("Id")
+        if not order_code:
+            continue
+        if entity["PartitionKey"] != current_partition:
+            yield from (build_order_index_entity(code, row) for code, row in latest.items())
+            latest = {}
+            current_partition = entity["PartitionKey"]
+        previous = latest.get(order_code)
+        if previous is None or _timestamp(entity) >= _timestamp(previous):
+            latest[order_code] = entity
+
+    yield from (build_order_index_entity(code, row) for code, row in latest.items())
+
+
+def _timestamp(entity: Dict[str, Any]):
+    metadata = getattr(entity, "metadata", None) or {}
+    return str(metadata.get("timestamp") or entity.get("Timestamp") or "")
+
+
+def _flush(index_client, pending: Dict[str, List[Dict[str, Any]]], dry_run: bool) -> int:
+    written = 0
+    for partition_key, rows in pending.items():
+        for start in range(0, len(rows), BATCH_SIZE):
+            chunk = rows[start:start + BATCH_SIZE]
+            if not dry_run:
+                index_client.submit_transaction([("upsert", row, {"mode": INDEX_WRITE_MODE}) for row in chunk])
+            written += len(chunk)
+    pending.clear()
+    return written
+
+
+def backfill(dry_run: bool = False, from_partition: str | None = None) -> int:
+    log_client = get_table_client()
+    index_client = get_table_client(ORDER_INDEX_TABLE_NAME)
+
+    if from_partition:
+        entities = log_client.query_entities("PartitionKey ge @start", parameters={"start": from_partition})
+    else:
+        entities = log_client.list_entities()
+
+    # Una transacción solo admite entidades de la misma partición y sin RowKey repetidos
+    pending: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    pending_keys: Dict[str, int] = {}
+    written = 0
+    for index_entity in _index_candidates(entities):
+        key = f"{index_entity['PartitionKey']}|{index_entity['RowKey']}"
+        rows = pending[index_entity["PartitionKey"]]
+        if key in pending_keys:
+            rows[pending_keys[key]] = index_entity
+            continue
+        pending_keys[key] = len(rows)
+        rows.append(index_entity)
+        if len(pending_keys) >= BATCH_SIZE * 50:
+            written += _flush(index_client, pending, dry_run)
+            pending_keys.clear()
+            print(f"Indexados {written} pedidos...")
+
+    written += _flush(index_client, pending, dry_run)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="No escribe, solo cuenta los pedidos a indexar")
+    parser.add_argument("--from-partition", help="Partición (YYYY-MM-DD) desde la que empezar")
+    args = parser.parse_args()
+
+    total = backfill(dry_run=args.dry_run, from_partition=args.from_partition)
+    action = "se indexarían" if args.dry_run else "indexados"
+    print(f"Total: {total} pedidos {action}.")
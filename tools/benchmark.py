@@ -0,0 +1,303 @@
+"""Micro-benchmarks de las rutas calientes (firma, codificación y parseo).
+
+Uso:
+    python tools/benchmark.py run [--output bench.json] [--repeat 5] [--filter crypto]
+    python tools/benchmark.py compare <baseline.json> <actual.json> [--threshold 0.15]
+    python tools/benchmark.py lookups [--rows 1000000] [--backend memory,sqlite] [--output lookups.json]
+
+`run` mide cada caso con `timeit` y escribe un JSON con la mediana y el mínimo
+en microsegundos por operación. `compare` termina con código 1 si algún caso es
+más lento que la referencia por encima del umbral (15 % por defecto), de modo
+que `deploy.sh` puede abortar el despliegue (ver `BENCH_BASELINE`).
+
+`lookups` carga `--rows` registros en los backends locales de tablas
+(`utils.table_backends`) y mide `get_entity_by_order_code` por el índice de
+pedidos y por las consultas de compatibilidad sobre EncryptDataLogs.
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import statistics
+import sys
+import timeit
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+TERMINAL_KEY = base64.b64encode(b"benchmark-terminal-key-24").decode("utf-8")
+PAYGOLD_KEY = "sq7HjrUOBfKmC576ILgskD5srU870gJ7"
+ORDER = "1234ABCD5678"
+# Comercio/terminal de los pedidos sembrados (el índice se busca por comercio, terminal y pedido)
+OWNER = ("263100000", "49")
+BC_URL = (
+    "https://api.businesscentral.dynamics.com/v2.0/tenant-id/Production/"
+    "api/galarux/redsys/v1.0/companies(00000000-0000-0000-0000-000000000000)/notifications"
+)
+
+NOTIFICATION_PARAMETERS = {
+    "Ds_Date": "09%2F11%2F2025",
+    "Ds_Hour": "21%3A30",
+    "Ds_SecurePayment": "1",
+    "Ds_Card_Country": "724",
+    "Ds_Amount": "900",
+    "Ds_Currency": "978",
+    "Ds_Order": ORDER,
+    "Ds_MerchantCode": "263100000",
+    "Ds_Terminal": "049",
+    "Ds_Response": "0000",
+    "Ds_MerchantData": "",
+    "Ds_TransactionType": "38",
+    "Ds_ConsumerLanguage": "1",
+    "Ds_AuthorisationCode": "333982",
+    "Ds_Card_Brand": "1",
+    "Ds_Card_Typology": "CONSUMO",
+    "Ds_ProcessedPayMethod": "78",
+    "Ds_Titular": "Daniel",
+}
+
+PAYGOLD_BODY = {
+    "urlBC": BC_URL,
+    "authType": "oAuth",
+    "user": "client-id",
+    "pass": "client-secret",
+    "amount": "1250",
+    "order": ORDER,
+    "productDescription": "Factura FV-000123",
+    "titular": "Cliente de prueba",
+    "paygold": True,
+    "extraParameters": {"DS_MERCHANT_CUSTOMER_MAIL": "cliente@example.com"},
+}
+PAYGOLD_CONFIG = {
+    "merchantCode": "263100000",
+    "terminal": "49",
+    "currency": "978",
+    "secretKey": PAYGOLD_KEY,
+    "restUrl": "https://sis-t.redsys.es:25443/sis/rest/trataPeticionREST",
+}
+
+
+def _cases() -> List[Tuple[str, Callable[[], Any]]]:
+    import azure.functions as func
+
+    import DecryptAndRedirect
+    import PaygoldLink
+    from utils import bc_client, crypto
+
+    params_b64 = base64.b64encode(json.dumps(NOTIFICATION_PARAMETERS).encode("utf-8")).decode("utf-8")
+    encrypted_secret = crypto.encrypt_secret("client-secret", PAYGOLD_KEY)
+    merchant_parameters = PaygoldLink._build_merchant_parameters(PAYGOLD_BODY, PAYGOLD_CONFIG)
+    signature = crypto.compute_redsys_signature(params_b64, ORDER, TERMINAL_KEY)
+    notification_request = func.HttpRequest(
+        method="POST",
+        url="/api/DecryptAndRedirect",
+        headers={"Content-Type": "application/json"},
+        body=json.dumps(
+            {
+                "Ds_SignatureVersion": "HMAC_SHA256_V1",
+                "Ds_MerchantParameters": params_b64,
+                "Ds_Signature": signature,
+            }
+        ).encode("utf-8"),
+    )
+    base_url, relative_path = bc_client.split_bc_url(BC_URL)
+
+    return [
+        ("crypto.diversify_redsys_key", lambda: crypto.diversify_redsys_key(ORDER, TERMINAL_KEY)),
+        ("crypto.compute_redsys_signature", lambda: crypto.compute_redsys_signature(params_b64, ORDER, TERMINAL_KEY)),
+        ("crypto.compute_paygold_signature", lambda: crypto.compute_paygold_signature(params_b64, ORDER, PAYGOLD_KEY)),
+        ("crypto.encrypt_secret", lambda: crypto.encrypt_secret("client-secret", PAYGOLD_KEY)),
+        ("crypto.decrypt_secret", lambda: crypto.decrypt_secret(encrypted_secret, PAYGOLD_KEY)),
+        ("crypto.decode_redsys_parameters", lambda: crypto.decode_redsys_parameters(params_b64)),
+        (
+            "PaygoldLink._build_merchant_parameters",
+            lambda: PaygoldLink._build_merchant_parameters(PAYGOLD_BODY, PAYGOLD_CONFIG),
+        ),
+        ("PaygoldLink._encode_parameters", lambda: PaygoldLink._encode_parameters(merchant_parameters)),
+        ("DecryptAndRedirect.parse_request", lambda: DecryptAndRedirect.parse_request(notification_request)),
+        (
+            "DecryptAndRedirect.build_bc_payload",
+            lambda: DecryptAndRedirect.build_bc_payload(NOTIFICATION_PARAMETERS, signature, ORDER),
+        ),
+        ("bc_client.split_bc_url", lambda: bc_client.split_bc_url(BC_URL)),
+        ("bc_client._build_basic_url", lambda: bc_client._build_basic_url(base_url, relative_path)),
+    ]
+
+
+def _measure(function: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    timer = timeit.Timer(function)
+    # Calibra el número de iteraciones para que cada repetición dure ~0,2 s
+    number, _ = timer.autorange()
+    samples = [elapsed / number * 1e6 for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "median_us": round(statistics.median(samples), 4),
+        "min_us": round(min(samples), 4),
+        "iterations": number,
+        "repeat": repeat,
+    }
+
+
+def run(output: str | None, repeat: int, name_filter: str | None) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for name, function in _cases():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = _measure(function, repeat)
+        print(f"{name:<45} {results[name]['median_us']:>12.3f} us/op")
+
+    report = {
+        "meta": {
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpuCount": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Resultados guardados en {output}")
+    return report
+
+
+def _latencies(function: Callable[[str], Any], orders: List[str]) -> Dict[str, Any]:
+    samples = []
+    for order in orders:
+        started = time.perf_counter()
+        if not function(order):
+            raise RuntimeError(f"No se ha encontrado el pedido {order}")
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return {
+        "median_us": round(statistics.median(samples), 2),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 2),
+        "max_us": round(samples[-1], 2),
+        "lookups": len(samples),
+    }
+
+
+def _seed_log(rows: int, batch: int = 10_000) -> float:
+    from utils.table_storage_sdk import build_log_entity, save_many_to_table
+
+    started = time.perf_counter()
+    for start in range(0, rows, batch):
+        entities = [
+            build_log_entity(
+                BC_URL, "Basic", "", "", "SHA-256", "", ds_merchant_order=f"{index:012d}",
+                merchant_code=OWNER[0], terminal=OWNER[1],
+            )
+            for index in range(start, min(rows, start + batch))
+        ]
+        save_many_to_table(entities)
+    return time.perf_counter() - started
+
+
+def lookups(rows: int, backends: List[str], samples: int, legacy_samples: int, output: str | None) -> Dict[str, Any]:
+    from utils import table_clients, table_storage_sdk
+
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in backends:
+            os.environ["TABLE_STORAGE_BACKEND"] = backend
+            os.environ["TABLE_STORAGE_SQLITE_PATH"] = os.path.join(directory, f"lookups-{backend}.sqlite3")
+            table_clients.reset_clients()
+            print(f"{backend}: cargando {rows} registros...")
+            seconds = _seed_log(rows)
+            orders = [f"{index:012d}" for index in random.sample(range(rows), min(samples, rows))]
+            results[backend] = {
+                "seedSeconds": round(seconds, 2),
+                "index": _latencies(lambda order: table_storage_sdk.get_entity_by_order_code(order, OWNER), orders),
+                "legacy": _latencies(
+                    lambda order: table_storage_sdk._find_legacy_entity(order, OWNER), orders[:legacy_samples]
+                ),
+            }
+            for path in ("index", "legacy"):
+                measured = results[backend][path]
+                print(
+                    f"  {path:<8} mediana {measured['median_us']:>12.2f} us  "
+                    f"p99 {measured['p99_us']:>12.2f} us  ({measured['lookups']} búsquedas)"
+                )
+            table_clients.reset_clients()
+
+    report = {
+        "meta": {
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "rows": rows,
+        },
+        "results": results,
+    }
+    if output:
+        Path(output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Resultados guardados en {output}")
+    return report
+
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))["results"]
+    current = json.loads(Path(current_path).read_text(encoding="utf-8"))["results"]
+
+    regressions = 0
+    for name, reference in baseline.items():
+        measured = current.get(name)
+        if not measured:
+            print(f"{name:<45} {'(sin medición)':>12}")
+            continue
+        ratio = measured["median_us"] / reference["median_us"] if reference["median_us"] else 1.0
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- REGRESIÓN"
+            regressions += 1
+        print(
+            f"{name:<45} {reference['median_us']:>10.3f} -> {measured['median_us']:>10.3f} us/op "
+            f"({(ratio - 1) * 100:+.1f} %){flag}"
+        )
+
+    if regressions:
+        print(f"{regressions} caso(s) superan el umbral del {threshold * 100:.0f} %")
+        return 1
+    print("Sin regresiones")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de SUITECH RedSys")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Ejecuta los benchmarks")
+    run_parser.add_argument("--output", help="Fichero JSON de salida")
+    run_parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por caso (por defecto 5)")
+    run_parser.add_argument("--filter", dest="name_filter", help="Solo casos cuyo nombre contenga este texto")
+
+    compare_parser = subparsers.add_parser("compare", help="Compara dos ficheros de resultados")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.15, help="Tolerancia relativa (0.15 = 15 %%)")
+
+    lookups_parser = subparsers.add_parser("lookups", help="Búsquedas de pedidos en los backends locales de tablas")
+    lookups_parser.add_argument("--rows", type=int, default=1_000_000, help="Registros a cargar (por defecto 1.000.000)")
+    lookups_parser.add_argument("--backend", default="memory,sqlite", help="Backends separados por comas")
+    lookups_parser.add_argument("--samples", type=int, default=2000, help="Búsquedas por el índice")
+    lookups_parser.add_argument("--legacy-samples", type=int, default=20, help="Búsquedas sin índice (recorren la tabla)")
+    lookups_parser.add_argument("--output", help="Fichero JSON de salida")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args.output, args.repeat, args.name_filter)
+    elif args.command == "lookups":
+        lookups(
+            args.rows,
+            [backend.strip() for backend in args.backend.split(",") if backend.strip()],
+            args.samples,
+            args.legacy_samples,
+            args.output,
+        )
+    else:
+        sys.exit(compare(args.baseline, args.current, args.threshold))
@@ -5,11 +5,10 @@ from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from utils.crypto import compute_redsys_signature  # noqa: E402
+from utils.crypto import compute_redsys_signature, get_signer  # noqa: E402
 
 
-def generate(order: str, terminal_key: str, template: dict | None = None) -> tuple[str, str]:
-    """Genera Ds_MerchantParameters y Ds_Signature para pruebas."""
+def _notification_payload(order: str, template: dict | None = None) -> dict:
     base_payload = {
         "Ds_Date": "09/11/2025",
         "Ds_Hour": "21:30",
@@ -35,15 +34,31 @@ def generate(order: str, terminal_key: str, template: dict | None = None) -> tup
     if template:
         base_payload.update(template)
         base_payload["Ds_Order"] = order
+    return base_payload
+
+
+def _encode(payload: dict) -> str:
+    return base64.b64encode(json.dumps(payload).encode("utf-8")).decode("utf-8")
+
 
-    params_b64 = base64.b64encode(json.dumps(base_payload).encode("utf-8")).decode("utf-8")
+def generate(order: str, terminal_key: str, template: dict | None = None) -> tuple[str, str]:
+    """Genera Ds_MerchantParameters y Ds_Signature para pruebas."""
+    params_b64 = _encode(_notification_payload(order, template))
     signature = compute_redsys_signature(params_b64, order, terminal_key)
     return params_b64, signature
 
 
+def generate_many(orders: list[str], terminal_key: str, template: dict | None = None) -> list[tuple[str, str]]:
+    """Genera (Ds_MerchantParameters, Ds_Signature) para varios pedidos (pruebas de carga)."""
+    encoded = [_encode(_notification_payload(order, template)) for order in orders]
+    signatures = get_signer(terminal_key).sign_many(zip(encoded, orders))
+    return list(zip(encoded, signatures))
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 3:
         print("Uso: python tools/generate_redsys_payload.py <ORDER> <REDSYS_SHA256_KEY_BASE64>")
+        print("Para pruebas de carga ver tools/load_harness.py")
         sys.exit(1)
 
     order_arg = sys.argv[1]
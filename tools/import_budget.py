@@ -0,0 +1,163 @@
+"""Mide cuánto tarda en importarse cada función y lo compara con un presupuesto.
+
+Uso:
+    python tools/import_budget.py [--budget-ms 250] [--repeat 3] [--top 8] [--output imports.json]
+    python tools/import_budget.py DecryptAndRedirect --budget DecryptAndRedirect=300
+
+Cada función (cada carpeta con `function.json`) se importa en un intérprete
+nuevo con `python -X importtime`, que es lo que paga una instancia en frío
+antes de atender su primera petición. `azure.functions` se importa antes y no
+se cuenta porque el worker de Python ya lo tiene cargado. De cada función se
+toma la mejor de `--repeat` mediciones y se listan las importaciones directas
+más caras, que son las candidatas a cargarse de forma diferida.
+
+Termina con código 1 si alguna función supera su presupuesto
+(`--budget-ms`, por defecto `IMPORT_BUDGET_MS` o 250 ms), de modo que
+`deploy.sh` puede abortar el despliegue.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+
+DEFAULT_BUDGET_MS = 250.0
+
+# Módulos que el worker de Python ya ha importado cuando carga las funciones
+PRELOADED_MODULES = ("azure.functions",)
+
+ImportLine = Tuple[int, float, str]
+
+
+def discover_functions() -> List[str]:
+    return sorted(
+        path.parent.name
+        for path in ROOT.glob("*/function.json")
+        if (path.parent / "__init__.py").exists()
+    )
+
+
+def _parse_importtime(stderr: str) -> List[ImportLine]:
+    """Líneas `import time: self | cumulative | name` como (nivel, ms acumulados, módulo)."""
+    lines = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # cabecera
+        name = fields[2].rstrip()
+        level = (len(name) - len(name.lstrip())) // 2
+        lines.append((level, int(fields[1]) / 1000, name.strip()))
+    return lines
+
+
+def measure(module_name: str) -> Tuple[float, List[Tuple[str, float]]]:
+    """Importa `module_name` en un proceso nuevo. Devuelve (ms totales, importaciones directas)."""
+    preload = "".join(f"import {name}; " for name in PRELOADED_MODULES)
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"{preload}import {module_name}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"No se pudo importar {module_name}:\n{completed.stderr.strip().splitlines()[-1]}")
+
+    lines = _parse_importtime(completed.stderr)
+    # Los hijos se imprimen antes que su padre: el módulo es la última línea y sus
+    # importaciones directas, las de nivel 1 que la preceden hasta el módulo anterior
+    _, total_ms, _ = lines[-1]
+    children = []
+    for level, cumulative_ms, name in reversed(lines[:-1]):
+        if level == 0:
+            break
+        if level == 1:
+            children.append((name, cumulative_ms))
+    return total_ms, sorted(children, key=lambda item: item[1], reverse=True)
+
+
+def _parse_budgets(values: List[str]) -> Dict[str, float]:
+    budgets = {}
+    for value in values:
+        name, _, budget = value.partition("=")
+        budgets[name] = float(budget)
+    return budgets
+
+
+def run(
+    functions: List[str],
+    budget_ms: float,
+    budgets: Dict[str, float],
+    repeat: int,
+    top: int,
+    output: Optional[str],
+) -> int:
+    results = {}
+    over_budget = []
+    for function_name in functions:
+        measurements = [measure(function_name) for _ in range(max(1, repeat))]
+        total_ms, children = min(measurements, key=lambda item: item[0])
+        limit = budgets.get(function_name, budget_ms)
+        status = "OK" if total_ms <= limit else "EXCEDIDO"
+        if total_ms > limit:
+            over_budget.append(function_name)
+
+        print(f"{function_name:<24} {total_ms:8.1f} ms  (presupuesto {limit:.0f} ms)  {status}")
+        for name, cumulative_ms in children[:top]:
+            print(f"    {name:<40} {cumulative_ms:8.1f} ms")
+        results[function_name] = {
+            "totalMs": round(total_ms, 1),
+            "budgetMs": limit,
+            "imports": {name: round(cumulative_ms, 1) for name, cumulative_ms in children},
+        }
+
+    if output:
+        Path(output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    if over_budget:
+        print(f"Fuera de presupuesto: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tiempo de importación en frío de cada función")
+    parser.add_argument("functions", nargs="*", help="Funciones a medir (por defecto, todas)")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=float(os.environ.get("IMPORT_BUDGET_MS", DEFAULT_BUDGET_MS)),
+        help="Presupuesto por función en ms (por defecto IMPORT_BUDGET_MS o 250)",
+    )
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="FUNCION=MS",
+        help="Presupuesto específico de una función (se puede repetir)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Mediciones por función; se toma la mejor")
+    parser.add_argument("--top", type=int, default=8, help="Importaciones directas a mostrar por función")
+    parser.add_argument("--output", help="Fichero JSON con el detalle")
+    args = parser.parse_args()
+
+    sys.exit(run(
+        args.functions or discover_functions(),
+        args.budget_ms,
+        _parse_budgets(args.budget),
+        args.repeat,
+        args.top,
+        args.output,
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""Arnés de carga local para DecryptAndRedirect y PaygoldLink.
+
+Levanta un servidor de stubs (endpoint de tokens OAuth, API OData de Business
+Central y `trataPeticionREST` de RedSys) con latencia y tasa de errores
+configurables, registra los pedidos necesarios en Table Storage y lanza N
+peticiones firmadas con la concurrencia y la tasa de llegada indicadas.
+
+Ejemplos:
+    # Notificaciones ejecutando el handler en el propio proceso (Azurite en marcha)
+    AzureWebJobsStorage=UseDevelopmentStorage=true \\
+        python tools/load_harness.py notifications -n 2000 -c 32 --bc-latency-ms 80
+
+    # Sin Azurite: las tablas en memoria del propio proceso
+    python tools/load_harness.py notifications -n 2000 -c 32 --storage memory
+
+    # PaygoldLink masivo contra `func start`
+    python tools/load_harness.py paygold-bulk -n 50 --orders-per-request 100 \\
+        --target http --base-url http://localhost:7071
+
+En modo `http` la Function App debe arrancarse con las variables que imprime
+el arnés (`BC_TOKEN_URL_TEMPLATE`, `BC_OAUTH_HOSTS`, `REDSYS_SHA256_KEY`) para
+que use los stubs.
+`--storage` (`TABLE_STORAGE_BACKEND`) solo afecta al proceso del arnés: en
+modo `http` `memory` no sirve, porque la Function App no vería los pedidos
+registrados; `sqlite` sí, si ambos apuntan al mismo `TABLE_STORAGE_SQLITE_PATH`.
+"""
+
+import argparse
+import asyncio
+import atexit
+import base64
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from generate_redsys_payload import generate_many  # noqa: E402
+
+TERMINAL_KEY = base64.b64encode(b"load-harness-terminal-k").decode("utf-8")
+ENCRYPT_KEY = "sq7HjrUOBfKmC576ILgskD5srU870gJ7"
+TENANT = "loadtest-tenant"
+ENVIRONMENT = "LoadTest"
+BC_RESOURCE = "api/suitech/redsys/v1.0/companies(00000000-0000-0000-0000-000000000001)/notifications"
+
+
+# --------------------------------------------------------------------------
+# Stubs
+# --------------------------------------------------------------------------
+
+class StubBehaviour:
+    """Latencia (ms, con jitter uniforme) y probabilidad de error 503 de un stub."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+
+    def apply(self) -> bool:
+        """Duerme la latencia simulada y devuelve True si hay que inyectar un error."""
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        return random.random() < self.error_rate
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    behaviours: Dict[str, StubBehaviour] = {}
+    hits: Counter = Counter()
+    hits_lock = threading.Lock()
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002  (firma de BaseHTTPRequestHandler)
+        pass
+
+    def _reply(self, status: int, body: bytes = b"", content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _service(self) -> str:
+        if "/oauth2/v2.0/token" in self.path:
+            return "token"
+        if "trataPeticionREST" in self.path:
+            return "redsys"
+        return "bc"
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        service = self._service()
+        with self.hits_lock:
+            self.hits[service] += 1
+
+        if self.behaviours[service].apply():
+            self._reply(503, b'{"error": "stub: error inyectado"}')
+            return
+
+        if service == "token":
+            self._reply(200, json.dumps({"access_token": uuid.uuid4().hex, "expires_in": 3599}).encode())
+        elif service == "redsys":
+            self._reply(200, json.dumps({"Ds_PayURL": "https://stub.local/pay", "Ds_Response": "0000"}).encode())
+        elif self.path.endswith("$batch"):
+            self._reply_batch(body)
+        elif self.command == "PUT":
+            self._reply(204)
+        else:
+            self._reply(201, json.dumps({"id": uuid.uuid4().hex}).encode())
+
+    def _reply_batch(self, body: bytes) -> None:
+        operations = body.count(b"Content-ID:")
+        boundary = "batchresponse_stub"
+        changeset = "changesetresponse_stub"
+        parts = [f"--{boundary}", f"Content-Type: multipart/mixed; boundary={changeset}", ""]
+        for content_id in range(1, operations + 1):
+            status = "201 Created" if content_id == 1 else "204 No Content"
+            content = '{"id": "stub"}' if content_id == 1 else ""
+            parts += [
+                f"--{changeset}",
+                "Content-Type: application/http",
+                "Content-Transfer-Encoding: binary",
+                f"Content-ID: {content_id}",
+                "",
+                f"HTTP/1.1 {status}",
+                "Content-Type: application/json",
+                "",
+                content,
+            ]
+        parts += [f"--{changeset}--", f"--{boundary}--", ""]
+        self._reply(200, "\r\n".join(parts).encode(), f"multipart/mixed; boundary={boundary}")
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+    do_PATCH = _handle
+
+
+def start_stubs(behaviours: Dict[str, StubBehaviour], port: int = 0) -> ThreadingHTTPServer:
+    _StubHandler.behaviours = behaviours
+    server = ThreadingHTTPServer(("127.0.0.1", port), _StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --------------------------------------------------------------------------
+# Preparación de datos
+# --------------------------------------------------------------------------
+
+def _bc_url(stub_base: str) -> str:
+    return f"{stub_base}/v2.0/{TENANT}/{ENVIRONMENT}/{BC_RESOURCE}"
+
+
+def seed_orders(orders: List[str], stub_base: str) -> None:
+    """Registra los pedidos en Table Storage apuntando al stub de BC."""
+    from utils.table_storage_sdk import build_log_entity, save_many_to_table
+
+    entities = [
+        build_log_entity(
+            url_bc=_bc_url(stub_base),
+            auth_type="oAuth",
+            user="load-client",
+            password="load-secret",
+            encrypt_type="SHA-256",
+            encrypt_key=ENCRYPT_KEY,
+            ds_merchant_order=order,
+            merchant_code="263100000",
+            terminal="49",
+        )
+        for order in orders
+    ]
+    saved = save_many_to_table(entities)
+    if len(saved) != len(entities):
+        raise RuntimeError(f"Solo se registraron {len(saved)} de {len(entities)} pedidos")
+
+
+def _paygold_bulk_body(stub_base: str, request_number: int, orders_per_request: int) -> Dict[str, Any]:
+    return {
+        "urlBC": _bc_url(stub_base),
+        "authType": "oAuth",
+        "user": "load-client",
+        "pass": "load-secret",
+        "encryptKey": ENCRYPT_KEY,
+        "merchantCode": "263100000",
+        "terminal": "49",
+        "redirectURL": f"{stub_base}/sis/rest/trataPeticionREST",
+        "paygold": True,
+        "orders": [
+            {"order": f"PG{request_number:05d}{position:04d}", "amount": str(100 + position)}
+            for position in range(orders_per_request)
+        ],
+    }
+
+
+# --------------------------------------------------------------------------
+# Ejecución
+# --------------------------------------------------------------------------
+
+Sender = Callable[[str, Dict[str, Any]], int]
+
+
+def _in_process_sender() -> Sender:
+    import azure.functions as func
+
+    import DecryptAndRedirect
+    import PaygoldLink
+    from utils import http_pool_aio
+
+    handlers = {"DecryptAndRedirect": DecryptAndRedirect.main, "PaygoldLink": PaygoldLink.main}
+
+    # Los handlers son `async def`: como en el worker de Functions, todas las
+    # invocaciones comparten un único bucle de eventos
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="harness-loop", daemon=True).start()
+    atexit.register(lambda: asyncio.run_coroutine_threadsafe(http_pool_aio.close_sessions(), loop).result())
+
+    def send(function_name: str, body: Dict[str, Any]) -> int:
+        request = func.HttpRequest(
+            method="POST",
+            url=f"/api/{function_name}",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps(body).encode("utf-8"),
+        )
+        return asyncio.run_coroutine_threadsafe(handlers[function_name](request), loop).result().status_code
+
+    return send
+
+
+def _http_sender(base_url: str, function_key: Optional[str]) -> Sender:
+    from utils import http_pool
+
+    headers = {"x-functions-key": function_key} if function_key else {}
+
+    def send(function_name: str, body: Dict[str, Any]) -> int:
+        response = http_pool.post(f"{base_url.rstrip('/')}/api/{function_name}", json=body, headers=headers, timeout=120)
+        return response.status_code
+
+    return send
+
+
+def run_load(
+    send: Sender,
+    requests_to_send: List[Tuple[str, Dict[str, Any]]],
+    concurrency: int,
+    rate: float,
+) -> Dict[str, Any]:
+    """Lanza las peticiones y devuelve throughput, percentiles y códigos de estado.
+
+    Con `rate` > 0 la llegada es abierta (una petición cada 1/rate segundos,
+    independientemente de lo que tarden las anteriores); con 0 es cerrada y
+    cada hilo envía la siguiente petición en cuanto termina la anterior.
+    """
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def one(index: int) -> None:
+        if rate > 0:
+            scheduled = started + index / rate
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        function_name, body = requests_to_send[index]
+        begin = time.perf_counter()
+        try:
+            status: Any = send(function_name, body)
+        except Exception as exc:  # pylint: disable=broad-except
+            status = type(exc).__name__
+        elapsed = (time.perf_counter() - begin) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(len(requests_to_send))))
+
+    duration = time.perf_counter() - started
+    ordered = sorted(latencies)
+
+    def percentile(value: float) -> float:
+        if not ordered:
+            return 0.0
+        rank = max(0, min(len(ordered) - 1, round(value / 100 * len(ordered) + 0.5) - 1))
+        return round(ordered[rank], 2)
+
+    return {
+        "requests": len(ordered),
+        "durationSeconds": round(duration, 3),
+        "throughputPerSecond": round(len(ordered) / duration, 2) if duration else 0.0,
+        "latencyMs": {
+            "mean": round(statistics.fmean(ordered), 2) if ordered else 0.0,
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "p99": percentile(99),
+            "max": round(ordered[-1], 2) if ordered else 0.0,
+        },
+        "statusCodes": {str(code): count for code, count in statuses.most_common()},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pruebas de carga locales de SUITECH RedSys")
+    parser.add_argument("scenario", choices=("notifications", "paygold-bulk"))
+    parser.add_argument("-n", "--requests", type=int, default=500, help="Peticiones a enviar")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=0.0, help="Peticiones por segundo (0 = carga cerrada)")
+    parser.add_argument("--target", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--base-url", default="http://localhost:7071")
+    parser.add_argument("--function-key", help="Clave de función para PaygoldLink en modo http")
+    parser.add_argument("--orders-per-request", type=int, default=50, help="Pedidos por petición masiva")
+    parser.add_argument("--stub-port", type=int, default=0, help="Puerto de los stubs (0 = libre)")
+    for service in ("bc", "token", "redsys"):
+        parser.add_argument(f"--{service}-latency-ms", type=float, default=20.0 if service != "token" else 50.0)
+        parser.add_argument(f"--{service}-jitter-ms", type=float, default=5.0)
+        parser.add_argument(f"--{service}-error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--storage",
+        choices=("azure", "memory", "sqlite"),
+        help="Backend de tablas (por defecto TABLE_STORAGE_BACKEND o azure)",
+    )
+    parser.add_argument("--output", help="Guarda el informe en JSON")
+    args = parser.parse_args()
+    if args.storage:
+        os.environ["TABLE_STORAGE_BACKEND"] = args.storage
+
+    behaviours = {
+        service: StubBehaviour(
+            getattr(args, f"{service}_latency_ms"),
+            getattr(args, f"{service}_jitter_ms"),
+            getattr(args, f"{service}_error_rate"),
+        )
+        for service in ("bc", "token", "redsys")
+    }
+    server = start_stubs(behaviours, args.stub_port)
+    stub_base = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["BC_TOKEN_URL_TEMPLATE"] = f"{stub_base}/{{tenant}}/oauth2/v2.0/token"
+    os.environ["REDSYS_SHA256_KEY"] = TERMINAL_KEY
+    print(f"Stubs en {stub_base}")
+    os.environ["BC_OAUTH_HOSTS"] = "127.0.0.1"
+    print(f"  BC_TOKEN_URL_TEMPLATE={os.environ['BC_TOKEN_URL_TEMPLATE']}")
+    print(f"  BC_OAUTH_HOSTS={os.environ['BC_OAUTH_HOSTS']}")
+    print(f"  REDSYS_SHA256_KEY={TERMINAL_KEY}")
+    print(f"  TABLE_STORAGE_BACKEND={os.environ.get('TABLE_STORAGE_BACKEND', 'azure')}")
+
+    run_id = uuid.uuid4().hex[:6].upper()
+    if args.scenario == "notifications":
+        orders = [f"{index:04d}{run_id}"[-12:] for index in range(args.requests)]
+        print(f"Registrando {len(orders)} pedidos...")
+        seed_orders(orders, stub_base)
+        signed = generate_many(orders, TERMINAL_KEY)
+        requests_to_send = [
+            (
+                "DecryptAndRedirect",
+                {"Ds_SignatureVersion": "HMAC_SHA256_V1", "Ds_MerchantParameters": params, "Ds_Signature": signature},
+            )
+            for params, signature in signed
+        ]
+    else:
+        requests_to_send = [
+            ("PaygoldLink", _paygold_bulk_body(stub_base, index, args.orders_per_request))
+            for index in range(args.requests)
+        ]
+
+    send = _in_process_sender() if args.target == "inprocess" else _http_sender(args.base_url, args.function_key)
+    print(f"Lanzando {len(requests_to_send)} peticiones ({args.target}, concurrencia {args.concurrency})...")
+    report = run_load(send, requests_to_send, args.concurrency, args.rate)
+    report["scenario"] = args.scenario
+    report["stubHits"] = dict(_StubHandler.hits)
+    server.shutdown()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
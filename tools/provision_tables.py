@@ -0,0 +1,32 @@
+"""Crea las tablas que usan las funciones.
+
+Uso:
+    AzureWebJobsStorage="<connection string>" python tools/provision_tables.py
+
+Tras ejecutarlo en el despliegue se puede configurar `TABLES_AUTO_CREATE=false`
+en la Function App para que los workers no comprueben la tabla al arrancar.
+"""
+
+import logging
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from utils.idempotency import LEDGER_TABLE_NAME  # noqa: E402
+from utils.retention import ARCHIVE_TABLE_NAME, STATE_TABLE_NAME  # noqa: E402
+from utils.table_clients import provision_tables  # noqa: E402
+from utils.table_storage_sdk import LOG_TABLE_NAME, ORDER_INDEX_TABLE_NAME  # noqa: E402
+
+TABLES = (
+    LOG_TABLE_NAME,
+    ORDER_INDEX_TABLE_NAME,
+    LEDGER_TABLE_NAME,
+    STATE_TABLE_NAME,
+    ARCHIVE_TABLE_NAME,
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    provision_tables(TABLES)
@@ -0,0 +1,29 @@
+"""Ejecuta a mano un ciclo de retención de EncryptDataLogs.
+
+Uso:
+    python tools/purge_logs.py [--dry-run] [--budget SEGUNDOS]
+
+Necesita `AzureWebJobsStorage` en el entorno. Usa la misma configuración que
+la función PurgeEncryptDataLogs (`LOG_RETENTION_DAYS`, `LOG_RETENTION_MODE`) y
+continúa el ciclo que esta haya dejado a medias. Con `--dry-run` solo cuenta
+las filas que se borrarían.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from utils.retention import run_retention  # noqa: E402
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="No borra, solo cuenta las filas afectadas")
+    parser.add_argument("--budget", type=float, default=3600, help="Segundos máximos de ejecución (por defecto 3600)")
+    args = parser.parse_args()
+
+    state = run_retention(time_budget=args.budget, dry_run=args.dry_run)
+    print(json.dumps(state, indent=2, default=str))
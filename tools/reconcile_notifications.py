@@ -0,0 +1,447 @@
+"""Verifica y decodifica exportaciones de notificaciones RedSys para conciliar con el banco.
+
+Uso:
+    python tools/reconcile_notifications.py export-*.jsonl.gz --output notificaciones.parquet
+    python tools/reconcile_notifications.py export.csv --output notificaciones.csv \\
+        --daily diario.csv --key <REDSYS_SHA256_KEY> --workers 8
+
+Lee ficheros JSONL o CSV (comprimidos con gzip o no) con una notificación por
+línea: `Ds_MerchantParameters` y `Ds_Signature`, o `merchantParameters` y
+`signature` como en los mensajes de la cola `redsys-notifications`. Las filas
+se reparten en bloques (`--chunk-size`) entre un pool de procesos que verifica
+la firma y decodifica los parámetros igual que DecryptAndRedirect: la clave es
+la del comercio en el registro (`MERCHANT_REGISTRY_FILE`) o, si no figura,
+`--key`/`REDSYS_SHA256_KEY`. El importe se normaliza con `parse_amount`.
+
+Salida:
+- `--output`: una fila por notificación, en Parquet si la extensión es
+  `.parquet` (requiere `pyarrow`) o en CSV. Se escribe por bloques y en el
+  orden de entrada.
+- `--daily`: agregados por día (`Ds_Date`), `Ds_Response`, `Ds_Card_Brand` y
+  moneda. `notifications` y `amount` solo cuentan las notificaciones con firma
+  válida; las de firma inválida y las que no se han podido verificar (sin
+  clave o sin firma) van en columnas propias con su número e importe, para
+  que nunca entren en el total que se concilia con el banco. Los importes se
+  suman en céntimos, sin errores de redondeo.
+
+Solo hay en memoria los bloques en curso (dos por proceso) y los agregados,
+así que el consumo no depende del tamaño de la exportación. Al terminar
+escribe un resumen JSON en la salida estándar.
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from utils import merchants  # noqa: E402
+from utils.crypto import RedsysSigner, get_signer  # noqa: E402
+from utils.notification_delivery import decode_notification_parameters, parse_amount, parse_datetime  # noqa: E402
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# (fichero, línea, Ds_MerchantParameters, Ds_Signature)
+SourceRecord = Tuple[int, int, Optional[str], Optional[str]]
+# (día, Ds_Response, Ds_Card_Brand, moneda) -> [notificaciones, céntimos, firmas inválidas, sin verificar]
+AggregateKey = Tuple[str, str, str, str]
+Aggregates = Dict[AggregateKey, List[int]]
+
+COLUMNS = (
+    "file",
+    "line",
+    "order",
+    "day",
+    "datetime",
+    "amount",
+    "currency",
+    "response",
+    "authorised",
+    "card_brand",
+    "card_country",
+    "merchant_code",
+    "terminal",
+    "transaction_type",
+    "authorisation_code",
+    "signature_valid",
+    "error",
+)
+
+DAILY_COLUMNS = (
+    "day",
+    "response",
+    "card_brand",
+    "currency",
+    "notifications",
+    "amount",
+    "invalid_signatures",
+    "invalid_amount",
+    "unverified",
+    "unverified_amount",
+)
+
+# Lista de agregados: (número, céntimos) de firmas válidas, inválidas y sin verificar
+_AGGREGATE_SIZE = 6
+
+PARAMETER_FIELDS = ("Ds_MerchantParameters", "merchantParameters")
+SIGNATURE_FIELDS = ("Ds_Signature", "signature")
+
+_default_signer: Optional[RedsysSigner] = None
+
+
+# --- Lectura -----------------------------------------------------------------
+
+
+def _open_text(path: Path) -> io.TextIOBase:
+    with open(path, "rb") as handle:
+        compressed = handle.read(2) == b"\x1f\x8b"
+    if compressed:
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def _input_format(path: Path, forced: Optional[str]) -> str:
+    if forced:
+        return forced
+    suffixes = [suffix.lower() for suffix in path.suffixes if suffix.lower() != ".gz"]
+    return "csv" if suffixes and suffixes[-1] == ".csv" else "jsonl"
+
+
+def _first(row: Dict[str, Any], fields: Iterable[str]) -> Optional[str]:
+    for field in fields:
+        value = row.get(field)
+        if value:
+            return str(value)
+    return None
+
+
+def read_records(paths: List[Path], forced_format: Optional[str] = None) -> Iterator[SourceRecord]:
+    """Recorre las exportaciones fila a fila sin cargarlas en memoria."""
+    for file_index, path in enumerate(paths):
+        with _open_text(path) as handle:
+            if _input_format(path, forced_format) == "csv":
+                # Línea 1 = cabecera; Ds_MerchantParameters no contiene saltos de línea
+                for line_number, row in enumerate(csv.DictReader(handle), start=2):
+                    yield file_index, line_number, _first(row, PARAMETER_FIELDS), _first(row, SIGNATURE_FIELDS)
+                continue
+            for line_number, line in enumerate(handle, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield file_index, line_number, None, None
+                    continue
+                if not isinstance(row, dict):
+                    row = {}
+                yield file_index, line_number, _first(row, PARAMETER_FIELDS), _first(row, SIGNATURE_FIELDS)
+
+
+def chunked(records: Iterable[SourceRecord], size: int) -> Iterator[List[SourceRecord]]:
+    chunk: List[SourceRecord] = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# --- Proceso (en los workers) ------------------------------------------------
+
+
+def _init_worker(default_key: Optional[str]) -> None:
+    global _default_signer
+    # parse_amount avisa de cada importe inválido; aquí se cuentan en la salida
+    logging.getLogger().setLevel(logging.ERROR)
+    _default_signer = get_signer(default_key) if default_key else None
+
+
+def _signer_for(params: Dict[str, Any]) -> Optional[RedsysSigner]:
+    merchant = merchants.lookup(params.get("Ds_MerchantCode"), params.get("Ds_Terminal"))
+    if merchant is not None:
+        return merchant.notification_signer
+    return _default_signer
+
+
+def _text(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _amount_cents(amount_value: Any) -> Optional[int]:
+    try:
+        return int(Decimal(str(amount_value)))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+
+
+def reconcile_record(record: SourceRecord) -> Tuple[Dict[str, Any], Optional[int]]:
+    """Verifica y decodifica una notificación.
+
+    Devuelve su fila de salida y el importe en céntimos (`Ds_Amount` tal cual),
+    que es lo que se suma en los agregados.
+    """
+    file_index, line_number, params_b64, signature = record
+    row: Dict[str, Any] = dict.fromkeys(COLUMNS)
+    row["file"] = file_index
+    row["line"] = line_number
+    if not params_b64 or not signature:
+        row["error"] = "Faltan Ds_MerchantParameters o Ds_Signature"
+        return row, None
+    try:
+        params = decode_notification_parameters(params_b64)
+    except Exception as exc:  # pylint: disable=broad-except
+        row["error"] = f"Ds_MerchantParameters inválido: {exc}"
+        return row, None
+
+    order = _text(params.get("Ds_Order") or params.get("DS_ORDER"))
+    response = _text(params.get("Ds_Response"))
+    timestamp = parse_datetime(params.get("Ds_Date"), params.get("Ds_Hour"))
+    row.update(
+        order=order,
+        day=timestamp[:10] if timestamp else None,
+        datetime=timestamp,
+        amount=parse_amount(_text(params.get("Ds_Amount"))),
+        currency=_text(params.get("Ds_Currency")),
+        response=response,
+        card_brand=_text(params.get("Ds_Card_Brand")),
+        card_country=_text(params.get("Ds_Card_Country")),
+        merchant_code=_text(params.get("Ds_MerchantCode")),
+        terminal=_text(params.get("Ds_Terminal")),
+        transaction_type=_text(params.get("Ds_TransactionType")),
+        authorisation_code=_text(params.get("Ds_AuthorisationCode")),
+    )
+    # Ds_Response de 0000 a 0099: operación autorizada
+    if response is not None and str(response).isdigit():
+        row["authorised"] = int(response) < 100
+
+    signer = _signer_for(params)
+    if signer is None:
+        row["error"] = "Sin clave para verificar la firma"
+    elif not order:
+        row["signature_valid"] = False
+        row["error"] = "Falta Ds_Order"
+    else:
+        row["signature_valid"] = signer.verify(params_b64, order, signature)
+    if params.get("Ds_Amount") and row["amount"] is None:
+        row["error"] = row["error"] or f"Ds_Amount inválido: {params.get('Ds_Amount')}"
+    return row, _amount_cents(params.get("Ds_Amount")) if row["amount"] is not None else None
+
+
+def reconcile_chunk(chunk: List[SourceRecord]) -> Tuple[List[Dict[str, Any]], Aggregates]:
+    """Procesa un bloque: filas de salida en orden y sus agregados parciales."""
+    rows = []
+    aggregates: Aggregates = {}
+    for record in chunk:
+        row, cents = reconcile_record(record)
+        rows.append(row)
+        if row["order"] is None and row["response"] is None:
+            continue  # sin parámetros decodificables: solo cuenta en el resumen
+        key = (row["day"] or "", row["response"] or "", row["card_brand"] or "", row["currency"] or "")
+        totals = aggregates.setdefault(key, [0] * _AGGREGATE_SIZE)
+        if row["signature_valid"] is True:
+            slot = 0
+        elif row["signature_valid"] is False:
+            slot = 2
+        else:
+            slot = 4
+        totals[slot] += 1
+        totals[slot + 1] += cents or 0
+    return rows, aggregates
+
+
+# --- Escritura ----------------------------------------------------------------
+
+
+class CsvRowWriter:
+    def __init__(self, path: Path) -> None:
+        self._handle = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._handle, fieldnames=COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._handle.close()
+
+
+class ParquetRowWriter:
+    def __init__(self, path: Path) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise SystemExit("La salida Parquet necesita pyarrow (pip install pyarrow); use .csv") from exc
+
+        self._pa = pa
+        self._schema = pa.schema([
+            ("file", pa.int32()),
+            ("line", pa.int64()),
+            ("order", pa.string()),
+            ("day", pa.string()),
+            ("datetime", pa.string()),
+            ("amount", pa.float64()),
+            ("currency", pa.string()),
+            ("response", pa.string()),
+            ("authorised", pa.bool_()),
+            ("card_brand", pa.string()),
+            ("card_country", pa.string()),
+            ("merchant_code", pa.string()),
+            ("terminal", pa.string()),
+            ("transaction_type", pa.string()),
+            ("authorisation_code", pa.string()),
+            ("signature_valid", pa.bool_()),
+            ("error", pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(str(path), self._schema, compression="zstd")
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        # Cada bloque es un row group: la memoria no crece con el fichero
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def _row_writer(path: Path):
+    if path.suffix.lower() == ".parquet":
+        return ParquetRowWriter(path)
+    return CsvRowWriter(path)
+
+
+def _money(cents: int) -> str:
+    return f"{Decimal(cents) / 100:.2f}"
+
+
+def write_daily(path: Path, aggregates: Aggregates) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(DAILY_COLUMNS)
+        for key in sorted(aggregates):
+            valid, valid_cents, invalid, invalid_cents, unverified, unverified_cents = aggregates[key]
+            writer.writerow([
+                *key,
+                valid,
+                _money(valid_cents),
+                invalid,
+                _money(invalid_cents),
+                unverified,
+                _money(unverified_cents),
+            ])
+
+
+# --- Orquestación ------------------------------------------------------------
+
+
+def _merge(target: Aggregates, partial: Aggregates) -> None:
+    for key, values in partial.items():
+        totals = target.setdefault(key, [0] * _AGGREGATE_SIZE)
+        for index, value in enumerate(values):
+            totals[index] += value
+
+
+def _results(chunks: Iterator[List[SourceRecord]], workers: int, default_key: Optional[str]):
+    """Resultados de `reconcile_chunk` en orden, con como mucho `2 * workers` bloques en curso."""
+    if workers <= 1:
+        _init_worker(default_key)
+        for chunk in chunks:
+            yield reconcile_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(default_key,)) as executor:
+        pending: Deque[Future] = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(reconcile_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run(
+    paths: List[Path],
+    output: Optional[Path],
+    daily: Optional[Path],
+    default_key: Optional[str],
+    workers: int,
+    chunk_size: int,
+    forced_format: Optional[str] = None,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    summary = {"rows": 0, "validSignatures": 0, "invalidSignatures": 0, "unverified": 0, "errors": 0}
+    aggregates: Aggregates = {}
+    writer = _row_writer(output) if output else None
+    try:
+        chunks = chunked(read_records(paths, forced_format), chunk_size)
+        for rows, partial in _results(chunks, workers, default_key):
+            if writer is not None:
+                writer.write(rows)
+            _merge(aggregates, partial)
+            for row in rows:
+                summary["rows"] += 1
+                if row["signature_valid"] is True:
+                    summary["validSignatures"] += 1
+                elif row["signature_valid"] is False:
+                    summary["invalidSignatures"] += 1
+                else:
+                    summary["unverified"] += 1
+                if row["error"]:
+                    summary["errors"] += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if daily:
+        write_daily(daily, aggregates)
+    elapsed = time.perf_counter() - started
+    summary.update(
+        files=[str(path) for path in paths],
+        days=len({key[0] for key in aggregates}),
+        seconds=round(elapsed, 2),
+        rowsPerSecond=round(summary["rows"] / elapsed) if elapsed else None,
+    )
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+", type=Path, help="Exportaciones JSONL o CSV (también .gz)")
+    parser.add_argument("--output", type=Path, help="Fichero por notificación (.parquet o .csv)")
+    parser.add_argument("--daily", type=Path, help="CSV con los agregados diarios")
+    parser.add_argument("--key", default=os.environ.get("REDSYS_SHA256_KEY"), help="Clave del TPV (por defecto REDSYS_SHA256_KEY)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos (por defecto, uno por CPU)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Notificaciones por bloque (5000)")
+    parser.add_argument("--format", dest="input_format", choices=("jsonl", "csv"), help="Formato de entrada si la extensión no lo indica")
+    args = parser.parse_args()
+
+    if not args.output and not args.daily:
+        parser.error("Indique --output, --daily o ambos")
+
+    summary = run(
+        args.inputs,
+        args.output,
+        args.daily,
+        args.key,
+        max(1, args.workers),
+        max(1, args.chunk_size),
+        args.input_format,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
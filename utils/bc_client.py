@@ -1,18 +1,52 @@
-import json
-from typing import Any, Dict, Optional, Tuple, Union
+import email
+import email.utils
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import requests
 
+from utils import codec, http_pool, timing
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError  # noqa: F401  (CircuitOpenError se reexporta)
+from utils.env import env_int
+
 DEFAULT_SCOPE = "https://api.businesscentral.dynamics.com/.default"
+# Hosts a los que se envían tokens OAuth de BC (ampliable con BC_OAUTH_HOSTS)
+DEFAULT_OAUTH_HOSTS = ("api.businesscentral.dynamics.com",)
 TOKEN_URL_TEMPLATE = "https://login.microsoftonline.com/{tenant}/oauth2/v2.0/token"
 SUPPORTED_METHODS = {"GET", "POST", "PATCH", "PUT", "DELETE"}
+# Margen (segundos) con el que se renueva un token antes de que caduque
+TOKEN_REFRESH_MARGIN = 300
+# Duración asumida cuando la respuesta de token no incluye expires_in
+DEFAULT_TOKEN_LIFETIME = 3599
+# Respuestas de BC que cuentan como caída para el circuit breaker (429 es limitación, no caída)
+OUTAGE_STATUS = {500, 502, 503, 504}
+DEFAULT_CIRCUIT_FAILURES = 5
+DEFAULT_CIRCUIT_OPEN_SECONDS = 30
+# Reintentos dentro de la misma invocación (ver `retry_delay`)
+IDEMPOTENT_METHODS = {"GET", "PUT", "DELETE"}
+THROTTLED_STATUS = {429}
+RETRY_STATUS = {429, 502, 503, 504}
+DEFAULT_RETRY_MAX_ATTEMPTS = 4
+DEFAULT_RETRY_DEADLINE = 15
+DEFAULT_RETRY_BACKOFF_MS = 500
+DEFAULT_RETRY_BACKOFF_MAX_MS = 8000
 
 
 class BusinessCentralError(Exception):
     """Error genérico para llamadas a Business Central."""
 
 
+class BatchNotSupportedError(BusinessCentralError):
+    """El endpoint de Business Central no acepta peticiones OData $batch."""
+
+
 def parse_bc_url(url_bc: str) -> Tuple[str, str, str]:
     """Devuelve (tenant, environment, base_url) a partir de la URL de BC."""
     parsed = urlparse(url_bc)
@@ -69,7 +103,7 @@ def _prepare_request_components(
 
     if isinstance(payload, (dict, list)):
         request_headers.setdefault("Content-Type", "application/json")
-        return request_headers, json.dumps(payload)
+        return request_headers, codec.dumps_bytes(payload)
 
     if isinstance(payload, (str, bytes)):
         # Permitir que quien llama defina Content-Type; si no, asumir texto plano
@@ -79,90 +113,357 @@ def _prepare_request_components(
     raise BusinessCentralError(f"Tipo de payload no soportado: {type(payload)!r}")
 
 
-def _request_oauth(
-    entity: Dict[str, Any],
+# (tenant, client_id, scope, huella del client_secret)
+TokenKey = Tuple[str, str, str, str]
+
+# Clave aleatoria del proceso para las huellas de los secretos (nunca se guarda el secreto)
+_SECRET_SALT = os.urandom(16)
+
+
+class _TokenCache:
+    """Caché de tokens OAuth compartida por todo el proceso.
+
+    Los tokens se indexan por (tenant, client_id, scope, huella del secreto),
+    así que una entidad con el secreto equivocado nunca recibe el token que
+    obtuvo otra con el secreto correcto. Se renuevan
+    `TOKEN_REFRESH_MARGIN` segundos antes de caducar. Cada clave tiene su propio
+    lock, de modo que si varias invocaciones concurrentes necesitan el mismo
+    token solo una de ellas llama al endpoint de identidad.
+    """
+
+    def __init__(self) -> None:
+        # clave -> (token, instante monotónico a partir del cual hay que renovarlo)
+        self._tokens: Dict[TokenKey, Tuple[str, float]] = {}
+        self._locks: Dict[TokenKey, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock_for(self, key: TokenKey) -> threading.Lock:
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def peek(self, key: TokenKey) -> Optional[str]:
+        """Token cacheado de `key` si aún no hay que renovarlo."""
+        cached = self._tokens.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        return None
+
+    def store(self, key: TokenKey, token: str, refresh_at: float) -> None:
+        self._tokens[key] = (token, refresh_at)
+
+    def get(self, key: TokenKey, client_secret: str) -> str:
+        token = self.peek(key)
+        if token:
+            return token
+
+        with self._lock_for(key):
+            # Otro hilo pudo renovar el token mientras esperábamos el lock
+            token = self.peek(key)
+            if token:
+                return token
+            with timing.stage("token"):
+                token, refresh_at = _fetch_token(key, client_secret)
+            self.store(key, token, refresh_at)
+            return token
+
+    def invalidate(self, key: TokenKey, token: Optional[str] = None) -> None:
+        """Elimina el token cacheado (solo si coincide con `token`, cuando se indica)."""
+        with self._guard:
+            cached = self._tokens.get(key)
+            if cached and (token is None or cached[0] == token):
+                self._tokens.pop(key, None)
+
+    def clear(self) -> None:
+        with self._guard:
+            self._tokens.clear()
+
+
+_token_cache = _TokenCache()
+
+
+def _token_request(key: TokenKey, client_secret: str) -> Tuple[str, Dict[str, str]]:
+    """URL y formulario de la petición client_credentials para `key`."""
+    tenant, client_id, scope, _ = key
+    token_payload = {
+        "grant_type": "client_credentials",
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "scope": scope,
+    }
+
+    # BC_TOKEN_URL_TEMPLATE permite apuntar a un endpoint de identidad local (pruebas de carga)
+    token_url = (os.environ.get("BC_TOKEN_URL_TEMPLATE") or TOKEN_URL_TEMPLATE).format(tenant=tenant)
+    return token_url, token_payload
+
+
+def _fetch_token(key: TokenKey, client_secret: str) -> Tuple[str, float]:
+    token_url, token_payload = _token_request(key, client_secret)
+    return _parse_token_response(http_pool.post(token_url, data=token_payload))
+
+
+def _parse_token_response(token_response: requests.Response) -> Tuple[str, float]:
+    """Devuelve (token, instante de renovación) de la respuesta del endpoint de tokens."""
+    token_response.raise_for_status()
+
+    token_data = token_response.json()
+    access_token = token_data.get("access_token")
+    if not access_token:
+        raise BusinessCentralError("Respuesta de token inválida (sin access_token).")
+
+    try:
+        expires_in = int(token_data.get("expires_in", DEFAULT_TOKEN_LIFETIME))
+    except (TypeError, ValueError):
+        expires_in = DEFAULT_TOKEN_LIFETIME
+    # Con tokens de vida muy corta el margen se limita a la mitad de su duración
+    refresh_in = max(expires_in - TOKEN_REFRESH_MARGIN, expires_in / 2)
+    return access_token, time.monotonic() + refresh_in
+
+
+def clear_token_cache() -> None:
+    """Vacía la caché de tokens OAuth del proceso."""
+    _token_cache.clear()
+
+
+def _send_oauth(
     method: str,
     url: str,
-    payload: PayloadType,
-    headers: Optional[Dict[str, str]],
+    access_token: str,
+    request_headers: Dict[str, str],
+    data: Optional[Union[str, bytes]],
 ) -> requests.Response:
+    auth_headers = {"Authorization": f"Bearer {access_token}"}
+    auth_headers.update(request_headers)
+    return http_pool.request(method, url, headers=auth_headers, data=data)
+
+
+def _oauth_credentials(entity: Dict[str, Any]) -> Tuple[TokenKey, str]:
     client_id = entity.get("User")
     client_secret = entity.get("Pass")
 
     if not client_id or not client_secret:
         raise BusinessCentralError("Entidad BC incompleta para OAuth (User/Pass requeridos).")
 
+    _check_oauth_host(entity["URLBC"])
     tenant, _, _ = parse_bc_url(entity["URLBC"])
+    secret_digest = hashlib.blake2b(client_secret.encode("utf-8"), key=_SECRET_SALT, digest_size=16).hexdigest()
+    return (tenant, client_id, DEFAULT_SCOPE, secret_digest), client_secret
 
-    token_payload = {
-        "grant_type": "client_credentials",
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "scope": DEFAULT_SCOPE,
-    }
 
-    token_url = TOKEN_URL_TEMPLATE.format(tenant=tenant)
-    token_response = requests.post(token_url, data=token_payload, timeout=30)
-    token_response.raise_for_status()
+def oauth_hosts() -> Tuple[str, ...]:
+    configured = os.environ.get("BC_OAUTH_HOSTS")
+    if not configured:
+        return DEFAULT_OAUTH_HOSTS
+    return tuple(host.strip().lower() for host in configured.split(",") if host.strip())
 
-    access_token = token_response.json().get("access_token")
-    if not access_token:
-        raise BusinessCentralError("Respuesta de token inválida (sin access_token).")
 
-    auth_headers = {"Authorization": f"Bearer {access_token}"}
-    
-    # Si el payload es un dict/list, usar json= para enviarlo correctamente como JSON
-    if isinstance(payload, (dict, list)):
-        request_headers = {"Accept": "application/json"}
-        if headers:
-            request_headers.update(headers)
-        if request_headers:
-            auth_headers.update(request_headers)
-        return requests.request(method, url, headers=auth_headers, json=payload, timeout=30)
-    
-    # Para strings/bytes, usar _prepare_request_components
-    request_headers, data = _prepare_request_components(payload, headers)
-    if request_headers:
-        auth_headers.update(request_headers)
-    return requests.request(method, url, headers=auth_headers, data=data, timeout=30)
+def _check_oauth_host(url_bc: str) -> None:
+    # El token de un tenant solo se envía a la API de BC, nunca al host que figure en URLBC
+    host = (urlparse(url_bc).hostname or "").lower()
+    if host not in oauth_hosts():
+        raise BusinessCentralError(f"El host {host or '(vacío)'} no es una API de Business Central admitida para OAuth.")
 
 
-def _request_basic(
+def _basic_credentials(entity: Dict[str, Any]) -> Tuple[str, str]:
+    user = entity.get("User")
+    password = entity.get("Pass")
+
+    if not user or not password:
+        raise BusinessCentralError("Entidad BC incompleta para Basic Auth (User/Pass requeridos).")
+    return user, password
+
+
+def _request_oauth(
     entity: Dict[str, Any],
     method: str,
     url: str,
     payload: PayloadType,
     headers: Optional[Dict[str, str]],
 ) -> requests.Response:
-    user = entity.get("User")
-    password = entity.get("Pass")
+    token_key, client_secret = _oauth_credentials(entity)
 
-    if not user or not password:
-        raise BusinessCentralError("Entidad BC incompleta para Basic Auth (User/Pass requeridos).")
+    # El cuerpo se serializa una sola vez aunque haya que reintentar tras un 401
+    request_headers, data = _prepare_request_components(payload, headers)
+    access_token = _token_cache.get(token_key, client_secret)
+    response = _send_oauth(method, url, access_token, request_headers, data)
+    if response.status_code != 401:
+        return response
 
-    # Si el payload es un dict/list, usar json= para enviarlo correctamente como JSON
-    if isinstance(payload, (dict, list)):
-        request_headers = {"Accept": "application/json"}
-        if headers:
-            request_headers.update(headers)
-        return requests.request(
-            method,
-            url,
-            headers=request_headers,
-            json=payload,
-            auth=(user, password),
-            timeout=30,
-        )
-    
-    # Para strings/bytes, usar _prepare_request_components
+    # El token pudo revocarse o rotarse antes de caducar: se renueva y se reintenta una vez.
+    # Solo se invalida si sigue siendo el mismo token, para que varias respuestas 401
+    # concurrentes no provoquen varias renovaciones.
+    _token_cache.invalidate(token_key, access_token)
+    access_token = _token_cache.get(token_key, client_secret)
+    return _send_oauth(method, url, access_token, request_headers, data)
+
+
+def _request_basic(
+    entity: Dict[str, Any],
+    method: str,
+    url: str,
+    payload: PayloadType,
+    headers: Optional[Dict[str, str]],
+) -> requests.Response:
+    user, password = _basic_credentials(entity)
     request_headers, data = _prepare_request_components(payload, headers)
-    return requests.request(
+    return http_pool.request(
         method,
         url,
         headers=request_headers,
         data=data,
         auth=(user, password),
-        timeout=30,
+    )
+
+
+# Un circuito por entorno de BC (tenant + entorno, o host para Basic)
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_key(url_bc: str) -> str:
+    parsed = urlparse(url_bc or "")
+    segments = [segment for segment in parsed.path.split("/") if segment]
+    if len(segments) >= 3 and segments[0].lower() == "v2.0":
+        return f"{parsed.scheme}://{parsed.netloc}/v2.0/{segments[1]}/{segments[2]}".lower()
+    return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+
+def _circuit_enabled() -> bool:
+    return os.environ.get("BC_CIRCUIT_ENABLED", "true").lower() not in ("false", "0", "no")
+
+
+def _breaker_for(url_bc: str) -> Optional[CircuitBreaker]:
+    if not _circuit_enabled():
+        return None
+    key = circuit_key(url_bc)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(key)
+            if breaker is None:
+                breaker = _breakers[key] = CircuitBreaker(
+                    key,
+                    failure_threshold=max(1, env_int("BC_CIRCUIT_FAILURES", DEFAULT_CIRCUIT_FAILURES)),
+                    reset_timeout=env_int("BC_CIRCUIT_OPEN_SECONDS", DEFAULT_CIRCUIT_OPEN_SECONDS),
+                )
+    return breaker
+
+
+def circuit_state(url_bc: str) -> str:
+    """Estado del circuito del entorno de BC de `url_bc` ("closed", "open" o "half_open")."""
+    breaker = _breaker_for(url_bc)
+    return breaker.state if breaker is not None else CircuitBreaker.CLOSED
+
+
+def circuit_open(url_bc: str) -> bool:
+    """True si las llamadas a ese entorno de BC fallarían ahora mismo sin salir del proceso."""
+    return circuit_state(url_bc) == CircuitBreaker.OPEN
+
+
+def circuit_retry_after(url_bc: str) -> float:
+    """Segundos hasta que el circuito de ese entorno admita llamadas de prueba."""
+    breaker = _breaker_for(url_bc)
+    return breaker.retry_after() if breaker is not None else 0.0
+
+
+def reset_circuits() -> None:
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def _settle(
+    breaker: Optional[CircuitBreaker],
+    response: Optional[requests.Response] = None,
+    error: Optional[BaseException] = None,
+    transport_errors: Tuple[type, ...] = (requests.ConnectionError, requests.Timeout),
+) -> None:
+    """Anota en el circuito el resultado de una llamada."""
+    if breaker is None:
+        return
+    if error is not None:
+        failed_response = getattr(error, "response", None) if isinstance(error, requests.HTTPError) else None
+        if isinstance(error, transport_errors) or (
+            failed_response is not None and failed_response.status_code in OUTAGE_STATUS
+        ):
+            breaker.record_failure()
+        else:
+            breaker.release()
+    elif response.status_code in OUTAGE_STATUS:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def retry_deadline() -> float:
+    return time.monotonic() + max(0, env_int("BC_RETRY_DEADLINE", DEFAULT_RETRY_DEADLINE))
+
+
+def _retry_after_seconds(response: requests.Response) -> Optional[float]:
+    value = (response.headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def retry_delay(
+    method: str,
+    idempotent: bool,
+    attempt: int,
+    deadline: float,
+    response: Optional[requests.Response] = None,
+    transport_error: bool = False,
+) -> Optional[float]:
+    """Segundos a esperar antes de repetir la llamada, o None si no debe repetirse.
+
+    Un 429 se repite siempre: BC lo devuelve sin procesar la petición. Los
+    errores de conexión, timeouts y 502/503/504 solo se repiten con métodos
+    idempotentes (GET, PUT, DELETE) o si quien llama indica que la operación
+    está protegida contra duplicados (`idempotent=True`). Se respeta
+    `Retry-After` y, si no viene, se espera un backoff exponencial con jitter;
+    no se reintenta si la espera supera el plazo (`deadline`).
+    """
+    if attempt >= max(1, env_int("BC_RETRY_MAX_ATTEMPTS", DEFAULT_RETRY_MAX_ATTEMPTS)):
+        return None
+    safe = idempotent or method in IDEMPOTENT_METHODS
+    if transport_error:
+        if not safe:
+            return None
+        retry_after = None
+    elif response is not None and (
+        response.status_code in THROTTLED_STATUS or (safe and response.status_code in RETRY_STATUS)
+    ):
+        retry_after = _retry_after_seconds(response)
+    else:
+        return None
+
+    if retry_after is not None:
+        # Un poco de jitter para que los workers limitados a la vez no vuelvan a la vez
+        delay = retry_after * random.uniform(1.0, 1.1)
+    else:
+        base = env_int("BC_RETRY_BACKOFF_MS", DEFAULT_RETRY_BACKOFF_MS) / 1000
+        cap = env_int("BC_RETRY_BACKOFF_MAX_MS", DEFAULT_RETRY_BACKOFF_MAX_MS) / 1000
+        delay = random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+    if time.monotonic() + delay > deadline:
+        return None
+    return delay
+
+
+def _log_retry(method: str, url: str, attempt: int, delay: float, reason: Any) -> None:
+    logging.warning(
+        "Business Central %s %s: intento %s fallido (%s); se reintenta en %.2f s",
+        method,
+        url,
+        attempt,
+        reason,
+        delay,
     )
 
 
@@ -172,8 +473,65 @@ def call_business_central(
     relative_path: Optional[str] = None,
     payload: PayloadType = None,
     headers: Optional[Dict[str, str]] = None,
+    idempotent: bool = False,
+) -> requests.Response:
+    """Realiza la llamada a Business Central usando la configuración almacenada.
+
+    Las limitaciones (429) y los fallos transitorios se reintentan dentro de
+    la misma llamada según `retry_delay`; `idempotent=True` permite repetir
+    también un POST/PATCH que no puede duplicar datos.
+
+    Raises:
+        CircuitOpenError: si el entorno de BC acumula fallos y el circuito está abierto.
+    """
+    method, url = _prepare_call(entity, method, relative_path)
+    deadline = retry_deadline()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            response = _call_once(entity, method, url, payload, headers)
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            delay = retry_delay(method, idempotent, attempt, deadline, transport_error=True)
+            if delay is None:
+                raise
+            _log_retry(method, url, attempt, delay, type(exc).__name__)
+        else:
+            delay = retry_delay(method, idempotent, attempt, deadline, response=response)
+            if delay is None:
+                return response
+            _log_retry(method, url, attempt, delay, response.status_code)
+        time.sleep(delay)
+
+
+def _call_once(
+    entity: Dict[str, Any],
+    method: str,
+    url: str,
+    payload: PayloadType,
+    headers: Optional[Dict[str, str]],
 ) -> requests.Response:
-    """Realiza la llamada a Business Central usando la configuración almacenada."""
+    breaker = _breaker_for(entity["URLBC"])
+    if breaker is not None:
+        breaker.before_call()
+    try:
+        if _is_oauth(entity):
+            response = _request_oauth(entity, method, url, payload, headers)
+        else:
+            response = _request_basic(entity, method, url, payload, headers)
+    except BaseException as exc:
+        _settle(breaker, error=exc)
+        raise
+    _settle(breaker, response=response)
+    return response
+
+
+def _is_oauth(entity: Dict[str, Any]) -> bool:
+    return (entity.get("AuthType") or "").lower() == "oauth"
+
+
+def _prepare_call(entity: Dict[str, Any], method: str, relative_path: Optional[str]) -> Tuple[str, str]:
+    """Valida la llamada y devuelve (método en mayúsculas, URL final)."""
     if "URLBC" not in entity:
         raise BusinessCentralError("Entidad sin URLBC definida.")
 
@@ -181,16 +539,19 @@ def call_business_central(
     if method not in SUPPORTED_METHODS:
         raise BusinessCentralError(f"Método HTTP '{method}' no soportado.")
 
+    return method, _resolve_url(entity, relative_path)
+
+
+def _resolve_url(entity: Dict[str, Any], relative_path: Optional[str]) -> str:
     auth_type = (entity.get("AuthType") or "").lower()
     if auth_type == "oauth":
         _, _, base_url = parse_bc_url(entity["URLBC"])
         url = entity["URLBC"]
         if relative_path:
             url = f"{base_url}/{relative_path.lstrip('/')}"
-        return _request_oauth(entity, method, url, payload, headers)
+        return url
     if auth_type == "basic":
-        url = _build_basic_url(entity["URLBC"], relative_path)
-        return _request_basic(entity, method, url, payload, headers)
+        return _build_basic_url(entity["URLBC"], relative_path)
 
     raise BusinessCentralError(f"AuthType '{auth_type}' no soportado.")
 
@@ -213,3 +574,148 @@ def _build_basic_url(base_url: str, relative_path: Optional[str]) -> str:
 
     return f"{base}/{relative_path.lstrip('/')}"
 
+
+
+# Bases de BC que han rechazado $batch; se usan llamadas secuenciales con ellas
+_batch_unsupported: set = set()
+_BATCH_REJECTED_STATUS = {400, 404, 405, 415, 501}
+
+
+def batch_path_for(relative_path: str) -> str:
+    """Ruta del endpoint $batch para el recurso `relative_path`.
+
+    El $batch vive en la raíz del servicio OData, es decir, antes del segmento
+    `companies(...)`/`Company(...)` (o en el padre del recurso si no lo hay).
+    """
+    segments = [segment for segment in relative_path.split("/") if segment]
+    root = segments[:-1]
+    for position, segment in enumerate(segments):
+        if segment.lower().startswith(("companies(", "company(")):
+            root = segments[:position]
+            break
+    return "/".join(root + ["$batch"])
+
+
+def _build_batch_body(
+    entity: Dict[str, Any],
+    operations: List[Dict[str, Any]],
+    boundary: str,
+) -> bytes:
+    changeset = f"changeset_{uuid.uuid4().hex}"
+    lines: List[bytes] = [
+        f"--{boundary}".encode(),
+        f"Content-Type: multipart/mixed; boundary={changeset}".encode(),
+        b"",
+    ]
+    for content_id, operation in enumerate(operations, start=1):
+        path = operation["path"]
+        # Las referencias $n apuntan a la entidad creada por la operación n del changeset
+        target = path if path.startswith("$") else _resolve_url(entity, path)
+        request_headers, data = _prepare_request_components(operation.get("payload"), operation.get("headers"))
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        lines += [
+            f"--{changeset}".encode(),
+            b"Content-Type: application/http",
+            b"Content-Transfer-Encoding: binary",
+            f"Content-ID: {content_id}".encode(),
+            b"",
+            f"{operation['method'].upper()} {target} HTTP/1.1".encode(),
+        ]
+        lines += [f"{name}: {value}".encode("utf-8") for name, value in (request_headers or {}).items()]
+        lines += [b"", data or b""]
+    lines += [f"--{changeset}--".encode(), f"--{boundary}--".encode(), b""]
+    return b"\r\n".join(lines)
+
+
+def _parse_http_part(raw: bytes, url: str) -> requests.Response:
+    head, separator, body = raw.partition(b"\r\n\r\n")
+    if not separator:
+        head, separator, body = raw.partition(b"\n\n")
+    head_lines = head.decode("iso-8859-1").splitlines()
+    status_line = head_lines[0].split(" ", 2)
+
+    response = requests.Response()
+    response.status_code = int(status_line[1])
+    response.reason = status_line[2] if len(status_line) > 2 else ""
+    for line in head_lines[1:]:
+        name, _, value = line.partition(":")
+        if name:
+            response.headers[name.strip()] = value.strip()
+    response._content = body.rstrip(b"\r\n")  # pylint: disable=protected-access
+    response.encoding = "utf-8"
+    response.url = url
+    return response
+
+
+def _parse_batch_response(batch_response: requests.Response) -> List[requests.Response]:
+    content_type = batch_response.headers.get("Content-Type", "")
+    if not content_type.lower().startswith("multipart/"):
+        raise BusinessCentralError("Respuesta $batch sin contenido multipart.")
+
+    message = email.message_from_bytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + batch_response.content
+    )
+    responses: List[requests.Response] = []
+    for part in message.walk():
+        if part.get_content_type() == "application/http":
+            raw = part.get_payload(decode=True) or b""
+            responses.append(_parse_http_part(raw, batch_response.url))
+    return responses
+
+
+def batch_supported(entity: Dict[str, Any]) -> bool:
+    return entity.get("URLBC") not in _batch_unsupported
+
+
+def call_business_central_batch(
+    entity: Dict[str, Any],
+    operations: List[Dict[str, Any]],
+) -> List[requests.Response]:
+    """Envía varias operaciones en un único changeset OData $batch.
+
+    Cada operación es un dict con `method`, `path` (relativo a URLBC o una
+    referencia `$n` a la operación n) y opcionalmente `payload` y `headers`.
+    Devuelve una respuesta por operación; si el changeset falla en bloque BC
+    devuelve una sola respuesta con el error. Lanza `BatchNotSupportedError`
+    si BC no procesa el $batch; si además el endpoint no lo admite (400, 404,
+    405, 415, 501) se recuerda para no volver a intentarlo con esa URL.
+    """
+    if not operations:
+        return []
+    relative_path, body, headers = _prepare_batch(entity, operations)
+    batch_response = call_business_central(
+        entity,
+        method="POST",
+        relative_path=relative_path,
+        payload=body,
+        headers=headers,
+    )
+    return _finish_batch(entity, batch_response)
+
+
+def _prepare_batch(
+    entity: Dict[str, Any],
+    operations: List[Dict[str, Any]],
+) -> Tuple[str, bytes, Dict[str, str]]:
+    """Devuelve (ruta del $batch, cuerpo multipart, cabeceras) para `operations`."""
+    first_path = next((op["path"] for op in operations if not op["path"].startswith("$")), None)
+    if not first_path:
+        raise BusinessCentralError("El changeset necesita al menos una ruta no referenciada.")
+
+    boundary = f"batch_{uuid.uuid4().hex}"
+    body = _build_batch_body(entity, operations, boundary)
+    headers = {"Content-Type": f"multipart/mixed; boundary={boundary}", "Accept": "multipart/mixed"}
+    return batch_path_for(first_path), body, headers
+
+
+def _finish_batch(entity: Dict[str, Any], batch_response: requests.Response) -> List[requests.Response]:
+    is_multipart = batch_response.headers.get("Content-Type", "").lower().startswith("multipart/")
+    if batch_response.status_code >= 400 and not is_multipart:
+        # Sin respuesta multipart no se ha ejecutado ninguna operación del changeset
+        if batch_response.status_code in _BATCH_REJECTED_STATUS:
+            _batch_unsupported.add(entity.get("URLBC"))
+        raise BatchNotSupportedError(
+            f"$batch rechazado por Business Central ({batch_response.status_code})."
+        )
+    return _parse_batch_response(batch_response)
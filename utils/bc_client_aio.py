@@ -0,0 +1,168 @@
+"""Variante asíncrona de `utils.bc_client` para funciones `async def`.
+
+Comparte con la versión síncrona la resolución de URLs, la preparación de
+payloads, el formato $batch y la caché de tokens OAuth (un token obtenido por
+cualquiera de las dos variantes sirve para la otra). Solo cambia el transporte:
+`utils.http_pool_aio` en lugar de `requests`, de modo que una instancia puede
+tener cientos de llamadas a BC en curso sin ocupar un hilo por cada una.
+"""
+
+import asyncio
+import weakref
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from utils import http_pool_aio, timing
+from utils.bc_client import (
+    PayloadType,
+    TokenKey,
+    _basic_credentials,
+    _breaker_for,
+    _finish_batch,
+    _is_oauth,
+    _log_retry,
+    _oauth_credentials,
+    _parse_token_response,
+    _prepare_batch,
+    _prepare_call,
+    _prepare_request_components,
+    _settle,
+    _token_cache,
+    _token_request,
+    retry_deadline,
+    retry_delay,
+)
+
+# Un lock por token y bucle de eventos: solo una corrutina renueva cada token
+_token_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[TokenKey, asyncio.Lock]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _token_lock(key: TokenKey) -> asyncio.Lock:
+    locks = _token_locks.setdefault(asyncio.get_running_loop(), {})
+    lock = locks.get(key)
+    if lock is None:
+        lock = locks[key] = asyncio.Lock()
+    return lock
+
+
+async def _get_token(key: TokenKey, client_secret: str) -> str:
+    token = _token_cache.peek(key)
+    if token:
+        return token
+
+    async with _token_lock(key):
+        token = _token_cache.peek(key)
+        if token:
+            return token
+        token_url, token_payload = _token_request(key, client_secret)
+        with timing.stage("token"):
+            token, refresh_at = _parse_token_response(await http_pool_aio.post(token_url, data=token_payload))
+        _token_cache.store(key, token, refresh_at)
+        return token
+
+
+async def _request_oauth(
+    entity: Dict[str, Any],
+    method: str,
+    url: str,
+    payload: PayloadType,
+    headers: Optional[Dict[str, str]],
+) -> requests.Response:
+    token_key, client_secret = _oauth_credentials(entity)
+    request_headers, data = _prepare_request_components(payload, headers)
+
+    for attempt in range(2):
+        access_token = await _get_token(token_key, client_secret)
+        auth_headers = {"Authorization": f"Bearer {access_token}"}
+        auth_headers.update(request_headers)
+        response = await http_pool_aio.request(method, url, headers=auth_headers, data=data)
+        if response.status_code != 401 or attempt:
+            return response
+        # Igual que en la variante síncrona: se renueva el token y se reintenta una vez
+        _token_cache.invalidate(token_key, access_token)
+    return response
+
+
+async def _request_basic(
+    entity: Dict[str, Any],
+    method: str,
+    url: str,
+    payload: PayloadType,
+    headers: Optional[Dict[str, str]],
+) -> requests.Response:
+    user, password = _basic_credentials(entity)
+    request_headers, data = _prepare_request_components(payload, headers)
+    return await http_pool_aio.request(method, url, headers=request_headers, data=data, auth=(user, password))
+
+
+async def call_business_central(
+    entity: Dict[str, Any],
+    method: str = "GET",
+    relative_path: Optional[str] = None,
+    payload: PayloadType = None,
+    headers: Optional[Dict[str, str]] = None,
+    idempotent: bool = False,
+) -> requests.Response:
+    """Versión asíncrona de `bc_client.call_business_central` (mismos reintentos y circuitos)."""
+    method, url = _prepare_call(entity, method, relative_path)
+    deadline = retry_deadline()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            response = await _call_once(entity, method, url, payload, headers)
+        except http_pool_aio.transport_errors() as exc:
+            delay = retry_delay(method, idempotent, attempt, deadline, transport_error=True)
+            if delay is None:
+                raise
+            _log_retry(method, url, attempt, delay, type(exc).__name__)
+        else:
+            delay = retry_delay(method, idempotent, attempt, deadline, response=response)
+            if delay is None:
+                return response
+            _log_retry(method, url, attempt, delay, response.status_code)
+        await asyncio.sleep(delay)
+
+
+async def _call_once(
+    entity: Dict[str, Any],
+    method: str,
+    url: str,
+    payload: PayloadType,
+    headers: Optional[Dict[str, str]],
+) -> requests.Response:
+    breaker = _breaker_for(entity["URLBC"])
+    if breaker is not None:
+        breaker.before_call()
+    try:
+        if _is_oauth(entity):
+            response = await _request_oauth(entity, method, url, payload, headers)
+        else:
+            response = await _request_basic(entity, method, url, payload, headers)
+    except BaseException as exc:
+        # Los errores de transporte de aiohttp cuentan como caída para el circuit breaker
+        _settle(breaker, error=exc, transport_errors=http_pool_aio.transport_errors())
+        raise
+    _settle(breaker, response=response)
+    return response
+
+
+async def call_business_central_batch(
+    entity: Dict[str, Any],
+    operations: List[Dict[str, Any]],
+) -> List[requests.Response]:
+    """Versión asíncrona de `bc_client.call_business_central_batch`."""
+    if not operations:
+        return []
+    relative_path, body, headers = _prepare_batch(entity, operations)
+    batch_response = await call_business_central(
+        entity,
+        method="POST",
+        relative_path=relative_path,
+        payload=body,
+        headers=headers,
+    )
+    return _finish_batch(entity, batch_response)
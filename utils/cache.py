@@ -0,0 +1,87 @@
+"""Caché en memoria con caducidad (TTL) y tamaño máximo, segura entre hilos.
+
+Se usa para datos por proceso que conviene no repetir entre invocaciones del
+mismo worker (resultados de notificaciones ya entregadas, claves derivadas...).
+Al llenarse expulsa la entrada usada hace más tiempo (LRU); las caducadas se
+descartan al consultarlas. `on_evict` recibe (clave, valor) cada vez que una
+entrada sale de la caché, por caducidad, expulsión, `pop` o `clear`.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class TTLCache(Generic[V]):
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        on_evict: Optional[Callable[[Hashable, V], None]] = None,
+    ) -> None:
+        if maxsize <= 0:
+            raise ValueError("maxsize debe ser mayor que 0")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._on_evict = on_evict
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, key: Hashable, value: V) -> None:
+        if self._on_evict is not None:
+            self._on_evict(key, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        expired = _MISSING
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                expired = value
+            else:
+                self._entries.move_to_end(key)
+                return value
+        self._evict(key, expired)
+        return default
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None and previous[1] is not value:
+                evicted.append((key, previous[1]))
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._pop_oldest())
+        for evicted_key, evicted_value in evicted:
+            self._evict(evicted_key, evicted_value)
+
+    def _pop_oldest(self) -> Tuple[Hashable, V]:
+        key, (_, value) = self._entries.popitem(last=False)
+        return key, value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self._evict(key, entry[1])
+        return entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries.clear()
+        for key, (_, value) in entries:
+            self._evict(key, value)
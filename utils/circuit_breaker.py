@@ -0,0 +1,106 @@
+"""Circuit breaker en memoria, seguro entre hilos y corrutinas.
+
+Tras `failure_threshold` fallos consecutivos el circuito se abre y las
+llamadas fallan al momento con `CircuitOpenError` durante `reset_timeout`
+segundos. Pasado ese tiempo queda semiabierto: se deja pasar un número
+limitado de llamadas de prueba (`half_open_probes`); si una termina bien el
+circuito se cierra y si falla vuelve a abrirse.
+
+Quien usa el circuito llama a `before_call()` antes de cada llamada y después
+a `record_success()`, `record_failure()` o, si el resultado no dice nada sobre
+la disponibilidad del servicio (un error de configuración, por ejemplo),
+`release()`.
+"""
+
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto: la llamada no se ha realizado."""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"Circuito abierto para {name}; reintentar en {retry_after:.0f} s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        half_open_probes: int = 1,
+    ) -> None:
+        if failure_threshold <= 0:
+            raise ValueError("failure_threshold debe ser mayor que 0")
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = max(1, half_open_probes)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._open = False
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _state(self, now: float) -> str:
+        if not self._open:
+            return self.CLOSED
+        if now - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def retry_after(self) -> float:
+        """Segundos hasta que el circuito admita llamadas de prueba (0 si ya las admite)."""
+        with self._lock:
+            if not self._open:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def before_call(self) -> None:
+        """Reserva la llamada o lanza `CircuitOpenError` si el circuito no la admite."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+            retry_after = max(0.0, self.reset_timeout - (now - self._opened_at))
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._open = False
+            self._probes = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._open:
+                # Ha fallado una prueba (o una llamada anterior a la apertura): otro periodo abierto
+                self._probes = max(0, self._probes - 1)
+                self._opened_at = time.monotonic()
+            elif self._failures >= self.failure_threshold:
+                self._open = True
+                self._opened_at = time.monotonic()
+                self._probes = 0
+
+    def release(self) -> None:
+        """Libera la llamada sin contarla como éxito ni como fallo."""
+        with self._lock:
+            if self._open:
+                self._probes = max(0, self._probes - 1)
@@ -0,0 +1,65 @@
+"""Serialización JSON compartida por las funciones.
+
+Usa `orjson` si está instalado y, si no, el módulo `json` de la biblioteca
+estándar. La salida es siempre UTF-8 sin escapar (equivalente a
+`ensure_ascii=False`) y compacta salvo que se pida `indent=True`, así que
+cada payload se serializa una vez y la misma cadena sirve para el cuerpo, el
+log y las llamadas a Business Central.
+
+`RESPONSE_PROFILE=compact` hace que las funciones respondan y registren sin
+sangrado y sin repetir los datos de entrada (`received`, parámetros en Base64);
+por defecto (`full`) se mantienen las respuestas completas.
+"""
+
+import json
+import os
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _dumps_stdlib(obj: Any, indent: bool) -> str:
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+    """Serializa `obj` a JSON en UTF-8."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:
+            # Claves no str o enteros de más de 64 bits: se delega en json
+            pass
+    return _dumps_stdlib(obj, indent).encode("utf-8")
+
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    """Serializa `obj` a una cadena JSON."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode("utf-8")
+        except TypeError:
+            pass
+    return _dumps_stdlib(obj, indent)
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Deserializa JSON; lanza ValueError si no es válido."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson no admite NaN/Infinity (json sí, como hacía `get_json`)
+            pass
+    return json.loads(data)
+
+
+def compact_profile() -> bool:
+    return os.environ.get("RESPONSE_PROFILE", "full").lower() == "compact"
@@ -1,12 +1,17 @@
 import base64
 import hashlib
 import hmac
-import json
-from typing import Any, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from Crypto.Cipher import DES3, AES
 from Crypto.Random import get_random_bytes
 
+from utils import codec
+from utils.cache import TTLCache
+from utils.env import env_int
+
 
 def encrypt(data: str, key: str, encrypt_type: str) -> str:
     message = (data + key).encode("utf-8")
@@ -25,10 +30,75 @@ def _derive_aes_key(encrypt_key: str) -> bytes:
     return hashlib.sha256(material).digest()
 
 
+# Cachés de claves AES derivadas y credenciales descifradas. Se indexan por una
+# huella BLAKE2b con clave aleatoria del proceso, de modo que ni los secretos
+# ni un hash verificable fuera del proceso quedan como claves del diccionario.
+# Los valores son bytearray que se sobrescriben con ceros al salir de la caché
+# (las copias inmutables que usa Python al descifrar no pueden borrarse).
+DEFAULT_CRYPTO_CACHE_TTL = 900
+DEFAULT_KEY_CACHE_SIZE = 256
+DEFAULT_CREDENTIAL_CACHE_SIZE = 1024
+
+_fingerprint_salt = get_random_bytes(32)
+# Reentrante: leer una entrada caducada dispara la puesta a cero desde la propia consulta
+_secret_cache_lock = threading.RLock()
+
+
+def _zeroize(_key: Any, value: bytearray) -> None:
+    with _secret_cache_lock:
+        value[:] = bytes(len(value))
+
+
+_crypto_cache_ttl = env_int("CRYPTO_CACHE_TTL", DEFAULT_CRYPTO_CACHE_TTL)
+_derived_keys: TTLCache = TTLCache(
+    maxsize=max(1, env_int("CRYPTO_KEY_CACHE_SIZE", DEFAULT_KEY_CACHE_SIZE)),
+    ttl=_crypto_cache_ttl,
+    on_evict=_zeroize,
+)
+_credentials: TTLCache = TTLCache(
+    maxsize=max(1, env_int("CRYPTO_CREDENTIAL_CACHE_SIZE", DEFAULT_CREDENTIAL_CACHE_SIZE)),
+    ttl=_crypto_cache_ttl,
+    on_evict=_zeroize,
+)
+
+
+def _secret_fingerprint(*parts: str) -> bytes:
+    digest = hashlib.blake2b(key=_fingerprint_salt, digest_size=32)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.digest()
+
+
+def _cached_secret(cache: TTLCache, fingerprint: bytes) -> Optional[bytes]:
+    # La copia se hace bajo el lock para no leer un valor que se está poniendo a cero
+    with _secret_cache_lock:
+        cached = cache.get(fingerprint)
+        return bytes(cached) if cached is not None else None
+
+
+def _get_aes_key(encrypt_key: str) -> bytes:
+    """`_derive_aes_key` con caché por huella de la clave (`CRYPTO_CACHE_TTL=0` la desactiva)."""
+    if _crypto_cache_ttl <= 0:
+        return _derive_aes_key(encrypt_key)
+    fingerprint = _secret_fingerprint(encrypt_key or "")
+    key = _cached_secret(_derived_keys, fingerprint)
+    if key is None:
+        key = _derive_aes_key(encrypt_key)
+        _derived_keys.set(fingerprint, bytearray(key))
+    return key
+
+
+def clear_secret_caches() -> None:
+    """Vacía (y pone a cero) las cachés de claves y credenciales."""
+    _derived_keys.clear()
+    _credentials.clear()
+
+
 def encrypt_secret(secret: str, encrypt_key: str) -> str:
     if secret is None:
         raise ValueError("No se puede cifrar un valor nulo.")
-    key = _derive_aes_key(encrypt_key)
+    key = _get_aes_key(encrypt_key)
     nonce = get_random_bytes(12)
     cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
     ciphertext, tag = cipher.encrypt_and_digest(secret.encode("utf-8"))
@@ -39,15 +109,24 @@ def encrypt_secret(secret: str, encrypt_key: str) -> str:
 def decrypt_secret(token: str, encrypt_key: str) -> str:
     if token is None:
         raise ValueError("Token vacío.")
+    # El mismo token cifrado con la misma clave siempre da el mismo texto
+    fingerprint = _secret_fingerprint(encrypt_key or "", token) if _crypto_cache_ttl > 0 else None
+    if fingerprint is not None:
+        cached = _cached_secret(_credentials, fingerprint)
+        if cached is not None:
+            return cached.decode("utf-8")
+
     raw = base64.b64decode(token)
     if len(raw) < 28:
         raise ValueError("Token de cifrado inválido.")
     nonce = raw[:12]
     tag = raw[12:28]
     ciphertext = raw[28:]
-    key = _derive_aes_key(encrypt_key)
+    key = _get_aes_key(encrypt_key)
     cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
     plaintext = cipher.decrypt_and_verify(ciphertext, tag)
+    if fingerprint is not None:
+        _credentials.set(fingerprint, bytearray(plaintext))
     return plaintext.decode("utf-8")
 
 
@@ -78,17 +157,7 @@ def diversify_redsys_key(order: str, terminal_key_b64: str) -> bytes:
         IV=0 sobre `order`, tal como indica RedSys.
     """
 
-    base_key = base64.b64decode(terminal_key_b64)
-    key_bytes = _prepare_3des_key(base_key)
-    cipher = DES3.new(key_bytes, DES3.MODE_CBC, iv=b"\x00" * 8)
-
-    # El mensaje debe ser múltiplo de 8 bytes. RedSys indica paddings con \0.
-    message = order.encode("utf-8")
-    pad_len = (8 - len(message) % 8) % 8
-    message += b"\x00" * pad_len
-
-    diversified = cipher.encrypt(message)
-    return diversified
+    return get_signer(terminal_key_b64).diversify(order)
 
 
 def compute_redsys_signature(merchant_parameters_b64: str, order: str, terminal_key_b64: str) -> str:
@@ -103,41 +172,20 @@ def compute_redsys_signature(merchant_parameters_b64: str, order: str, terminal_
         Firma codificada en Base64 lista para comparar con Ds_Signature.
     """
 
-    diversified_key = diversify_redsys_key(order, terminal_key_b64)
-    digest = hmac.new(
-        diversified_key,
-        merchant_parameters_b64.encode("utf-8"),
-        hashlib.sha256,
-    ).digest()
-    return base64.b64encode(digest).decode("utf-8")
+    return get_signer(terminal_key_b64).sign(merchant_parameters_b64, order)
 
 
 def decode_redsys_parameters(merchant_parameters_b64: str) -> Dict[str, Any]:
     """Devuelve el JSON contenido en Ds_MerchantParameters."""
 
     decoded = base64.b64decode(merchant_parameters_b64)
-    return json.loads(decoded.decode("utf-8"))
+    return codec.loads(decoded)
 
 
 def _derive_paygold_key(order: str, secret_key_b64: str) -> bytes:
     """Deriva la clave por operación usando 3DES-CBC como en HMAC_SHA256_V1."""
 
-    # Intenta decodificar como Base64, si falla trata la clave como texto plano
-    try:
-        base_key = base64.b64decode(secret_key_b64, validate=True)
-    except Exception:
-        # Si no es Base64 válido, codifica el texto plano a Base64 primero
-        secret_key_b64 = base64.b64encode(secret_key_b64.encode("utf-8")).decode("utf-8")
-        base_key = base64.b64decode(secret_key_b64)
-    
-    key_bytes = _prepare_3des_key(base_key)
-
-    data = order.encode("utf-8")
-    if len(data) % 8:
-        data += b"\x00" * (8 - (len(data) % 8))
-
-    cipher = DES3.new(key_bytes, DES3.MODE_CBC, iv=b"\x00" * 8)
-    return cipher.encrypt(data)
+    return get_signer(secret_key_b64, PAYGOLD).diversify(order)
 
 
 def compute_paygold_signature(
@@ -147,10 +195,131 @@ def compute_paygold_signature(
 ) -> str:
     """Calcula la firma HMAC-SHA256 usada por Paygold REST (HMAC_SHA256_V1)."""
 
-    derived_key = _derive_paygold_key(order, secret_key_b64)
-    digest = hmac.new(
-        derived_key,
-        merchant_parameters_b64.encode("utf-8"),
-        hashlib.sha256,
-    ).digest()
-    return base64.b64encode(digest).decode("utf-8")
\ No newline at end of file
+    return get_signer(secret_key_b64, PAYGOLD).sign(merchant_parameters_b64, order)
+
+
+def normalize_signature(signature: str) -> bytes:
+    """Decodifica una firma Base64 aceptando también el alfabeto URL-safe sin relleno."""
+
+    normalized = signature.replace("-", "+").replace("_", "/")
+    padding = len(normalized) % 4
+    if padding:
+        normalized += "=" * (4 - padding)
+    return base64.b64decode(normalized)
+
+
+REDSYS = "redsys"
+PAYGOLD = "paygold"
+
+# Tamaño de los bloques de trabajo que se reparten entre hilos en sign_many/verify_many
+_BATCH_CHUNK_SIZE = 512
+_MAX_CACHED_SIGNERS = 64
+_signers: Dict[Tuple[str, str], "RedsysSigner"] = {}
+_signers_lock = threading.Lock()
+
+
+def _parse_terminal_key(key_b64: str, variant: str) -> bytes:
+    if variant == PAYGOLD:
+        # Intenta decodificar como Base64; si no lo es, la clave se usa como texto plano
+        try:
+            return base64.b64decode(key_b64, validate=True)
+        except Exception:
+            return key_b64.encode("utf-8")
+    return base64.b64decode(key_b64)
+
+
+class RedsysSigner:
+    """Firma y verifica operaciones con una clave de terminal ya preparada.
+
+    La clave se decodifica y ajusta a 24 bytes una sola vez, y se reutiliza un
+    cifrador 3DES-ECB sobre el que se encadena el CBC con IV=0 de cada pedido,
+    evitando recalcular la expansión de clave en cada firma.
+    """
+
+    def __init__(self, key_b64: str, variant: str = REDSYS) -> None:
+        key_bytes = _prepare_3des_key(_parse_terminal_key(key_b64, variant))
+        self.variant = variant
+        self._cipher = DES3.new(key_bytes, DES3.MODE_ECB)
+
+    def diversify(self, order: str) -> bytes:
+        # El mensaje debe ser múltiplo de 8 bytes. RedSys indica paddings con \0.
+        message = order.encode("utf-8")
+        pad_len = (8 - len(message) % 8) % 8
+        message += b"\x00" * pad_len
+
+        # CBC con IV=0: cada bloque se combina con el cifrado del anterior
+        previous = 0
+        blocks = []
+        for start in range(0, len(message), 8):
+            block = int.from_bytes(message[start:start + 8], "big") ^ previous
+            encrypted = self._cipher.encrypt(block.to_bytes(8, "big"))
+            previous = int.from_bytes(encrypted, "big")
+            blocks.append(encrypted)
+        return b"".join(blocks)
+
+    def sign(self, merchant_parameters_b64: str, order: str) -> str:
+        digest = hmac.new(
+            self.diversify(order),
+            merchant_parameters_b64.encode("utf-8"),
+            hashlib.sha256,
+        ).digest()
+        return base64.b64encode(digest).decode("utf-8")
+
+    def verify(self, merchant_parameters_b64: str, order: str, signature: str) -> bool:
+        """Compara en tiempo constante la firma recibida (Base64 estándar o URL-safe)."""
+        try:
+            received = normalize_signature(signature)
+        except Exception:
+            return False
+        expected = base64.b64decode(self.sign(merchant_parameters_b64, order))
+        return hmac.compare_digest(expected, received)
+
+    def _sign_chunk(self, chunk: Sequence[Tuple[str, str]]) -> List[str]:
+        return [self.sign(parameters, order) for parameters, order in chunk]
+
+    def _verify_chunk(self, chunk: Sequence[Tuple[str, str, str]]) -> List[bool]:
+        return [self.verify(parameters, order, signature) for parameters, order, signature in chunk]
+
+    def sign_many(
+        self,
+        items: Iterable[Tuple[str, str]],
+        max_workers: Optional[int] = None,
+    ) -> List[str]:
+        """Firma pares (Ds_MerchantParameters, pedido) conservando el orden."""
+        return _run_in_chunks(self._sign_chunk, list(items), max_workers)
+
+    def verify_many(
+        self,
+        items: Iterable[Tuple[str, str, str]],
+        max_workers: Optional[int] = None,
+    ) -> List[bool]:
+        """Verifica tríos (Ds_MerchantParameters, pedido, firma) conservando el orden."""
+        return _run_in_chunks(self._verify_chunk, list(items), max_workers)
+
+
+def _run_in_chunks(worker, items: List[Any], max_workers: Optional[int]) -> List[Any]:
+    if not max_workers or max_workers <= 1 or len(items) <= _BATCH_CHUNK_SIZE:
+        return worker(items)
+
+    chunks = [items[start:start + _BATCH_CHUNK_SIZE] for start in range(0, len(items), _BATCH_CHUNK_SIZE)]
+    results: List[Any] = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk_result in executor.map(worker, chunks):
+            results.extend(chunk_result)
+    return results
+
+
+def get_signer(key_b64: str, variant: str = REDSYS) -> RedsysSigner:
+    """Devuelve el firmador cacheado para la clave (indexado por su huella SHA-256)."""
+    fingerprint = hashlib.sha256(f"{variant}:{key_b64}".encode("utf-8")).hexdigest()
+    cache_key = (variant, fingerprint)
+    signer = _signers.get(cache_key)
+    if signer is not None:
+        return signer
+
+    signer = RedsysSigner(key_b64, variant)
+    with _signers_lock:
+        if len(_signers) >= _MAX_CACHED_SIGNERS:
+            _signers.pop(next(iter(_signers)))
+        _signers[cache_key] = signer
+    return signer
@@ -0,0 +1,24 @@
+"""Lectura de la configuración numérica de las variables de entorno.
+
+Un valor ausente usa el valor por defecto; uno que no se puede convertir también,
+pero se avisa en el log para que la errata no pase desapercibida.
+"""
+
+import logging
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        logging.warning("Valor no válido para %s; se usa %s", name, default)
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        logging.warning("Valor no válido para %s; se usa %s", name, default)
+        return default
@@ -0,0 +1,118 @@
+"""Pool de sesiones HTTP keep-alive compartido por las funciones.
+
+Cada host (esquema + dominio + puerto) tiene su propia `requests.Session`, de
+modo que las llamadas repetidas a un mismo entorno de Business Central, al
+endpoint de tokens o a `trataPeticionREST` reutilizan conexiones TCP/TLS ya
+abiertas en lugar de negociar una nueva en cada petición. Las sesiones no
+guardan cookies: un mismo host atiende a varios clientes (entornos de BC de
+distintos tenants) y las llamadas son sin estado.
+
+Configuración (variables de entorno, todas opcionales):
+- `HTTP_POOL_CONNECTIONS`: número de pools por sesión (por defecto 10).
+- `HTTP_POOL_MAXSIZE`: conexiones keep-alive máximas por host (por defecto 20).
+- `HTTP_TIMEOUT`: timeout por defecto en segundos (por defecto 30).
+- `HTTP_HOST_TIMEOUTS`: JSON `{"host": segundos}` con timeouts por host,
+  por ejemplo `{"login.microsoftonline.com": 10}`.
+"""
+
+import http.cookiejar
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.env import env_float, env_int
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 20
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_host_timeouts: Optional[Dict[str, float]] = None
+
+
+def _load_host_timeouts() -> Dict[str, float]:
+    global _host_timeouts
+    if _host_timeouts is None:
+        raw = os.environ.get("HTTP_HOST_TIMEOUTS")
+        timeouts: Dict[str, float] = {}
+        if raw:
+            try:
+                timeouts = {str(host).lower(): float(value) for host, value in json.loads(raw).items()}
+            except (ValueError, AttributeError, TypeError):
+                logging.warning("HTTP_HOST_TIMEOUTS no es un JSON válido; se ignora")
+        _host_timeouts = timeouts
+    return _host_timeouts
+
+
+def _pool_key(url: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+
+def get_timeout(url: str, timeout: Optional[float] = None) -> float:
+    """Timeout efectivo para `url`: el explícito, el del host o el global."""
+    if timeout:
+        return timeout
+    host = urlparse(url).hostname or ""
+    host_timeout = _load_host_timeouts().get(host.lower())
+    if host_timeout:
+        return host_timeout
+    return env_float("HTTP_TIMEOUT", DEFAULT_TIMEOUT)
+
+
+def pool_maxsize() -> int:
+    """Conexiones keep-alive máximas por host (`HTTP_POOL_MAXSIZE`)."""
+    return env_int("HTTP_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE)
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    # La sesión se comparte entre tenants e hilos: ninguna cookie debe pasar de una petición a otra
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(
+        pool_connections=env_int("HTTP_POOL_CONNECTIONS", DEFAULT_POOL_CONNECTIONS),
+        pool_maxsize=pool_maxsize(),
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """Devuelve la sesión compartida del host de `url`, creándola si no existe."""
+    key = _pool_key(url)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = _build_session()
+        return session
+
+
+def request(method: str, url: str, timeout: Optional[float] = None, **kwargs: Any) -> requests.Response:
+    """Equivalente a `requests.request` usando la sesión keep-alive del host."""
+    return get_session(url).request(method, url, timeout=get_timeout(url, timeout), **kwargs)
+
+
+def post(url: str, timeout: Optional[float] = None, **kwargs: Any) -> requests.Response:
+    return request("POST", url, timeout=timeout, **kwargs)
+
+
+def close_sessions() -> None:
+    """Cierra todas las sesiones abiertas (útil en pruebas o al reciclar el worker)."""
+    global _host_timeouts
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _host_timeouts = None
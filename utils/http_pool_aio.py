@@ -0,0 +1,104 @@
+"""Variante asíncrona de `utils.http_pool` sobre `aiohttp`.
+
+Cada bucle de eventos tiene una `aiohttp.ClientSession` con su propio pool de
+conexiones keep-alive (`HTTP_POOL_MAXSIZE` por host, igual que la variante
+síncrona) y los timeouts se resuelven con `http_pool.get_timeout`. Como en la
+variante síncrona, la sesión no guarda cookies y respeta `HTTPS_PROXY`/`NO_PROXY`.
+
+Las respuestas se devuelven como `requests.Response` ya leídas, de modo que el
+código que las consume (`raise_for_status`, `json()`, `HTTPError`...) es el
+mismo para las llamadas síncronas y las asíncronas.
+
+`aiohttp` se importa al crear la primera sesión y no al cargar el módulo: las
+funciones que solo usan la variante síncrona no pagan su importación en frío.
+"""
+
+import asyncio
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from utils import http_pool
+
+if TYPE_CHECKING:
+    import aiohttp
+
+# Las sesiones quedan ligadas al bucle en el que se crean; al desaparecer el bucle se olvidan
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = (
+    weakref.WeakKeyDictionary()
+)
+_transport_errors: Tuple[type, ...] = ()
+
+
+def transport_errors() -> Tuple[type, ...]:
+    """Errores de conexión y timeout de `aiohttp` (equivalentes a `ConnectionError`/`Timeout`)."""
+    global _transport_errors
+    if not _transport_errors:
+        import aiohttp
+
+        _transport_errors = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+    return _transport_errors
+
+
+def get_session() -> "aiohttp.ClientSession":
+    """Sesión compartida del bucle de eventos actual, creándola si no existe."""
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=http_pool.pool_maxsize())
+        session = _sessions[loop] = aiohttp.ClientSession(
+            connector=connector,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            trust_env=True,
+        )
+    return session
+
+
+def _to_response(method: str, url: str, status: int, reason: Optional[str], headers, content: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.reason = reason or ""
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = content  # pylint: disable=protected-access
+    response.url = url
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.request = requests.Request(method, url).prepare()
+    return response
+
+
+async def request(
+    method: str,
+    url: str,
+    timeout: Optional[float] = None,
+    headers: Optional[Dict[str, str]] = None,
+    data: Any = None,
+    auth: Optional[Tuple[str, str]] = None,
+) -> requests.Response:
+    """Equivalente asíncrono de `http_pool.request` (solo `headers`, `data` y `auth`)."""
+    import aiohttp
+
+    async with get_session().request(
+        method,
+        url,
+        headers=headers,
+        data=data,
+        auth=aiohttp.BasicAuth(*auth) if auth else None,
+        timeout=aiohttp.ClientTimeout(total=http_pool.get_timeout(url, timeout)),
+    ) as response:
+        content = await response.read()
+        return _to_response(method, str(response.url), response.status, response.reason, response.headers, content)
+
+
+async def post(url: str, timeout: Optional[float] = None, **kwargs: Any) -> requests.Response:
+    return await request("POST", url, timeout=timeout, **kwargs)
+
+
+async def close_sessions() -> None:
+    """Cierra la sesión del bucle actual."""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
@@ -0,0 +1,181 @@
+"""Registro de notificaciones RedSys ya entregadas a Business Central.
+
+RedSys reintenta la notificación si no recibe respuesta a tiempo, y cada
+reintento volvía a buscar el pedido y a crear el pago en BC. La huella de una
+notificación es el Ds_Order más el SHA-256 de Ds_MerchantParameters: cuando
+una entrega termina bien se guarda su resultado en `RedsysNotificationLedger`
+(y en una caché en memoria del worker) y las repeticiones devuelven ese
+resultado sin repetir el trabajo.
+
+Solo se registran las entregas correctas; si BC devolvió un error, el
+reintento de RedSys vuelve a intentarlo. Las notificaciones duplicadas que
+llegan a la vez al mismo worker se agrupan en una sola entrega (`run_once`).
+
+Se desactiva con `IDEMPOTENCY_ENABLED=false`.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from utils.cache import TTLCache
+from utils.env import env_int
+from utils.table_storage_sdk import get_table_client, order_index_keys
+
+LEDGER_TABLE_NAME = "RedsysNotificationLedger"
+
+DEFAULT_CACHE_TTL = 3600
+DEFAULT_CACHE_SIZE = 10000
+
+# Las propiedades string de Table Storage admiten 64 KiB (32K caracteres UTF-16)
+_MAX_RESULT_CHARS = 30000
+
+Fingerprint = Tuple[str, str]
+
+
+_results: TTLCache = TTLCache(
+    maxsize=max(1, env_int("IDEMPOTENCY_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+    ttl=env_int("IDEMPOTENCY_CACHE_TTL", DEFAULT_CACHE_TTL),
+)
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_inflight: Dict[Fingerprint, _Flight] = {}
+_inflight_lock = threading.Lock()
+
+
+def idempotency_enabled() -> bool:
+    return os.environ.get("IDEMPOTENCY_ENABLED", "true").lower() not in ("false", "0", "no")
+
+
+def fingerprint(order: str, merchant_parameters_b64: str) -> Fingerprint:
+    digest = hashlib.sha256(merchant_parameters_b64.encode("utf-8")).hexdigest()
+    return order, digest
+
+
+def ledger_keys(notification: Fingerprint) -> Tuple[str, str]:
+    """(PartitionKey, RowKey) de la huella; reparte por pedido como el índice de pedidos."""
+    order, digest = notification
+    partition_key, order_key = order_index_keys(order)
+    return partition_key, f"{order_key}_{digest}"
+
+
+def result_from_entity(entity: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return json.loads(entity.get("Result") or "{}")
+    except ValueError:
+        return {}
+
+
+def ledger_entity(notification: Fingerprint, bc_call_summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila del registro para una entrega correcta."""
+    serialized = json.dumps(bc_call_summary, ensure_ascii=False, separators=(",", ":"))
+    if len(serialized) > _MAX_RESULT_CHARS:
+        serialized = json.dumps(
+            {key: bc_call_summary.get(key) for key in ("status", "method", "url")} | {"truncated": True},
+            ensure_ascii=False,
+        )
+
+    order, digest = notification
+    partition_key, row_key = ledger_keys(notification)
+    return {
+        "PartitionKey": partition_key,
+        "RowKey": row_key,
+        "Order": order,
+        "ParamsHash": digest,
+        "Status": bc_call_summary.get("status", 200),
+        "Result": serialized,
+        "ProcessedAt": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def is_recordable(bc_call_summary: Optional[Dict[str, Any]]) -> bool:
+    return bool(bc_call_summary) and bc_call_summary.get("status", 200) < 400
+
+
+def get_processed(notification: Fingerprint) -> Optional[Dict[str, Any]]:
+    """Resultado de BC de una notificación ya entregada, o None si no consta."""
+    cached = _results.get(notification)
+    if cached is not None:
+        return cached
+
+    partition_key, row_key = ledger_keys(notification)
+    try:
+        entity = get_table_client(LEDGER_TABLE_NAME).get_entity(partition_key, row_key, select=["Result"])
+    except ResourceNotFoundError:
+        return None
+    except Exception as exc:  # pylint: disable=broad-except
+        # Sin registro disponible se procesa la notificación con normalidad
+        logging.warning("No se pudo consultar %s: %s", LEDGER_TABLE_NAME, exc)
+        return None
+
+    result = result_from_entity(entity)
+    _results.set(notification, result)
+    return result
+
+
+def record_processed(notification: Fingerprint, bc_call_summary: Optional[Dict[str, Any]]) -> None:
+    """Guarda el resultado si la entrega fue correcta (estado < 400)."""
+    if not is_recordable(bc_call_summary):
+        return
+
+    _results.set(notification, bc_call_summary)
+    try:
+        get_table_client(LEDGER_TABLE_NAME).upsert_entity(entity=ledger_entity(notification, bc_call_summary))
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.warning(
+            "No se pudo registrar la notificación del pedido %s en %s: %s", notification[0], LEDGER_TABLE_NAME, exc
+        )
+
+
+def run_once(
+    notification: Fingerprint,
+    deliver: Callable[[], Dict[str, Any]],
+) -> Tuple[Dict[str, Any], bool]:
+    """Ejecuta `deliver` una sola vez por huella entre los hilos del worker.
+
+    Quien llega mientras hay otra entrega en curso espera y recibe el mismo
+    resultado (o la misma excepción). Devuelve (resultado, agrupada), donde
+    `agrupada` indica que el resultado viene de la entrega de otra petición.
+    """
+    with _inflight_lock:
+        flight = _inflight.get(notification)
+        leader = flight is None
+        if leader:
+            flight = _inflight[notification] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
+
+    try:
+        flight.result = deliver()
+        record_processed(notification, flight.result)
+    except BaseException as exc:
+        flight.error = exc
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(notification, None)
+        flight.done.set()
+    return flight.result, False
+
+
+def clear_cache() -> None:
+    _results.clear()
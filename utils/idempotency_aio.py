@@ -0,0 +1,96 @@
+"""Variante asíncrona de `utils.idempotency`.
+
+Usa el mismo registro (`RedsysNotificationLedger`) y la misma caché en memoria
+que la versión síncrona, con el cliente de `azure.data.tables.aio`. Las
+notificaciones duplicadas que llegan a la vez al mismo bucle de eventos se
+agrupan en una sola entrega con un `asyncio.Future`.
+"""
+
+import asyncio
+import logging
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from utils.idempotency import (
+    LEDGER_TABLE_NAME,
+    Fingerprint,
+    _results,
+    is_recordable,
+    ledger_entity,
+    ledger_keys,
+    result_from_entity,
+)
+from utils.table_clients import get_async_table_client
+
+_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Fingerprint, asyncio.Future]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+async def get_processed(notification: Fingerprint) -> Optional[Dict[str, Any]]:
+    """Versión asíncrona de `idempotency.get_processed`."""
+    cached = _results.get(notification)
+    if cached is not None:
+        return cached
+
+    partition_key, row_key = ledger_keys(notification)
+    try:
+        table_client = await get_async_table_client(LEDGER_TABLE_NAME)
+        entity = await table_client.get_entity(partition_key, row_key, select=["Result"])
+    except ResourceNotFoundError:
+        return None
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.warning("No se pudo consultar %s: %s", LEDGER_TABLE_NAME, exc)
+        return None
+
+    result = result_from_entity(entity)
+    _results.set(notification, result)
+    return result
+
+
+async def record_processed(notification: Fingerprint, bc_call_summary: Optional[Dict[str, Any]]) -> None:
+    """Versión asíncrona de `idempotency.record_processed`."""
+    if not is_recordable(bc_call_summary):
+        return
+
+    _results.set(notification, bc_call_summary)
+    try:
+        table_client = await get_async_table_client(LEDGER_TABLE_NAME)
+        await table_client.upsert_entity(entity=ledger_entity(notification, bc_call_summary))
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.warning(
+            "No se pudo registrar la notificación del pedido %s en %s: %s", notification[0], LEDGER_TABLE_NAME, exc
+        )
+
+
+async def run_once(
+    notification: Fingerprint,
+    deliver: Callable[[], Awaitable[Dict[str, Any]]],
+) -> Tuple[Dict[str, Any], bool]:
+    """Versión asíncrona de `idempotency.run_once` (mismo valor de retorno)."""
+    loop = asyncio.get_running_loop()
+    inflight = _inflight.setdefault(loop, {})
+    flight = inflight.get(notification)
+    if flight is not None:
+        # shield: si se cancela quien espera, la entrega en curso sigue adelante
+        return await asyncio.shield(flight), True
+
+    flight = inflight[notification] = loop.create_future()
+    try:
+        result = await deliver()
+        await record_processed(notification, result)
+    except asyncio.CancelledError:
+        flight.cancel()
+        raise
+    except BaseException as exc:
+        flight.set_exception(exc)
+        # Se marca como recuperada para no avisar si nadie más la esperaba
+        flight.exception()
+        raise
+    else:
+        flight.set_result(result)
+    finally:
+        inflight.pop(notification, None)
+    return result, False
@@ -0,0 +1,251 @@
+"""Registro de comercios y terminales RedSys.
+
+Permite que un mismo despliegue atienda varios comercios: cada par
+(código de comercio, terminal) tiene su clave, moneda y URL REST. El registro
+se carga una vez por worker desde un fichero JSON (`MERCHANT_REGISTRY_FILE`)
+o desde una tabla (`MERCHANT_REGISTRY_TABLE`), se indexa en memoria con los
+firmadores ya preparados y se recarga cuando cambia. El origen se comprueba
+como mucho cada `MERCHANT_REGISTRY_REFRESH` segundos (60 por defecto): el
+fichero por su fecha de modificación y la tabla por los etags de sus filas.
+Si una recarga falla se sigue usando el registro anterior. Las funciones
+`async def` llaman a `refresh_async` antes de `lookup`, que lee el origen en un
+hilo aparte; en el hilo del bucle de eventos `lookup` solo consulta la memoria.
+
+Formato del fichero (lista o `{"merchants": [...]}`)::
+
+    [{"merchantCode": "263100000", "terminal": "49",
+      "secretKeySetting": "REDSYS_KEY_263100000_49",
+      "currency": "978", "restUrl": "https://sis.redsys.es/sis/rest/trataPeticionREST"}]
+
+En la tabla, PartitionKey es el código de comercio, RowKey el terminal y las
+columnas son `SecretKey`/`SecretKeySetting`, `Currency` y `RestUrl`. Con
+`secretKeySetting` la clave se lee de esa variable de entorno (por ejemplo
+una referencia a Key Vault) en lugar de guardarse junto al registro.
+
+Sin registro configurado, o para comercios que no figuran en él, las funciones
+siguen usando `REDSYS_SHA256_KEY` y el resto de variables de entorno.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from utils import codec
+from utils.crypto import PAYGOLD, REDSYS, RedsysSigner
+from utils.env import env_int
+
+DEFAULT_REFRESH_SECONDS = 60
+
+MerchantKey = Tuple[str, str]
+
+
+class Merchant(NamedTuple):
+    merchant_code: str
+    terminal: str
+    secret_key: str
+    currency: Optional[str]
+    rest_url: Optional[str]
+    notification_signer: RedsysSigner
+    paygold_signer: RedsysSigner
+
+    def __repr__(self) -> str:
+        # Sin la clave: el comercio puede acabar en un log
+        return f"Merchant({self.merchant_code}/{self.terminal})"
+
+
+_merchants: Dict[MerchantKey, Merchant] = {}
+_version: Any = None
+_next_check = 0.0
+_loaded = False
+_lock = threading.Lock()
+
+
+def normalize_terminal(terminal: Any) -> str:
+    """RedSys envía el terminal con o sin ceros a la izquierda ("001" y "1")."""
+    value = str(terminal).strip()
+    if value.isdigit():
+        return value.lstrip("0") or "0"
+    return value
+
+
+def merchant_key(merchant_code: Any, terminal: Any) -> MerchantKey:
+    return str(merchant_code).strip(), normalize_terminal(terminal)
+
+
+def optional_merchant_key(merchant_code: Any, terminal: Any) -> Optional[MerchantKey]:
+    """`merchant_key`, o None si falta el comercio o el terminal."""
+    if not merchant_code or terminal in (None, ""):
+        return None
+    return merchant_key(merchant_code, terminal)
+
+
+def _build_merchant(
+    merchant_code: Any,
+    terminal: Any,
+    secret_key: Optional[str],
+    secret_key_setting: Optional[str],
+    currency: Any,
+    rest_url: Optional[str],
+) -> Optional[Merchant]:
+    if not merchant_code or terminal in (None, ""):
+        logging.warning("Registro de comercios: entrada sin merchantCode o terminal; se ignora")
+        return None
+    if secret_key_setting:
+        secret_key = os.environ.get(secret_key_setting)
+    if not secret_key:
+        logging.warning("Registro de comercios: %s/%s sin clave; se ignora", merchant_code, terminal)
+        return None
+    try:
+        notification_signer = RedsysSigner(secret_key, REDSYS)
+        paygold_signer = RedsysSigner(secret_key, PAYGOLD)
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.warning("Registro de comercios: clave inválida para %s/%s: %s", merchant_code, terminal, exc)
+        return None
+    code, normalized_terminal = merchant_key(merchant_code, terminal)
+    return Merchant(
+        merchant_code=code,
+        terminal=normalized_terminal,
+        secret_key=secret_key,
+        currency=str(currency) if currency else None,
+        rest_url=rest_url or None,
+        notification_signer=notification_signer,
+        paygold_signer=paygold_signer,
+    )
+
+
+def _index(merchants: Iterable[Optional[Merchant]]) -> Dict[MerchantKey, Merchant]:
+    return {
+        (merchant.merchant_code, merchant.terminal): merchant
+        for merchant in merchants
+        if merchant is not None
+    }
+
+
+def _load_file(path: str) -> Dict[MerchantKey, Merchant]:
+    with open(path, "rb") as handle:
+        data = codec.loads(handle.read())
+    entries = data.get("merchants", []) if isinstance(data, dict) else data
+    return _index(
+        _build_merchant(
+            entry.get("merchantCode"),
+            entry.get("terminal"),
+            entry.get("secretKey"),
+            entry.get("secretKeySetting"),
+            entry.get("currency"),
+            entry.get("restUrl"),
+        )
+        for entry in entries
+        if isinstance(entry, dict)
+    )
+
+
+def _load_table(entities: Iterable[Dict[str, Any]]) -> Dict[MerchantKey, Merchant]:
+    return _index(
+        _build_merchant(
+            entity["PartitionKey"],
+            entity["RowKey"],
+            entity.get("SecretKey"),
+            entity.get("SecretKeySetting"),
+            entity.get("Currency"),
+            entity.get("RestUrl"),
+        )
+        for entity in entities
+    )
+
+
+def _table_version(table_name: str, entities: Iterable[Any]) -> Tuple[Any, ...]:
+    # Cualquier alta, baja o modificación cambia el conjunto de etags
+    return (
+        "table",
+        table_name,
+        tuple(sorted(
+            (entity["PartitionKey"], entity["RowKey"], str(getattr(entity, "metadata", {}).get("etag")))
+            for entity in entities
+        )),
+    )
+
+
+def _refresh() -> None:
+    """Recarga el registro si su origen ha cambiado."""
+    global _merchants, _version
+
+    path = os.environ.get("MERCHANT_REGISTRY_FILE")
+    table_name = os.environ.get("MERCHANT_REGISTRY_TABLE")
+    if path:
+        version: Any = ("file", path, os.stat(path).st_mtime_ns)
+        if version == _version:
+            return
+        merchants = _load_file(path)
+    elif table_name:
+        from utils.table_clients import get_table_client
+
+        entities = list(get_table_client(table_name).list_entities())
+        version = _table_version(table_name, entities)
+        if version == _version:
+            return
+        merchants = _load_table(entities)
+    else:
+        version, merchants = None, {}
+
+    if version != _version:
+        if version is not None:
+            logging.info("Registro de comercios cargado: %s terminales (%s)", len(merchants), version[0])
+        _merchants, _version = merchants, version
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _registry() -> Dict[MerchantKey, Merchant]:
+    global _next_check, _loaded
+
+    now = time.monotonic()
+    # Solo un hilo recarga; el resto sigue con el registro vigente mientras tanto
+    # (salvo en la primera carga, que todos esperan). En el bucle de eventos no se
+    # recarga: leer la tabla lo bloquearía, y de eso se encarga refresh_async
+    if now >= _next_check and not (_loaded and _on_event_loop()) and _lock.acquire(blocking=not _loaded):
+        try:
+            if now >= _next_check:
+                _next_check = now + env_int("MERCHANT_REGISTRY_REFRESH", DEFAULT_REFRESH_SECONDS)
+                try:
+                    _refresh()
+                except Exception as exc:  # pylint: disable=broad-except
+                    logging.warning("No se pudo recargar el registro de comercios: %s", exc)
+                _loaded = True
+        finally:
+            _lock.release()
+    return _merchants
+
+
+def lookup(merchant_code: Any, terminal: Any) -> Optional[Merchant]:
+    """Comercio registrado para (Ds_MerchantCode, Ds_Terminal), o None."""
+    if not merchant_code or terminal in (None, ""):
+        return None
+    return _registry().get(merchant_key(merchant_code, terminal))
+
+
+async def refresh_async() -> None:
+    """Recarga el registro en un hilo aparte si toca comprobar su origen (para las funciones `async def`)."""
+    if time.monotonic() >= _next_check:
+        await asyncio.to_thread(_registry)
+
+
+def reload() -> None:
+    """Fuerza la recarga en la siguiente consulta (pruebas o cambio de configuración)."""
+    global _version, _next_check
+    with _lock:
+        _version = None
+        _next_check = 0.0
+
+
+def preload() -> int:
+    """Carga el registro si aún no se ha cargado (función Warmup). Devuelve los terminales registrados."""
+    return len(_registry())
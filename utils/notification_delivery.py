@@ -0,0 +1,389 @@
+"""Entrega de notificaciones RedSys verificadas a Business Central.
+
+Lo usan tanto `DecryptAndRedirect` (entrega en línea) como `DeliverNotification`
+(entrega diferida desde la cola de notificaciones).
+"""
+
+import logging
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import unquote
+
+from requests import HTTPError
+
+from utils import codec, timing
+from utils.bc_client import (
+    BatchNotSupportedError,
+    BusinessCentralError,
+    CircuitOpenError,
+    batch_supported,
+    call_business_central,
+    call_business_central_batch,
+    split_bc_url,
+)
+from utils.crypto import decode_redsys_parameters, decrypt_secret
+
+# Estados de BC que indican un fallo transitorio y justifican reintentar la entrega
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class CredentialsError(Exception):
+    """No se pudieron descifrar las credenciales de Business Central guardadas."""
+
+
+def decode_notification_parameters(merchant_parameters_b64: str) -> Dict[str, Any]:
+    """Decodifica Ds_MerchantParameters y deshace el URL-encoding de sus valores."""
+    decoded_params_raw = decode_redsys_parameters(merchant_parameters_b64)
+    return {
+        key: unquote(value) if isinstance(value, str) else value
+        for key, value in decoded_params_raw.items()
+    }
+
+
+def parse_amount(amount_value: str | None) -> float | None:
+    if not amount_value:
+        return None
+    try:
+        return float(Decimal(amount_value) / Decimal("100"))
+    except Exception:  # pylint: disable=broad-except
+        logging.warning("No se pudo convertir Ds_Amount='%s'", amount_value)
+        return None
+
+
+def parse_datetime(date_value: str | None, hour_value: str | None) -> str | None:
+    if not date_value or not hour_value:
+        return None
+    try:
+        dt = datetime.strptime(f"{date_value} {hour_value}", "%d/%m/%Y %H:%M")
+        return dt.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z")
+    except ValueError:
+        logging.warning("No se pudo convertir fecha/hora '%s' '%s'", date_value, hour_value)
+        return None
+
+
+def build_bc_payload(
+    decoded_params: Dict[str, Any],
+    signature: str,
+    order: str,
+    params_json: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Construye el payload para Business Central.
+    
+    Envía exactamente lo que RedSys manda (decoded_params) como un string JSON
+    en el campo 'paymentInfo'. Esto hace la solución transparente a cambios
+    en los campos de RedSys.
+    
+    Args:
+        decoded_params: Parámetros decodificados de RedSys (tal cual los envía)
+        signature: Firma recibida de RedSys
+        order: Número de pedido
+        params_json: decoded_params ya serializado, si quien llama lo tiene
+        
+    Returns:
+        Diccionario con un único campo 'paymentInfo' conteniendo el JSON string
+    """
+    # Enviar exactamente lo que RedSys manda, sin transformaciones
+    # Esto hace la AF transparente a cambios en los campos de RedSys
+    return {
+        "paymentInfo": params_json if params_json is not None else codec.dumps(decoded_params)
+    }
+
+
+def escape_odata_key(value: str) -> str:
+    return value.replace("'", "''")
+
+
+def stream_path(relative_resource: Optional[str], order: str, stream_name: str) -> Optional[str]:
+    """Ruta OData del stream `stream_name` del registro `order`, o None si no hay recurso."""
+    if not relative_resource:
+        return None
+    escaped_order = escape_odata_key(order)
+    normalized_resource = relative_resource.strip("/")
+    if not normalized_resource:
+        return None
+    return f"{normalized_resource}" f"('{escaped_order}')/{stream_name}/$value"
+
+
+def upload_stream_property(
+    entity: Dict[str, Any],
+    relative_resource: Optional[str],
+    order: str,
+    stream_name: str,
+    content: str,
+    content_type: str,
+) -> None:
+    path = stream_path(relative_resource, order, stream_name)
+    if not path:
+        return
+    call_business_central(
+        entity,
+        method="PUT",
+        relative_path=path,
+        payload=content,
+        headers={"Content-Type": content_type},
+    )
+
+
+def _batch_enabled() -> bool:
+    return os.environ.get("BC_BATCH_ENABLED", "true").lower() not in ("false", "0", "no")
+
+
+def use_batch(entity: Dict[str, Any], bc_method: str, relative_path: Optional[str]) -> bool:
+    return bool(
+        bc_method == "POST"
+        and relative_path
+        and relative_path.strip("/")
+        and _batch_enabled()
+        and batch_supported(entity)
+    )
+
+
+def batch_operations(
+    relative_path: str,
+    bc_payload: Dict[str, Any],
+    json_payload: str,
+    ds_params_b64: str,
+) -> List[Dict[str, Any]]:
+    """Operaciones del changeset: crear el registro y subir ambos streams."""
+    return [
+        {"method": "POST", "path": relative_path.strip("/"), "payload": bc_payload},
+        {
+            "method": "PUT",
+            "path": "$1/jsonPayload/$value",
+            "payload": json_payload,
+            "headers": {"Content-Type": "application/json; charset=utf-8"},
+        },
+        {
+            "method": "PUT",
+            "path": "$1/rawParameters/$value",
+            "payload": ds_params_b64,
+            "headers": {"Content-Type": "text/plain; charset=utf-8"},
+        },
+    ]
+
+
+def batch_post_response(responses: List[Any]):
+    """Respuesta del POST del changeset, o None si BC lo rechazó en bloque.
+
+    En ese caso no se ha confirmado nada y se puede repetir secuencialmente.
+    """
+    if len(responses) < 3:
+        failed = responses[0] if responses else None
+        logging.warning(
+            "Business Central rechazó el changeset $batch (%s); se reintenta en llamadas separadas",
+            failed.status_code if failed is not None else "sin respuesta",
+        )
+        return None
+    return responses[0]
+
+
+def _post_with_streams_batch(
+    entity: Dict[str, Any],
+    relative_path: str,
+    bc_payload: Dict[str, Any],
+    json_payload: str,
+    ds_params_b64: str,
+):
+    """Crea el registro y sube ambos streams en un único changeset $batch."""
+    responses = call_business_central_batch(
+        entity,
+        batch_operations(relative_path, bc_payload, json_payload, ds_params_b64),
+    )
+    return batch_post_response(responses)
+
+
+def post_with_streams(
+    entity: Dict[str, Any],
+    bc_method: str,
+    relative_path: Optional[str],
+    bc_payload: Dict[str, Any],
+    order: str,
+    decoded_params: Dict[str, Any],
+    ds_params_b64: str,
+    json_payload: Optional[str] = None,
+):
+    """Envía la notificación a BC y, si es un POST correcto, sube los streams.
+
+    Si el endpoint admite OData $batch, las tres operaciones viajan en una sola
+    petición HTTP; en caso contrario se usan llamadas secuenciales.
+    `json_payload` es `decoded_params` ya serializado (se calcula si falta).
+    """
+    if json_payload is None:
+        json_payload = codec.dumps(decoded_params)
+
+    if use_batch(entity, bc_method, relative_path):
+        try:
+            with timing.stage("bc_batch"):
+                bc_response = _post_with_streams_batch(entity, relative_path, bc_payload, json_payload, ds_params_b64)
+            if bc_response is not None:
+                return bc_response
+        except BatchNotSupportedError as exc:
+            logging.info("%s Se usan llamadas secuenciales.", exc)
+
+    with timing.stage("bc_post"):
+        bc_response = call_business_central(
+            entity,
+            method=bc_method,
+            relative_path=relative_path,
+            payload=bc_payload,
+        )
+
+    if bc_method == "POST" and bc_response.status_code < 400:
+        with timing.stage("bc_streams"):
+            try:
+                upload_stream_property(
+                    entity,
+                    relative_path,
+                    order,
+                    "jsonPayload",
+                    json_payload,
+                    "application/json; charset=utf-8",
+                )
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("No se pudo subir jsonPayload a Business Central")
+            try:
+                upload_stream_property(
+                    entity,
+                    relative_path,
+                    order,
+                    "rawParameters",
+                    ds_params_b64,
+                    "text/plain; charset=utf-8",
+                )
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("No se pudo subir rawParameters a Business Central")
+
+    return bc_response
+
+
+class DeliveryPlan(NamedTuple):
+    """Lo que `deliver_notification` necesita para llamar a BC y resumir el resultado."""
+
+    entity: Dict[str, Any]
+    method: str
+    relative_path: Optional[str]
+    path: str
+    final_url: str
+    payload: Dict[str, Any]
+    params_json: str
+
+
+def plan_delivery(
+    entity: Dict[str, Any],
+    decoded_params: Dict[str, Any],
+    ds_signature: str,
+    ds_order: str,
+) -> DeliveryPlan:
+    """Resuelve endpoint, método y credenciales de la entrega.
+
+    Raises:
+        CredentialsError: si no se pueden descifrar las credenciales guardadas.
+    """
+    # Se serializa una vez para paymentInfo y para el stream jsonPayload
+    params_json = codec.dumps(decoded_params)
+    bc_payload = build_bc_payload(decoded_params, ds_signature, ds_order, params_json)
+    endpoint_url = entity.get("URLBC", "")
+    base_url, relative_path = split_bc_url(endpoint_url)
+    legacy_path = entity.get("BCPath")
+    if not relative_path and legacy_path:
+        relative_path = legacy_path
+    bc_path = relative_path or legacy_path or ""
+    call_entity = dict(entity)
+    call_entity["URLBC"] = base_url or endpoint_url
+    bc_method = (entity.get("BCMethod") or "POST").upper()
+    if call_entity.get("PassEncrypted") and call_entity.get("Pass") and call_entity.get("EncryptKey"):
+        try:
+            with timing.stage("decrypt"):
+                call_entity["Pass"] = decrypt_secret(call_entity["Pass"], call_entity["EncryptKey"])
+        except Exception as exc:
+            logging.exception("No se pudo descifrar las credenciales de Business Central")
+            raise CredentialsError(str(exc)) from exc
+    final_url = endpoint_url
+    if relative_path and (base_url or endpoint_url):
+        base_for_summary = base_url or endpoint_url
+        final_url = f"{base_for_summary.rstrip('/')}/{relative_path.lstrip('/')}"
+
+    return DeliveryPlan(call_entity, bc_method, relative_path, bc_path, final_url, bc_payload, params_json)
+
+
+def summarize_response(plan: DeliveryPlan, bc_response) -> Dict[str, Any]:
+    """Resumen de una respuesta correcta de BC; lanza HTTPError si es un error."""
+    try:
+        bc_content = bc_response.json()
+    except ValueError:
+        bc_content = {"raw": bc_response.text}
+
+    bc_call_summary = {
+        "status": bc_response.status_code,
+        "method": plan.method,
+        "url": plan.final_url,
+        "payload": bc_content,
+    }
+    bc_response.raise_for_status()
+    return bc_call_summary
+
+
+def summarize_error(plan: DeliveryPlan, exc: Exception) -> Dict[str, Any]:
+    """Resumen de una entrega fallida. Debe llamarse desde el bloque `except`."""
+    if isinstance(exc, HTTPError):
+        status_code = exc.response.status_code if exc.response is not None else 502
+        body = exc.response.text if exc.response is not None else str(exc)
+        logging.error("Business Central devolvió error %s: %s", status_code, body)
+    elif isinstance(exc, CircuitOpenError):
+        # Sin llamar a BC: se responde al momento y el reintento llega por la cola o por RedSys
+        logging.warning("Entrega a Business Central omitida: %s", exc)
+        status_code, body = 503, str(exc)
+    elif isinstance(exc, BusinessCentralError):
+        logging.error("Error de configuración para Business Central: %s", exc)
+        status_code, body = 400, str(exc)
+    else:
+        logging.exception("Error llamando a Business Central")
+        status_code, body = 500, str(exc)
+    return {
+        "status": status_code,
+        "method": plan.method,
+        "path": plan.path,
+        "error": body,
+        "sentPayload": plan.payload,
+    }
+
+
+def deliver_notification(
+    entity: Dict[str, Any],
+    decoded_params: Dict[str, Any],
+    ds_params_b64: str,
+    ds_signature: str,
+    ds_order: str,
+) -> Dict[str, Any]:
+    """Envía una notificación ya verificada a Business Central.
+
+    Returns:
+        Resumen de la llamada (`status`, `method` y `payload` o `error`).
+
+    Raises:
+        CredentialsError: si no se pueden descifrar las credenciales guardadas.
+    """
+    plan = plan_delivery(entity, decoded_params, ds_signature, ds_order)
+    try:
+        bc_response = post_with_streams(
+            plan.entity,
+            plan.method,
+            plan.relative_path,
+            plan.payload,
+            ds_order,
+            decoded_params,
+            ds_params_b64,
+            plan.params_json,
+        )
+        return summarize_response(plan, bc_response)
+    except Exception as exc:  # pylint: disable=broad-except
+        return summarize_error(plan, exc)
+
+
+def is_retryable(bc_call_summary: Optional[Dict[str, Any]]) -> bool:
+    """Indica si un resumen de `deliver_notification` corresponde a un fallo transitorio."""
+    if not bc_call_summary:
+        return False
+    return bc_call_summary.get("status", 200) in RETRYABLE_STATUS
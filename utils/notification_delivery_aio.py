@@ -0,0 +1,134 @@
+"""Variante asíncrona de `utils.notification_delivery`.
+
+Resuelve la entrega con los mismos helpers (`plan_delivery`,
+`batch_operations`, `summarize_response`...) y llama a BC con
+`utils.bc_client_aio`. Los dos streams de la ruta secuencial se suben a la vez.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from utils import codec, timing
+from utils.bc_client import BatchNotSupportedError
+from utils.bc_client_aio import call_business_central, call_business_central_batch
+from utils.notification_delivery import (
+    batch_operations,
+    batch_post_response,
+    plan_delivery,
+    stream_path,
+    summarize_error,
+    summarize_response,
+    use_batch,
+)
+
+
+async def upload_stream_property(
+    entity: Dict[str, Any],
+    relative_resource: Optional[str],
+    order: str,
+    stream_name: str,
+    content: str,
+    content_type: str,
+) -> None:
+    path = stream_path(relative_resource, order, stream_name)
+    if not path:
+        return
+    try:
+        await call_business_central(
+            entity,
+            method="PUT",
+            relative_path=path,
+            payload=content,
+            headers={"Content-Type": content_type},
+        )
+    except Exception:  # pylint: disable=broad-except
+        logging.exception("No se pudo subir %s a Business Central", stream_name)
+
+
+async def post_with_streams(
+    entity: Dict[str, Any],
+    bc_method: str,
+    relative_path: Optional[str],
+    bc_payload: Dict[str, Any],
+    order: str,
+    decoded_params: Dict[str, Any],
+    ds_params_b64: str,
+    json_payload: Optional[str] = None,
+):
+    """Versión asíncrona de `notification_delivery.post_with_streams`."""
+    if json_payload is None:
+        json_payload = codec.dumps(decoded_params)
+
+    if use_batch(entity, bc_method, relative_path):
+        try:
+            with timing.stage("bc_batch"):
+                responses = await call_business_central_batch(
+                    entity,
+                    batch_operations(relative_path, bc_payload, json_payload, ds_params_b64),
+                )
+                bc_response = batch_post_response(responses)
+            if bc_response is not None:
+                return bc_response
+        except BatchNotSupportedError as exc:
+            logging.info("%s Se usan llamadas secuenciales.", exc)
+
+    with timing.stage("bc_post"):
+        bc_response = await call_business_central(
+            entity,
+            method=bc_method,
+            relative_path=relative_path,
+            payload=bc_payload,
+        )
+
+    if bc_method == "POST" and bc_response.status_code < 400:
+        with timing.stage("bc_streams"):
+            await asyncio.gather(
+                upload_stream_property(
+                    entity,
+                    relative_path,
+                    order,
+                    "jsonPayload",
+                    json_payload,
+                    "application/json; charset=utf-8",
+                ),
+                upload_stream_property(
+                    entity,
+                    relative_path,
+                    order,
+                    "rawParameters",
+                    ds_params_b64,
+                    "text/plain; charset=utf-8",
+                ),
+            )
+
+    return bc_response
+
+
+async def deliver_notification(
+    entity: Dict[str, Any],
+    decoded_params: Dict[str, Any],
+    ds_params_b64: str,
+    ds_signature: str,
+    ds_order: str,
+) -> Dict[str, Any]:
+    """Versión asíncrona de `notification_delivery.deliver_notification`.
+
+    Raises:
+        CredentialsError: si no se pueden descifrar las credenciales guardadas.
+    """
+    plan = plan_delivery(entity, decoded_params, ds_signature, ds_order)
+    try:
+        bc_response = await post_with_streams(
+            plan.entity,
+            plan.method,
+            plan.relative_path,
+            plan.payload,
+            ds_order,
+            decoded_params,
+            ds_params_b64,
+            plan.params_json,
+        )
+        return summarize_response(plan, bc_response)
+    except Exception as exc:  # pylint: disable=broad-except
+        return summarize_error(plan, exc)
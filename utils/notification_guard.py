@@ -0,0 +1,130 @@
+"""Rechazo barato de notificaciones falsificadas, mal formadas o de pedidos desconocidos.
+
+DecryptAndRedirect comprueba la firma antes de tocar Table Storage, pero el
+tráfico basura sigue costando el parseo, la decodificación y la firma. Este
+módulo guarda en memoria del worker lo necesario para cortarlo antes:
+
+- las notificaciones cuya firma no era válida (huella SHA-256 de
+  `Ds_MerchantParameters` + `Ds_Signature`), durante
+  `NOTIFICATION_REJECT_CACHE_TTL` segundos (300);
+- los pedidos con firma válida que no están registrados (por comercio,
+  terminal y número de pedido, como el índice de pedidos), durante
+  `NOTIFICATION_UNKNOWN_ORDER_TTL` segundos (30; poco, porque el pedido puede
+  registrarse en otro worker justo después);
+- un token bucket por IP de origen que solo gasta fichas con las peticiones
+  rechazadas (400/401): `NOTIFICATION_REJECT_BURST` rechazos seguidos (20) y
+  después `NOTIFICATION_REJECT_RATE` por segundo (1). Cuando un origen lo
+  agota, sus peticiones reciben 429 antes de parsear, decodificar o firmar
+  nada. Las notificaciones con firma válida no gastan fichas.
+
+La IP de origen es la que el front-end de la plataforma añade al final de
+`X-Forwarded-For`; las entradas anteriores las controla el cliente y no se
+usan, así que un falsificador solo puede agotar el cupo de su propia IP (no el
+de RedSys). Si hay proxies propios delante (Front Door, Application Gateway),
+`NOTIFICATION_TRUSTED_PROXIES` indica cuántos saltos finales descartar.
+
+Un TTL o una tasa `0` desactiva la parte correspondiente.
+"""
+
+import hashlib
+import logging
+from typing import Hashable, Mapping, Optional
+
+from utils.cache import TTLCache
+from utils.env import env_float, env_int
+from utils.rate_limit import RateLimiter
+
+DEFAULT_REJECT_CACHE_TTL = 300
+DEFAULT_REJECT_CACHE_SIZE = 10000
+DEFAULT_UNKNOWN_ORDER_TTL = 30
+DEFAULT_REJECT_RATE = 1.0
+DEFAULT_REJECT_BURST = 20
+DEFAULT_MAX_SOURCES = 10000
+DEFAULT_TRUSTED_PROXIES = 0
+
+
+_cache_size = max(1, env_int("NOTIFICATION_REJECT_CACHE_SIZE", DEFAULT_REJECT_CACHE_SIZE))
+_reject_ttl = env_int("NOTIFICATION_REJECT_CACHE_TTL", DEFAULT_REJECT_CACHE_TTL)
+_unknown_order_ttl = env_int("NOTIFICATION_UNKNOWN_ORDER_TTL", DEFAULT_UNKNOWN_ORDER_TTL)
+_forged: TTLCache = TTLCache(maxsize=_cache_size, ttl=_reject_ttl)
+_unknown_orders: TTLCache = TTLCache(maxsize=_cache_size, ttl=_unknown_order_ttl)
+
+_reject_rate = env_float("NOTIFICATION_REJECT_RATE", DEFAULT_REJECT_RATE)
+_limiter: Optional[RateLimiter] = (
+    RateLimiter(
+        rate=_reject_rate,
+        burst=max(1, env_int("NOTIFICATION_REJECT_BURST", DEFAULT_REJECT_BURST)),
+        maxsize=max(1, env_int("NOTIFICATION_REJECT_SOURCES", DEFAULT_MAX_SOURCES)),
+    )
+    if _reject_rate > 0
+    else None
+)
+_trusted_proxies = max(0, env_int("NOTIFICATION_TRUSTED_PROXIES", DEFAULT_TRUSTED_PROXIES))
+
+
+def source_address(headers: Mapping[str, str]) -> Optional[str]:
+    """IP del cliente: el salto de `X-Forwarded-For` añadido por el último proxy de confianza.
+
+    El front-end de Functions añade `ip:puerto` al final de la cabecera; lo que
+    haya a su izquierda puede venir del propio cliente.
+    """
+    forwarded = headers.get("x-forwarded-for") or headers.get("X-Forwarded-For")
+    if not forwarded:
+        return None
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    if len(hops) <= _trusted_proxies:
+        return None
+    address = hops[-1 - _trusted_proxies]
+    if address.startswith("["):
+        # IPv6 con puerto: [::1]:443
+        return address[1:address.find("]")] if "]" in address else address
+    if address.count(":") == 1:
+        address = address.split(":")[0]
+    return address or None
+
+
+def throttled(source: Optional[str]) -> float:
+    """Segundos que `source` debe esperar por exceso de rechazos (0 si no está limitado)."""
+    if _limiter is None or source is None:
+        return 0.0
+    return _limiter.retry_after(source)
+
+
+def record_rejection(source: Optional[str]) -> None:
+    if _limiter is not None and source is not None and not _limiter.consume(source):
+        logging.warning("Origen %s limitado por exceso de notificaciones rechazadas", source)
+
+
+def _notification_key(ds_params_b64: str, ds_signature: str) -> str:
+    digest = hashlib.sha256(ds_params_b64.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(ds_signature.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def known_forgery(ds_params_b64: str, ds_signature: str) -> bool:
+    """True si esta notificación ya se rechazó hace poco por firma no válida."""
+    return _reject_ttl > 0 and _forged.get(_notification_key(ds_params_b64, ds_signature)) is not None
+
+
+def remember_forgery(ds_params_b64: str, ds_signature: str) -> None:
+    if _reject_ttl > 0:
+        _forged.set(_notification_key(ds_params_b64, ds_signature), True)
+
+
+def unknown_order(owner: Optional[Hashable], ds_order: str) -> bool:
+    """True si el pedido `ds_order` del comercio `owner` se buscó hace poco y no estaba registrado."""
+    return _unknown_order_ttl > 0 and _unknown_orders.get((owner, ds_order)) is not None
+
+
+def remember_unknown_order(owner: Optional[Hashable], ds_order: str) -> None:
+    if _unknown_order_ttl > 0:
+        _unknown_orders.set((owner, ds_order), True)
+
+
+def clear() -> None:
+    """Olvida las notificaciones rechazadas, los pedidos desconocidos y los límites por origen."""
+    _forged.clear()
+    _unknown_orders.clear()
+    if _limiter is not None:
+        _limiter.clear()
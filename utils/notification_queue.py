@@ -0,0 +1,198 @@
+"""Cola de notificaciones RedSys pendientes de entregar a Business Central.
+
+Con `NOTIFICATION_DELIVERY_MODE=queue`, DecryptAndRedirect responde a RedSys en
+cuanto la firma es válida y deja la notificación en la cola
+`redsys-notifications`. La función `DeliverNotification` la consume, reintenta
+con backoff exponencial los fallos transitorios y, cuando se agotan los
+intentos o el error es definitivo, la mueve a `redsys-notifications-poison`.
+Mientras el circuito de BC está abierto los mensajes se aplazan sin gastar
+intentos, pero como mucho `NOTIFICATION_MAX_DEFERRALS` veces (120, algo más de
+una hora con el circuito por defecto); después también van a poison.
+
+Funciona igual contra Azurite (`AzureWebJobsStorage=UseDevelopmentStorage=true`).
+Los mensajes no incluyen credenciales: el worker vuelve a leer la entidad del
+pedido en Table Storage.
+
+`azure.storage.queue` se importa al crear el primer cliente: en modo `sync`
+DecryptAndRedirect solo lo necesita si el circuito de BC está abierto.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import weakref
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Dict, Set
+
+from azure.core.exceptions import ResourceExistsError
+
+from utils.env import env_int
+
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueClient
+
+# Deben coincidir con el binding de DeliverNotification/function.json
+NOTIFICATION_QUEUE_NAME = "redsys-notifications"
+POISON_QUEUE_NAME = f"{NOTIFICATION_QUEUE_NAME}-poison"
+
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_BACKOFF_BASE = 15
+DEFAULT_BACKOFF_MAX = 900
+DEFAULT_MAX_DEFERRALS = 120
+
+_queue_clients: "Dict[str, QueueClient]" = {}
+_lock = threading.Lock()
+
+# Clientes de `azure.storage.queue.aio`, ligados al bucle de eventos en el que se crean;
+# al desaparecer el bucle se olvidan
+_async_queue_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+# Colas ya creadas desde la variante asíncrona (como `table_clients._async_provisioned`)
+_async_created: Set[str] = set()
+
+
+def queue_mode_enabled() -> bool:
+    return os.environ.get("NOTIFICATION_DELIVERY_MODE", "sync").lower() == "queue"
+
+
+def max_attempts() -> int:
+    return env_int("NOTIFICATION_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+
+
+def max_deferrals() -> int:
+    return env_int("NOTIFICATION_MAX_DEFERRALS", DEFAULT_MAX_DEFERRALS)
+
+
+def backoff_seconds(attempt: int) -> int:
+    """Retardo antes del intento `attempt` (1, 2, ...): exponencial con jitter."""
+    base = env_int("NOTIFICATION_BACKOFF_BASE", DEFAULT_BACKOFF_BASE)
+    cap = env_int("NOTIFICATION_BACKOFF_MAX", DEFAULT_BACKOFF_MAX)
+    delay = min(cap, base * (2 ** max(attempt - 1, 0)))
+    return int(random.uniform(delay / 2, delay))
+
+
+def get_queue_client(queue_name: str = NOTIFICATION_QUEUE_NAME) -> "QueueClient":
+    queue_client = _queue_clients.get(queue_name)
+    if queue_client is not None:
+        return queue_client
+
+    with _lock:
+        queue_client = _queue_clients.get(queue_name)
+        if queue_client is None:
+            from azure.storage.queue import QueueClient, TextBase64DecodePolicy, TextBase64EncodePolicy
+
+            connection_string = os.environ.get("AzureWebJobsStorage")
+            if not connection_string:
+                raise ValueError("AzureWebJobsStorage no está configurado")
+            # El trigger de cola de Functions espera los mensajes en Base64
+            queue_client = QueueClient.from_connection_string(
+                conn_str=connection_string,
+                queue_name=queue_name,
+                message_encode_policy=TextBase64EncodePolicy(),
+                message_decode_policy=TextBase64DecodePolicy(),
+            )
+            try:
+                queue_client.create_queue()
+            except ResourceExistsError:
+                pass
+            _queue_clients[queue_name] = queue_client
+        return queue_client
+
+
+async def get_async_queue_client(queue_name: str = NOTIFICATION_QUEUE_NAME):
+    """Variante asíncrona de `get_queue_client`, cacheada por bucle de eventos."""
+    from azure.storage.queue import TextBase64DecodePolicy, TextBase64EncodePolicy
+    from azure.storage.queue.aio import QueueClient as AsyncQueueClient
+
+    loop_clients = _async_queue_clients.setdefault(asyncio.get_running_loop(), {})
+    queue_client = loop_clients.get(queue_name)
+    if queue_client is not None:
+        return queue_client
+
+    connection_string = os.environ.get("AzureWebJobsStorage")
+    if not connection_string:
+        raise ValueError("AzureWebJobsStorage no está configurado")
+    queue_client = AsyncQueueClient.from_connection_string(
+        conn_str=connection_string,
+        queue_name=queue_name,
+        message_encode_policy=TextBase64EncodePolicy(),
+        message_decode_policy=TextBase64DecodePolicy(),
+    )
+    if queue_name not in _async_created:
+        try:
+            await queue_client.create_queue()
+        except ResourceExistsError:
+            pass
+        _async_created.add(queue_name)
+    # Otra corrutina pudo registrar el suyo mientras se creaba la cola: se usa ese y se cierra este
+    registered = loop_clients.setdefault(queue_name, queue_client)
+    if registered is not queue_client:
+        await queue_client.close()
+    return registered
+
+
+def build_message(ds_params_b64: str, ds_signature: str, ds_order: str) -> Dict[str, Any]:
+    return {
+        "order": ds_order,
+        "merchantParameters": ds_params_b64,
+        "signature": ds_signature,
+        "attempt": 0,
+        "receivedAt": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def enqueue_notification(message: Dict[str, Any], delay_seconds: int = 0) -> None:
+    get_queue_client().send_message(
+        json.dumps(message, ensure_ascii=False),
+        visibility_timeout=delay_seconds or None,
+    )
+
+
+async def enqueue_notification_async(message: Dict[str, Any], delay_seconds: int = 0) -> None:
+    queue_client = await get_async_queue_client()
+    await queue_client.send_message(
+        json.dumps(message, ensure_ascii=False),
+        visibility_timeout=delay_seconds or None,
+    )
+
+
+def schedule_retry(message: Dict[str, Any], last_result: Dict[str, Any] | None) -> bool:
+    """Reencola el mensaje con backoff. Devuelve False si ya no quedan intentos."""
+    attempt = int(message.get("attempt", 0)) + 1
+    if attempt >= max_attempts():
+        return False
+    retry_message = dict(message, attempt=attempt, lastResult=last_result)
+    delay = backoff_seconds(attempt)
+    enqueue_notification(retry_message, delay_seconds=delay)
+    logging.warning(
+        "Entrega a BC del pedido %s reprogramada (intento %s) en %s s",
+        message.get("order"),
+        attempt + 1,
+        delay,
+    )
+    return True
+
+
+def schedule_deferral(message: Dict[str, Any], delay_seconds: int) -> bool:
+    """Reencola el mensaje sin gastar un intento. Devuelve False si ya no quedan aplazamientos."""
+    deferrals = int(message.get("deferrals", 0)) + 1
+    if deferrals > max_deferrals():
+        return False
+    enqueue_notification(dict(message, deferrals=deferrals), delay_seconds=delay_seconds)
+    logging.warning(
+        "Business Central no disponible; pedido %s aplazado %s s (aplazamiento %s)",
+        message.get("order"),
+        delay_seconds,
+        deferrals,
+    )
+    return True
+
+
+def send_to_poison(message: Dict[str, Any], reason: str, last_result: Dict[str, Any] | None = None) -> None:
+    poison_message = dict(message, reason=reason, lastResult=last_result)
+    get_queue_client(POISON_QUEUE_NAME).send_message(json.dumps(poison_message, ensure_ascii=False))
+    logging.error("Notificación del pedido %s movida a %s: %s", message.get("order"), POISON_QUEUE_NAME, reason)
@@ -0,0 +1,302 @@
+"""Perfilado bajo demanda de invocaciones en producción.
+
+`profiled(...)` envuelve el `main` de una función (síncrono o `async def`) y
+perfila algunas invocaciones:
+
+- con `PROFILING_ENABLED=true`, una fracción aleatoria
+  `PROFILING_SAMPLE_RATE` (0.01 por defecto);
+- con `PROFILING_TOKEN` configurado, las peticiones que traen la cabecera
+  `X-Profile-Token` con ese valor (solo quien conoce el token puede pedirlo).
+  La respuesta lleva entonces `X-Profile-Artifact` con el nombre del perfil.
+
+`PROFILING_MODE` elige el perfilador: `cprofile` (por defecto; fichero
+`.pstats` para `python -m pstats` o snakeviz) o `sampling`, un muestreador que
+cada `PROFILING_SAMPLE_INTERVAL_MS` ms (5) anota la pila del hilo de la
+invocación y escribe pilas colapsadas (`.collapsed`, para flamegraph.pl o
+speedscope) con un coste mucho menor. Con `PROFILING_TRACEMALLOC=true` se
+guarda además una instantánea de `tracemalloc` (`.tracemalloc`).
+
+Los ficheros se escriben en `PROFILING_OUTPUT_DIR` (por defecto
+`<tmp>/suitech-profiles`) y, con `PROFILING_BLOB_CONTAINER`, se suben a ese
+contenedor de la cuenta de `AzureWebJobsStorage` (requiere
+`azure-storage-blob`). En cada proceso se perfila como mucho una invocación a
+la vez; las funciones `async def` comparten hilo, así que el perfil incluye lo
+que hagan a la vez otras invocaciones del mismo bucle de eventos.
+
+La configuración se lee al decorar (las Function Apps se reinician al cambiar
+la configuración): si no hay ni `PROFILING_ENABLED` ni `PROFILING_TOKEN`,
+`profiled` devuelve el handler sin envolver y el coste es cero.
+"""
+
+import asyncio
+import functools
+import hmac
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, List, NamedTuple, Optional
+
+from utils.env import env_float
+
+PROFILE_HEADER = "X-Profile-Token"
+ARTIFACT_HEADER = "X-Profile-Artifact"
+
+CPROFILE = "cprofile"
+SAMPLING = "sampling"
+
+DEFAULT_SAMPLE_RATE = 0.01
+DEFAULT_SAMPLE_INTERVAL_MS = 5.0
+DEFAULT_TRACEMALLOC_FRAMES = 10
+
+# Un perfil por proceso a la vez: cProfile no admite dos activos y dos
+# muestreadores sobre el mismo bucle de eventos verían las mismas pilas
+_active = threading.Lock()
+_blob_service: Any = None
+
+
+def _flag(name: str) -> bool:
+    return os.environ.get(name, "false").lower() in ("true", "1", "yes")
+
+
+class ProfilingConfig(NamedTuple):
+    sample_rate: float
+    token: Optional[str]
+    mode: str
+    interval: float
+    tracemalloc: bool
+    output_dir: Path
+    blob_container: Optional[str]
+
+    @property
+    def active(self) -> bool:
+        return self.sample_rate > 0 or bool(self.token)
+
+
+def load_config() -> ProfilingConfig:
+    mode = os.environ.get("PROFILING_MODE", CPROFILE).strip().lower()
+    if mode not in (CPROFILE, SAMPLING):
+        logging.warning("PROFILING_MODE no válido (%s); se usa %s", mode, CPROFILE)
+        mode = CPROFILE
+    return ProfilingConfig(
+        sample_rate=env_float("PROFILING_SAMPLE_RATE", DEFAULT_SAMPLE_RATE) if _flag("PROFILING_ENABLED") else 0.0,
+        token=os.environ.get("PROFILING_TOKEN") or None,
+        mode=mode,
+        interval=max(0.5, env_float("PROFILING_SAMPLE_INTERVAL_MS", DEFAULT_SAMPLE_INTERVAL_MS)) / 1000,
+        tracemalloc=_flag("PROFILING_TRACEMALLOC"),
+        output_dir=Path(os.environ.get("PROFILING_OUTPUT_DIR") or Path(tempfile.gettempdir()) / "suitech-profiles"),
+        blob_container=os.environ.get("PROFILING_BLOB_CONTAINER") or None,
+    )
+
+
+class StackSampler:
+    """Muestrea la pila de un hilo cada `interval` segundos y cuenta las pilas colapsadas."""
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{Path(code.co_filename).stem}:{getattr(code, 'co_qualname', code.co_name)}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileSession:
+    """Perfil de una invocación: se inicia y se detiene en el hilo de la invocación."""
+
+    def __init__(self, function_name: str, config: ProfilingConfig, requested: bool) -> None:
+        self.config = config
+        self.requested = requested
+        self.name = f"{function_name}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.artifacts: List[str] = []
+        self._profile: Any = None
+        self._sampler: Optional[StackSampler] = None
+        self._snapshot: Any = None
+        self._started_tracemalloc = False
+        self._started_at = 0.0
+        self.duration_ms = 0.0
+
+    def start(self) -> None:
+        if self.config.tracemalloc:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(DEFAULT_TRACEMALLOC_FRAMES)
+                self._started_tracemalloc = True
+        if self.config.mode == SAMPLING:
+            self._sampler = StackSampler(threading.get_ident(), self.config.interval)
+            self._sampler.start()
+        else:
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._started_at = time.perf_counter()
+
+    def stop(self) -> None:
+        self.duration_ms = (time.perf_counter() - self._started_at) * 1000
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        if self.config.tracemalloc:
+            import tracemalloc
+
+            self._snapshot = tracemalloc.take_snapshot()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+    def save(self) -> None:
+        """Escribe los ficheros del perfil (y los sube al contenedor si está configurado)."""
+        try:
+            self.config.output_dir.mkdir(parents=True, exist_ok=True)
+            if self._profile is not None:
+                self._write(f"{self.name}.pstats", self._profile.dump_stats)
+            if self._sampler is not None:
+                self._write(f"{self.name}.collapsed", lambda path: Path(path).write_text(self._sampler.collapsed()))
+            if self._snapshot is not None:
+                self._write(f"{self.name}.tracemalloc", self._snapshot.dump)
+            logging.info(
+                "Perfil %s (%s, %.1f ms) guardado: %s",
+                self.name,
+                self.config.mode,
+                self.duration_ms,
+                ", ".join(self.artifacts),
+            )
+        except Exception:  # pylint: disable=broad-except
+            # Perfilar nunca debe hacer fallar la invocación
+            logging.exception("No se pudo guardar el perfil %s", self.name)
+
+    def _write(self, file_name: str, writer: Callable[[str], Any]) -> None:
+        path = self.config.output_dir / file_name
+        writer(str(path))
+        self.artifacts.append(file_name)
+        if self.config.blob_container:
+            _upload(path, self.config.blob_container)
+
+
+def _upload(path: Path, container: str) -> None:
+    global _blob_service
+    if _blob_service is None:
+        try:
+            from azure.storage.blob import BlobServiceClient
+        except ImportError:
+            logging.warning("azure-storage-blob no está instalado; el perfil queda en %s", path)
+            return
+        _blob_service = BlobServiceClient.from_connection_string(os.environ["AzureWebJobsStorage"])
+        container_client = _blob_service.get_container_client(container)
+        if not container_client.exists():
+            container_client.create_container()
+    with open(path, "rb") as data:
+        _blob_service.get_blob_client(container, path.name).upload_blob(data, overwrite=True)
+
+
+def _requested(config: ProfilingConfig, req: Any) -> bool:
+    headers = getattr(req, "headers", None)
+    if not config.token or headers is None:
+        return False
+    supplied = headers.get(PROFILE_HEADER)
+    return bool(supplied) and hmac.compare_digest(supplied.encode("utf-8"), config.token.encode("utf-8"))
+
+
+def _start(function_name: str, config: ProfilingConfig, req: Any) -> Optional[ProfileSession]:
+    requested = _requested(config, req)
+    if not requested and random.random() >= config.sample_rate:
+        return None
+    if not _active.acquire(blocking=False):
+        return None
+    session = ProfileSession(function_name, config, requested)
+    try:
+        session.start()
+    except Exception:  # pylint: disable=broad-except
+        _active.release()
+        logging.exception("No se pudo iniciar el perfil de %s", function_name)
+        return None
+    return session
+
+
+def _stop(session: ProfileSession) -> None:
+    try:
+        session.stop()
+    finally:
+        _active.release()
+
+
+def _annotate(session: ProfileSession, response: Any) -> None:
+    if session.requested and session.artifacts and response is not None and hasattr(response, "headers"):
+        response.headers[ARTIFACT_HEADER] = ", ".join(session.artifacts)
+
+
+def profiled(function_name: str) -> Callable:
+    """Decorador para el `main` de una función que activa el perfilado bajo demanda."""
+    config = load_config()
+
+    def decorator(handler: Callable) -> Callable:
+        if not config.active:
+            return handler
+
+        if asyncio.iscoroutinefunction(handler):
+
+            @functools.wraps(handler)
+            async def async_wrapper(req, *args: Any, **kwargs: Any):
+                session = _start(function_name, config, req)
+                if session is None:
+                    return await handler(req, *args, **kwargs)
+
+                response = None
+                try:
+                    response = await handler(req, *args, **kwargs)
+                finally:
+                    _stop(session)
+                    # Escribir (y subir) el perfil no bloquea el bucle de eventos
+                    await asyncio.to_thread(session.save)
+                _annotate(session, response)
+                return response
+
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(req, *args: Any, **kwargs: Any):
+            session = _start(function_name, config, req)
+            if session is None:
+                return handler(req, *args, **kwargs)
+
+            response = None
+            try:
+                response = handler(req, *args, **kwargs)
+            finally:
+                _stop(session)
+                session.save()
+            _annotate(session, response)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,70 @@
+"""Limitador de tasa por origen (token bucket), en memoria y seguro entre hilos.
+
+Cada origen (una IP, por ejemplo) tiene un cubo de `burst` fichas que se
+rellena a `rate` fichas por segundo. `consume` gasta una ficha y `retry_after`
+indica cuánto falta para que vuelva a haber una. Se guardan como mucho
+`maxsize` orígenes; al llenarse se olvida el usado hace más tiempo, que de
+todos modos tendría el cubo casi lleno.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens: float, updated_at: float) -> None:
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float, maxsize: int = 10000) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate debe ser mayor que 0 y burst al menos 1")
+        if maxsize <= 0:
+            raise ValueError("maxsize debe ser mayor que 0")
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _bucket(self, key: Hashable, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+            bucket.updated_at = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def retry_after(self, key: Hashable) -> float:
+        """Segundos hasta que `key` tenga una ficha (0 si ya la tiene). No gasta nada."""
+        with self._lock:
+            if key not in self._buckets:
+                return 0.0
+            bucket = self._bucket(key, time.monotonic())
+            return 0.0 if bucket.tokens >= 1 else (1 - bucket.tokens) / self.rate
+
+    def consume(self, key: Hashable, tokens: float = 1.0) -> bool:
+        """Gasta `tokens` fichas de `key`. Devuelve False si no había suficientes."""
+        with self._lock:
+            bucket = self._bucket(key, time.monotonic())
+            if bucket.tokens < tokens:
+                return False
+            bucket.tokens -= tokens
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
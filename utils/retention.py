@@ -0,0 +1,250 @@
+"""Retención de EncryptDataLogs y de las tablas que dependen de ella.
+
+`save_to_table` escribe en particiones diarias (`YYYY-MM-DD`) que nunca se
+limpiaban, así que cualquier consulta sin clave recorría toda la historia.
+`run_retention` borra (o archiva en `EncryptDataLogsArchive` con
+`LOG_RETENTION_MODE=archive`) las particiones anteriores a
+`LOG_RETENTION_DAYS` días, en transacciones de hasta 100 entidades por
+partición, y después elimina las entradas de `EncryptDataLogsOrderIndex` que
+apuntan a registros purgados y las de `RedsysNotificationLedger` caducadas.
+
+Cada ejecución tiene un presupuesto de tiempo (`LOG_RETENTION_TIME_BUDGET`,
+en segundos). El avance se guarda en `MaintenanceState`: si el presupuesto se
+agota, la siguiente ejecución continúa el mismo ciclo con la misma fecha de
+corte. Como las filas borradas desaparecen de las consultas, reanudar no
+necesita tokens de continuación.
+"""
+
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from utils.env import env_int
+from utils.idempotency import LEDGER_TABLE_NAME
+from utils.table_storage_sdk import (
+    LOG_TABLE_NAME,
+    ORDER_INDEX_TABLE_NAME,
+    TRANSACTION_MAX_OPERATIONS,
+    get_table_client,
+)
+
+ARCHIVE_TABLE_NAME = f"{LOG_TABLE_NAME}Archive"
+STATE_TABLE_NAME = "MaintenanceState"
+STATE_PARTITION = "retention"
+
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_TIME_BUDGET = 240
+PAGE_SIZE = 1000
+
+# Fases de un ciclo, en orden
+PHASES = ("logs", "index", "ledger")
+
+
+def retention_days() -> int:
+    return max(1, env_int("LOG_RETENTION_DAYS", DEFAULT_RETENTION_DAYS))
+
+
+def archive_enabled() -> bool:
+    return os.environ.get("LOG_RETENTION_MODE", "delete").lower() == "archive"
+
+
+def cutoff_partition(now: datetime, days: int) -> str:
+    """Primera partición que se conserva: se purga todo lo que sea estrictamente anterior."""
+    return (now - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def load_checkpoint() -> Dict[str, Any]:
+    try:
+        return dict(get_table_client(STATE_TABLE_NAME).get_entity(STATE_PARTITION, LOG_TABLE_NAME))
+    except ResourceNotFoundError:
+        return {}
+
+
+def save_checkpoint(state: Dict[str, Any]) -> None:
+    state = dict(state, PartitionKey=STATE_PARTITION, RowKey=LOG_TABLE_NAME)
+    state["UpdatedAt"] = datetime.now(timezone.utc).isoformat()
+    get_table_client(STATE_TABLE_NAME).upsert_entity(entity=state)
+
+
+def _delete_in_transactions(table_client, keys: Iterable[Tuple[str, str]]) -> int:
+    """Borra las claves (PartitionKey, RowKey) agrupándolas por partición.
+
+    Si una transacción falla (por ejemplo porque otra ejecución ya borró alguna
+    fila), sus entidades se borran una a una; `delete_entity` ignora las que ya
+    no existen.
+    """
+    by_partition: Dict[str, set] = defaultdict(set)
+    for partition_key, row_key in keys:
+        by_partition[partition_key].add(row_key)
+
+    deleted = 0
+    for partition_key, row_keys in by_partition.items():
+        rows = sorted(row_keys)
+        for start in range(0, len(rows), TRANSACTION_MAX_OPERATIONS):
+            chunk = rows[start:start + TRANSACTION_MAX_OPERATIONS]
+            try:
+                table_client.submit_transaction(
+                    [("delete", {"PartitionKey": partition_key, "RowKey": row_key}) for row_key in chunk]
+                )
+            except Exception as exc:  # pylint: disable=broad-except
+                logging.warning("Transacción de borrado fallida en la partición %s: %s", partition_key, exc)
+                for row_key in chunk:
+                    table_client.delete_entity(partition_key, row_key)
+            deleted += len(chunk)
+    return deleted
+
+
+def _archive(entities: List[Dict[str, Any]]) -> None:
+    archive_client = get_table_client(ARCHIVE_TABLE_NAME)
+    for start in range(0, len(entities), TRANSACTION_MAX_OPERATIONS):
+        chunk = entities[start:start + TRANSACTION_MAX_OPERATIONS]
+        archive_client.submit_transaction([("upsert", dict(entity)) for entity in chunk])
+
+
+def _purge_logs(state: Dict[str, Any], deadline: float, dry_run: bool) -> bool:
+    """Purga las particiones de EncryptDataLogs anteriores al corte. Devuelve True al terminar."""
+    log_client = get_table_client()
+    archive = archive_enabled()
+    entities = log_client.query_entities(
+        "PartitionKey lt @cutoff",
+        parameters={"cutoff": state["Cutoff"]},
+        select=None if archive else ["PartitionKey", "RowKey"],
+        results_per_page=PAGE_SIZE,
+    )
+
+    # Las filas llegan ordenadas por partición: se borran en bloques de una partición
+    pending: List[Dict[str, Any]] = []
+
+    def flush() -> None:
+        if not pending:
+            return
+        if not dry_run:
+            if archive:
+                _archive(pending)
+                state["Archived"] = state.get("Archived", 0) + len(pending)
+            _delete_in_transactions(log_client, ((row["PartitionKey"], row["RowKey"]) for row in pending))
+        state["LogsDeleted"] = state.get("LogsDeleted", 0) + len(pending)
+        state["CurrentPartition"] = pending[-1]["PartitionKey"]
+        pending.clear()
+
+    for entity in entities:
+        if pending and (
+            entity["PartitionKey"] != pending[0]["PartitionKey"] or len(pending) >= TRANSACTION_MAX_OPERATIONS
+        ):
+            partition_done = entity["PartitionKey"] != pending[0]["PartitionKey"]
+            finished = pending[0]["PartitionKey"]
+            flush()
+            if partition_done:
+                logging.info("Retención: partición %s purgada (%s filas en el ciclo)", finished, state["LogsDeleted"])
+            if not dry_run:
+                save_checkpoint(state)
+            if time.monotonic() >= deadline:
+                return False
+        pending.append(entity)
+    flush()
+    return True
+
+
+def _purge_by_filter(
+    table_name: str,
+    query: str,
+    parameters: Dict[str, Any],
+    counter: str,
+    state: Dict[str, Any],
+    deadline: float,
+    dry_run: bool,
+) -> bool:
+    table_client = get_table_client(table_name)
+    entities = table_client.query_entities(
+        query,
+        parameters=parameters,
+        select=["PartitionKey", "RowKey"],
+        results_per_page=PAGE_SIZE,
+    )
+    keys: List[Tuple[str, str]] = []
+    for entity in entities:
+        keys.append((entity["PartitionKey"], entity["RowKey"]))
+        if len(keys) >= PAGE_SIZE:
+            state[counter] = state.get(counter, 0) + (len(keys) if dry_run else _delete_in_transactions(table_client, keys))
+            keys = []
+            if not dry_run:
+                save_checkpoint(state)
+            if time.monotonic() >= deadline:
+                return False
+    if keys:
+        state[counter] = state.get(counter, 0) + (len(keys) if dry_run else _delete_in_transactions(table_client, keys))
+    return True
+
+
+def run_retention(
+    now: Optional[datetime] = None,
+    time_budget: Optional[float] = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Ejecuta (o continúa) un ciclo de retención y devuelve su estado.
+
+    Con `dry_run` solo cuenta lo que se borraría y no guarda el avance.
+    """
+    now = now or datetime.now(timezone.utc)
+    budget = time_budget if time_budget is not None else env_int("LOG_RETENTION_TIME_BUDGET", DEFAULT_TIME_BUDGET)
+    deadline = time.monotonic() + budget
+
+    state = {} if dry_run else load_checkpoint()
+    if state.get("Status") != "running":
+        cutoff = cutoff_partition(now, retention_days())
+        if state.get("Status") == "completed" and state.get("Cutoff") == cutoff:
+            # El ciclo de hoy ya terminó: no hay particiones nuevas que purgar
+            return state
+        # Nuevo ciclo: el corte se fija ahora y se mantiene hasta completarlo
+        previous = state
+        state = {
+            "Status": "running",
+            "Phase": PHASES[0],
+            "Cutoff": cutoff,
+            "StartedAt": now.isoformat(),
+        }
+        if previous.get("LastCompletedAt"):
+            state["LastCompletedAt"] = previous["LastCompletedAt"]
+    cutoff = state["Cutoff"]
+    cutoff_iso = f"{cutoff}T00:00:00+00:00"
+
+    steps = {
+        "logs": lambda: _purge_logs(state, deadline, dry_run),
+        "index": lambda: _purge_by_filter(
+            ORDER_INDEX_TABLE_NAME,
+            "LogPartitionKey lt @cutoff",
+            {"cutoff": cutoff},
+            "IndexDeleted",
+            state,
+            deadline,
+            dry_run,
+        ),
+        "ledger": lambda: _purge_by_filter(
+            LEDGER_TABLE_NAME,
+            "ProcessedAt lt @cutoff",
+            {"cutoff": cutoff_iso},
+            "LedgerDeleted",
+            state,
+            deadline,
+            dry_run,
+        ),
+    }
+
+    for phase in PHASES[PHASES.index(state.get("Phase", PHASES[0])):]:
+        state["Phase"] = phase
+        if not steps[phase]():
+            logging.info("Retención: presupuesto agotado en la fase '%s'; se continuará en la siguiente ejecución", phase)
+            if not dry_run:
+                save_checkpoint(state)
+            return state
+
+    state["Status"] = "completed"
+    state["LastCompletedAt"] = datetime.now(timezone.utc).isoformat()
+    if not dry_run:
+        save_checkpoint(state)
+    return state
@@ -0,0 +1,584 @@
+"""Backends locales de Table Storage: en memoria y SQLite.
+
+`TABLE_STORAGE_BACKEND` elige dónde guardan sus tablas las funciones y las
+herramientas (ver `utils.table_clients`):
+
+- `azure` (por defecto): Azure Table Storage con `AzureWebJobsStorage`.
+- `memory`: diccionarios del propio proceso, seguros entre hilos. Para
+  pruebas, benchmarks y el arnés de carga; los datos se pierden al salir.
+- `sqlite`: un fichero SQLite (`TABLE_STORAGE_SQLITE_PATH`) en modo WAL, con
+  índices sobre las propiedades que se consultan (`Ds_Merchant_Order`, `Id`,
+  `LogPartitionKey`, `ProcessedAt`). Pensado para ejecutar las funciones en un
+  host propio con un almacén de baja latencia.
+
+Los clientes locales implementan la parte de `TableClient` que usa el proyecto
+(`get_entity`, `upsert_entity`, `update_entity`, `delete_entity`,
+`query_entities`, `list_entities` y `submit_transaction`) con el mismo
+comportamiento: `upsert` y `update` combinan propiedades por defecto (MERGE),
+los resultados salen ordenados por PartitionKey y RowKey, una entidad que no
+existe lanza `ResourceNotFoundError` y cada entidad devuelta lleva su etag en
+`entity.metadata`. Los filtros admitidos son comparaciones (`eq`, `ne`, `lt`,
+`le`, `gt`, `ge`) entre una propiedad y un parámetro `@nombre` o un literal,
+unidas con `and`, que es todo lo que usan las consultas del proyecto.
+"""
+
+import json
+import operator
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+MEMORY = "memory"
+SQLITE = "sqlite"
+LOCAL_BACKENDS = (MEMORY, SQLITE)
+
+DEFAULT_SQLITE_FILE = "suitech-redsys-tables.sqlite3"
+
+# Propiedades con índice en SQLite: las que filtran get_entity_by_order_code y la retención
+SQLITE_INDEXED_FIELDS = ("Ds_Merchant_Order", "Id", "LogPartitionKey", "ProcessedAt")
+
+QUERY_PAGE_SIZE = 1000
+TRANSACTION_MAX_OPERATIONS = 100
+
+Key = Tuple[str, str]
+Condition = Tuple[str, str, Any]
+
+_OPERATORS = {"eq": "=", "ne": "!=", "lt": "<", "le": "<=", "gt": ">", "ge": ">="}
+_COMPARISON = re.compile(r"^\s*(\w+)\s+(eq|ne|lt|le|gt|ge)\s+(@\w+|'(?:[^']|'')*'|\S+)\s*$")
+_TABLE_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9]{2,62}$")
+
+
+class LocalEntity(dict):
+    """Entidad devuelta por un backend local; como `TableEntity`, con `metadata`."""
+
+    def __init__(self, values: Dict[str, Any], etag: int, timestamp: Optional[datetime]) -> None:
+        super().__init__(values)
+        self.metadata = {"etag": f'W/"{etag}"', "timestamp": timestamp}
+
+
+def _check_table_name(table_name: str) -> str:
+    if not _TABLE_NAME.match(table_name):
+        raise ValueError(f"Nombre de tabla no válido: {table_name!r}")
+    return table_name
+
+
+def _literal(token: str) -> Any:
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    if token in ("true", "false"):
+        return token == "true"
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token)
+    except ValueError as exc:
+        raise ValueError(f"Literal no admitido en el filtro: {token}") from exc
+
+
+def parse_filter(query_filter: str, parameters: Optional[Dict[str, Any]] = None) -> List[Condition]:
+    """Convierte `Prop op @param [and ...]` en una lista de (propiedad, operador, valor)."""
+    parameters = parameters or {}
+    conditions = []
+    for part in re.split(r"\s+and\s+", query_filter.strip()):
+        match = _COMPARISON.match(part)
+        if not match:
+            raise ValueError(f"Filtro no admitido por el backend local: {query_filter!r}")
+        field, comparison, operand = match.groups()
+        value = parameters[operand[1:]] if operand.startswith("@") else _literal(operand)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        conditions.append((field, comparison, value))
+    return conditions
+
+
+def _without_none(entity: Dict[str, Any]) -> Dict[str, Any]:
+    # Table Storage no guarda propiedades nulas
+    return {key: value for key, value in entity.items() if value is not None}
+
+
+def _select(values: Dict[str, Any], select: Optional[Iterable[str]]) -> Dict[str, Any]:
+    if not select:
+        return values
+    return {field: values[field] for field in select if field in values}
+
+
+def _keys(entity: Dict[str, Any]) -> Key:
+    return str(entity["PartitionKey"]), str(entity["RowKey"])
+
+
+def _is_merge(mode: Any) -> bool:
+    # Admite `UpdateMode.MERGE` (enum de str) o el texto "merge"
+    return str(getattr(mode, "value", mode)).lower() == "merge"
+
+
+def _transaction_operation(operation: Tuple[Any, ...]) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+    kind = str(getattr(operation[0], "value", operation[0])).lower()
+    options = operation[2] if len(operation) > 2 else {}
+    return kind, operation[1], options
+
+
+def _check_transaction(operations: List[Tuple[Any, ...]]) -> None:
+    if len(operations) > TRANSACTION_MAX_OPERATIONS:
+        raise ValueError(f"Una transacción admite como mucho {TRANSACTION_MAX_OPERATIONS} operaciones")
+    if len({str(operation[1]["PartitionKey"]) for operation in operations}) > 1:
+        raise ValueError("Todas las operaciones de una transacción deben ser de la misma partición")
+
+
+# --- Memoria -----------------------------------------------------------------
+
+
+_COMPARATORS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+}
+
+
+def _matches(values: Dict[str, Any], conditions: List[Condition]) -> bool:
+    """Evalúa el filtro sobre una entidad guardada (que incluye PartitionKey y RowKey)."""
+    for field, comparison, expected in conditions:
+        actual = values.get(field)
+        if actual is None:
+            # Como en Table Storage, una propiedad ausente no cumple ninguna comparación
+            return False
+        if isinstance(actual, datetime):
+            actual = actual.isoformat()
+        try:
+            if not _COMPARATORS[comparison](actual, expected):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+class MemoryTableClient:
+    """Tabla en memoria con la interfaz de `TableClient` que usa el proyecto."""
+
+    def __init__(self, table_name: str) -> None:
+        self.table_name = _check_table_name(table_name)
+        # PartitionKey, RowKey -> (propiedades, etag, última escritura)
+        self._rows: Dict[Key, Tuple[Dict[str, Any], int, datetime]] = {}
+        self._etag = 0
+        self._lock = threading.RLock()
+
+    def _entity(self, key: Key, select: Optional[Iterable[str]] = None) -> Optional[LocalEntity]:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        values, etag, timestamp = row
+        return LocalEntity(_select(values, select), etag, timestamp)
+
+    def _write(self, key: Key, values: Dict[str, Any]) -> None:
+        self._etag += 1
+        self._rows[key] = (values, self._etag, datetime.now(timezone.utc))
+
+    def _upsert(self, entity: Dict[str, Any], merge: bool) -> None:
+        key = _keys(entity)
+        values = _without_none(entity)
+        current = self._rows.get(key)
+        if merge and current is not None:
+            values = {**current[0], **values}
+        self._write(key, values)
+
+    def _update(self, entity: Dict[str, Any], merge: bool) -> None:
+        if _keys(entity) not in self._rows:
+            raise ResourceNotFoundError(f"La entidad no existe en {self.table_name}")
+        self._upsert(entity, merge)
+
+    def _create(self, entity: Dict[str, Any]) -> None:
+        if _keys(entity) in self._rows:
+            raise ResourceExistsError(f"La entidad ya existe en {self.table_name}")
+        self._write(_keys(entity), _without_none(entity))
+
+    def get_entity(self, partition_key: str, row_key: str, select: Optional[List[str]] = None, **_: Any) -> LocalEntity:
+        with self._lock:
+            entity = self._entity((partition_key, row_key), select)
+        if entity is None:
+            raise ResourceNotFoundError(f"La entidad no existe en {self.table_name}")
+        return entity
+
+    def create_entity(self, entity: Dict[str, Any], **_: Any) -> None:
+        with self._lock:
+            self._create(entity)
+
+    def upsert_entity(self, entity: Dict[str, Any], mode: Any = "merge", **_: Any) -> None:
+        with self._lock:
+            self._upsert(entity, _is_merge(mode))
+
+    def update_entity(self, entity: Dict[str, Any], mode: Any = "merge", **_: Any) -> None:
+        with self._lock:
+            self._update(entity, _is_merge(mode))
+
+    def delete_entity(self, partition_key: Any, row_key: Optional[str] = None, **_: Any) -> None:
+        if isinstance(partition_key, dict):
+            partition_key, row_key = _keys(partition_key)
+        with self._lock:
+            self._rows.pop((partition_key, row_key), None)
+
+    def submit_transaction(self, operations: Iterable[Tuple[Any, ...]], **_: Any) -> None:
+        operations = list(operations)
+        _check_transaction(operations)
+        with self._lock:
+            # Todo o nada, como las transacciones de Table Storage: se guardan las
+            # filas afectadas (no la tabla entera) para deshacer si algo falla
+            previous = {_keys(operation[1]): self._rows.get(_keys(operation[1])) for operation in operations}
+            try:
+                for operation in operations:
+                    kind, entity, options = _transaction_operation(operation)
+                    if kind == "delete":
+                        self._rows.pop(_keys(entity), None)
+                    elif kind == "create":
+                        self._create(entity)
+                    elif kind == "update":
+                        self._update(entity, _is_merge(options.get("mode", "merge")))
+                    elif kind == "upsert":
+                        self._upsert(entity, _is_merge(options.get("mode", "merge")))
+                    else:
+                        raise ValueError(f"Operación de transacción no admitida: {kind}")
+            except Exception:
+                for key, row in previous.items():
+                    if row is None:
+                        self._rows.pop(key, None)
+                    else:
+                        self._rows[key] = row
+                raise
+
+    def query_entities(
+        self,
+        query_filter: str,
+        parameters: Optional[Dict[str, Any]] = None,
+        select: Optional[List[str]] = None,
+        **_: Any,
+    ) -> Iterator[LocalEntity]:
+        conditions = parse_filter(query_filter, parameters)
+        return self._scan(conditions, select)
+
+    def list_entities(self, select: Optional[List[str]] = None, **_: Any) -> Iterator[LocalEntity]:
+        return self._scan([], select)
+
+    def _scan(self, conditions: List[Condition], select: Optional[Iterable[str]]) -> Iterator[LocalEntity]:
+        point = _point_key(conditions)
+        with self._lock:
+            # Se filtra de una vez y solo se guardan las claves; cada fila se vuelve
+            # a leer al recorrerla, así que las borradas entretanto no se devuelven
+            if point is not None:
+                row = self._rows.get(point)
+                candidates = [point] if row is not None and _matches(row[0], conditions) else []
+            else:
+                candidates = [key for key, row in self._rows.items() if _matches(row[0], conditions)]
+        for key in sorted(candidates):
+            with self._lock:
+                entity = self._entity(key, select)
+            if entity is not None:
+                yield entity
+
+    def close(self) -> None:
+        pass
+
+
+def _point_key(conditions: List[Condition]) -> Optional[Key]:
+    equal = {field: value for field, comparison, value in conditions if comparison == "eq"}
+    if "PartitionKey" in equal and "RowKey" in equal:
+        return str(equal["PartitionKey"]), str(equal["RowKey"])
+    return None
+
+
+# --- SQLite ------------------------------------------------------------------
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"$bytes": value.hex()}
+    raise TypeError(f"Tipo no admitido en una entidad: {type(value).__name__}")
+
+
+def _decode_object(value: Dict[str, Any]) -> Any:
+    if len(value) == 1:
+        if "$datetime" in value:
+            return datetime.fromisoformat(value["$datetime"])
+        if "$bytes" in value:
+            return bytes.fromhex(value["$bytes"])
+    return value
+
+
+def _encode_body(entity: Dict[str, Any]) -> str:
+    body = {key: value for key, value in _without_none(entity).items() if key not in ("PartitionKey", "RowKey")}
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":"), default=_encode_value)
+
+
+def sqlite_path() -> str:
+    return os.environ.get("TABLE_STORAGE_SQLITE_PATH") or os.path.join(tempfile.gettempdir(), DEFAULT_SQLITE_FILE)
+
+
+class SqliteStore:
+    """Conexión SQLite compartida por todas las tablas de un fichero."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.RLock()
+
+    def create_table(self, table_name: str) -> str:
+        sql_table = f"t_{_check_table_name(table_name)}"
+        with self.lock:
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{sql_table}" ('
+                "PartitionKey TEXT NOT NULL, RowKey TEXT NOT NULL, Etag INTEGER NOT NULL, "
+                "Written TEXT NOT NULL, Body TEXT NOT NULL, UNIQUE (PartitionKey, RowKey))"
+            )
+            for field in SQLITE_INDEXED_FIELDS:
+                # Índice parcial: en las tablas sin esa propiedad no ocupa nada
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_{field}" ON "{sql_table}" '
+                    f"(json_extract(Body, '$.{field}')) WHERE json_extract(Body, '$.{field}') IS NOT NULL"
+                )
+        return sql_table
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+def _column(field: str) -> str:
+    if field in ("PartitionKey", "RowKey"):
+        return field
+    return f"json_extract(Body, '$.{field}')"
+
+
+class SqliteTableClient:
+    """Tabla SQLite con la interfaz de `TableClient` que usa el proyecto."""
+
+    def __init__(self, store: SqliteStore, table_name: str) -> None:
+        self.table_name = table_name
+        self._store = store
+        self._sql_table = store.create_table(table_name)
+
+    def _execute(self, sql: str, parameters: Iterable[Any] = ()) -> sqlite3.Cursor:
+        return self._store.connection.execute(sql.replace("{table}", f'"{self._sql_table}"'), tuple(parameters))
+
+    @staticmethod
+    def _entity(row: Tuple[Any, ...], select: Optional[Iterable[str]] = None) -> LocalEntity:
+        partition_key, row_key, etag, written, body = row
+        values = {"PartitionKey": partition_key, "RowKey": row_key}
+        values.update(json.loads(body, object_hook=_decode_object))
+        return LocalEntity(_select(values, select), etag, datetime.fromisoformat(written))
+
+    def _upsert(self, entity: Dict[str, Any], merge: bool) -> None:
+        update = "json_patch(Body, excluded.Body)" if merge else "excluded.Body"
+        self._execute(
+            "INSERT INTO {table} (PartitionKey, RowKey, Etag, Written, Body) VALUES (?, ?, 1, ?, ?) "
+            f"ON CONFLICT (PartitionKey, RowKey) DO UPDATE SET Body = {update}, "
+            "Etag = Etag + 1, Written = excluded.Written",
+            (*_keys(entity), datetime.now(timezone.utc).isoformat(), _encode_body(entity)),
+        )
+
+    def _update(self, entity: Dict[str, Any], merge: bool) -> None:
+        update = "json_patch(Body, ?)" if merge else "?"
+        cursor = self._execute(
+            f"UPDATE {{table}} SET Body = {update}, Etag = Etag + 1, Written = ? WHERE PartitionKey = ? AND RowKey = ?",
+            (_encode_body(entity), datetime.now(timezone.utc).isoformat(), *_keys(entity)),
+        )
+        if cursor.rowcount == 0:
+            raise ResourceNotFoundError(f"La entidad no existe en {self.table_name}")
+
+    def _create(self, entity: Dict[str, Any]) -> None:
+        try:
+            self._execute(
+                "INSERT INTO {table} (PartitionKey, RowKey, Etag, Written, Body) VALUES (?, ?, 1, ?, ?)",
+                (*_keys(entity), datetime.now(timezone.utc).isoformat(), _encode_body(entity)),
+            )
+        except sqlite3.IntegrityError as exc:
+            raise ResourceExistsError(f"La entidad ya existe en {self.table_name}") from exc
+
+    def _delete(self, key: Key) -> None:
+        self._execute("DELETE FROM {table} WHERE PartitionKey = ? AND RowKey = ?", key)
+
+    def get_entity(self, partition_key: str, row_key: str, select: Optional[List[str]] = None, **_: Any) -> LocalEntity:
+        with self._store.lock:
+            row = self._execute(
+                "SELECT PartitionKey, RowKey, Etag, Written, Body FROM {table} WHERE PartitionKey = ? AND RowKey = ?",
+                (partition_key, row_key),
+            ).fetchone()
+        if row is None:
+            raise ResourceNotFoundError(f"La entidad no existe en {self.table_name}")
+        return self._entity(row, select)
+
+    def create_entity(self, entity: Dict[str, Any], **_: Any) -> None:
+        with self._store.lock:
+            self._create(entity)
+
+    def upsert_entity(self, entity: Dict[str, Any], mode: Any = "merge", **_: Any) -> None:
+        with self._store.lock:
+            self._upsert(entity, _is_merge(mode))
+
+    def update_entity(self, entity: Dict[str, Any], mode: Any = "merge", **_: Any) -> None:
+        with self._store.lock:
+            self._update(entity, _is_merge(mode))
+
+    def delete_entity(self, partition_key: Any, row_key: Optional[str] = None, **_: Any) -> None:
+        if isinstance(partition_key, dict):
+            partition_key, row_key = _keys(partition_key)
+        with self._store.lock:
+            self._delete((partition_key, row_key))
+
+    def submit_transaction(self, operations: Iterable[Tuple[Any, ...]], **_: Any) -> None:
+        operations = list(operations)
+        _check_transaction(operations)
+        with self._store.lock:
+            self._execute("BEGIN IMMEDIATE")
+            try:
+                for operation in operations:
+                    kind, entity, options = _transaction_operation(operation)
+                    if kind == "delete":
+                        self._delete(_keys(entity))
+                    elif kind == "create":
+                        self._create(entity)
+                    elif kind == "update":
+                        self._update(entity, _is_merge(options.get("mode", "merge")))
+                    elif kind == "upsert":
+                        self._upsert(entity, _is_merge(options.get("mode", "merge")))
+                    else:
+                        raise ValueError(f"Operación de transacción no admitida: {kind}")
+            except BaseException:
+                self._execute("ROLLBACK")
+                raise
+            self._execute("COMMIT")
+
+    def query_entities(
+        self,
+        query_filter: str,
+        parameters: Optional[Dict[str, Any]] = None,
+        select: Optional[List[str]] = None,
+        **_: Any,
+    ) -> Iterator[LocalEntity]:
+        return self._scan(parse_filter(query_filter, parameters), select)
+
+    def list_entities(self, select: Optional[List[str]] = None, **_: Any) -> Iterator[LocalEntity]:
+        return self._scan([], select)
+
+    def _scan(self, conditions: List[Condition], select: Optional[Iterable[str]]) -> Iterator[LocalEntity]:
+        where = [f"{_column(field)} {_OPERATORS[comparison]} ?" for field, comparison, _ in conditions]
+        values = [value for _, _, value in conditions]
+        last: Optional[Key] = None
+        while True:
+            # Paginación por clave: el lock no se mantiene mientras quien llama recorre
+            # los resultados, y las filas borradas entretanto no descolocan la página
+            clauses = where + (["(PartitionKey, RowKey) > (?, ?)"] if last else [])
+            sql = "SELECT PartitionKey, RowKey, Etag, Written, Body FROM {table}"
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            sql += f" ORDER BY PartitionKey, RowKey LIMIT {QUERY_PAGE_SIZE}"
+            with self._store.lock:
+                rows = self._execute(sql, values + (list(last) if last else [])).fetchall()
+            for row in rows:
+                yield self._entity(row, select)
+            if len(rows) < QUERY_PAGE_SIZE:
+                return
+            last = (rows[-1][0], rows[-1][1])
+
+    def close(self) -> None:
+        pass
+
+
+# --- Variante asíncrona ------------------------------------------------------
+
+
+async def _aiter(entities: Iterator[LocalEntity]) -> AsyncIterator[LocalEntity]:
+    for entity in entities:
+        yield entity
+
+
+class AsyncTableAdapter:
+    """Expone un cliente local con la interfaz de `azure.data.tables.aio`.
+
+    Las operaciones locales tardan microsegundos, así que se ejecutan en el
+    propio bucle de eventos en lugar de en un hilo aparte.
+    """
+
+    def __init__(self, client: Any) -> None:
+        self._client = client
+        self.table_name = client.table_name
+
+    async def get_entity(self, *args: Any, **kwargs: Any) -> LocalEntity:
+        return self._client.get_entity(*args, **kwargs)
+
+    async def create_entity(self, *args: Any, **kwargs: Any) -> None:
+        self._client.create_entity(*args, **kwargs)
+
+    async def upsert_entity(self, *args: Any, **kwargs: Any) -> None:
+        self._client.upsert_entity(*args, **kwargs)
+
+    async def update_entity(self, *args: Any, **kwargs: Any) -> None:
+        self._client.update_entity(*args, **kwargs)
+
+    async def delete_entity(self, *args: Any, **kwargs: Any) -> None:
+        self._client.delete_entity(*args, **kwargs)
+
+    async def submit_transaction(self, *args: Any, **kwargs: Any) -> None:
+        self._client.submit_transaction(*args, **kwargs)
+
+    def query_entities(self, *args: Any, **kwargs: Any) -> AsyncIterator[LocalEntity]:
+        return _aiter(self._client.query_entities(*args, **kwargs))
+
+    def list_entities(self, *args: Any, **kwargs: Any) -> AsyncIterator[LocalEntity]:
+        return _aiter(self._client.list_entities(*args, **kwargs))
+
+    async def close(self) -> None:
+        pass
+
+
+# --- Registro de tablas ------------------------------------------------------
+
+_tables: Dict[Tuple[str, str], Any] = {}
+_sqlite_store: Optional[SqliteStore] = None
+_lock = threading.Lock()
+
+
+def _get_sqlite_store() -> SqliteStore:
+    global _sqlite_store
+    if _sqlite_store is None or _sqlite_store.path != sqlite_path():
+        _sqlite_store = SqliteStore(sqlite_path())
+    return _sqlite_store
+
+
+def get_table_client(backend: str, table_name: str) -> Any:
+    """Cliente de `table_name` en el backend local `backend` (la tabla se crea si no existe)."""
+    table_client = _tables.get((backend, table_name))
+    if table_client is not None:
+        return table_client
+    with _lock:
+        table_client = _tables.get((backend, table_name))
+        if table_client is None:
+            if backend == MEMORY:
+                table_client = MemoryTableClient(table_name)
+            elif backend == SQLITE:
+                table_client = SqliteTableClient(_get_sqlite_store(), table_name)
+            else:
+                raise ValueError(f"TABLE_STORAGE_BACKEND no válido: {backend!r}")
+            _tables[(backend, table_name)] = table_client
+        return table_client
+
+
+def reset() -> None:
+    """Olvida las tablas locales (en memoria se pierden sus datos) y cierra SQLite."""
+    global _sqlite_store
+    with _lock:
+        _tables.clear()
+        if _sqlite_store is not None:
+            _sqlite_store.close()
+        _sqlite_store = None
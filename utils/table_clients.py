@@ -0,0 +1,171 @@
+"""Clientes de Table Storage reutilizables por proceso.
+
+`TableServiceClient` mantiene su propio pool HTTP, así que se crea una sola vez
+por proceso (y por bucle de eventos en la variante asíncrona) y se comparte
+entre invocaciones. Las tablas se aprovisionan como mucho una vez por proceso;
+si se crean en el despliegue (`tools/provision_tables.py`) se puede desactivar
+la comprobación con `TABLES_AUTO_CREATE=false`.
+
+Los paquetes de `azure.data.tables` se importan al crear el primer cliente, de
+modo que cargar el módulo no cuesta nada a las funciones que no usan tablas
+(o que solo usan la variante asíncrona).
+
+`TABLE_STORAGE_BACKEND=memory|sqlite` sustituye Azure Table Storage por uno de
+los backends locales de `utils.table_backends` sin tocar a quien llama.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Set
+
+if TYPE_CHECKING:
+    from azure.data.tables import TableClient, TableServiceClient
+
+_service_client: "Optional[TableServiceClient]" = None
+_table_clients: "Dict[str, TableClient]" = {}
+_provisioned: Set[str] = set()
+_lock = threading.RLock()
+
+# Los clientes asíncronos quedan ligados al bucle en el que se crean; al desaparecer el
+# bucle se olvidan (por id() un bucle nuevo podría heredar los de uno ya cerrado)
+_async_service_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+_async_table_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+_async_provisioned: Set[str] = set()
+
+
+def _connection_string() -> str:
+    connection_string = os.environ.get("AzureWebJobsStorage")
+    if not connection_string:
+        raise ValueError("AzureWebJobsStorage no está configurado")
+    return connection_string
+
+
+def backend_name() -> str:
+    """Backend de tablas configurado: `azure` (por defecto), `memory` o `sqlite`."""
+    return os.environ.get("TABLE_STORAGE_BACKEND", "azure").strip().lower() or "azure"
+
+
+def _local_backend() -> Optional[str]:
+    backend = backend_name()
+    if backend == "azure":
+        return None
+    from utils import table_backends
+
+    if backend not in table_backends.LOCAL_BACKENDS:
+        raise ValueError(f"TABLE_STORAGE_BACKEND no válido: {backend!r}")
+    return backend
+
+
+def auto_create_enabled() -> bool:
+    return os.environ.get("TABLES_AUTO_CREATE", "true").lower() not in ("false", "0", "no")
+
+
+def get_service_client() -> "TableServiceClient":
+    global _service_client
+    if _service_client is None:
+        with _lock:
+            if _service_client is None:
+                from azure.data.tables import TableServiceClient
+
+                _service_client = TableServiceClient.from_connection_string(conn_str=_connection_string())
+    return _service_client
+
+
+def get_table_client(table_name: str) -> "TableClient":
+    """Devuelve el cliente compartido de `table_name`, creando la tabla la primera vez."""
+    table_client = _table_clients.get(table_name)
+    if table_client is not None:
+        return table_client
+
+    local_backend = _local_backend()
+    if local_backend is not None:
+        from utils import table_backends
+
+        return table_backends.get_table_client(local_backend, table_name)
+
+    with _lock:
+        table_client = _table_clients.get(table_name)
+        if table_client is not None:
+            return table_client
+        service = get_service_client()
+        if auto_create_enabled() and table_name not in _provisioned:
+            service.create_table_if_not_exists(table_name=table_name)
+            _provisioned.add(table_name)
+        table_client = _table_clients[table_name] = service.get_table_client(table_name=table_name)
+        return table_client
+
+
+def provision_tables(table_names: Iterable[str]) -> None:
+    """Crea las tablas indicadas (pensado para ejecutarse en el despliegue)."""
+    local_backend = _local_backend()
+    if local_backend is not None:
+        from utils import table_backends
+
+        for table_name in table_names:
+            table_backends.get_table_client(local_backend, table_name)
+            logging.info("Tabla '%s' disponible (%s)", table_name, local_backend)
+        return
+
+    service = get_service_client()
+    for table_name in table_names:
+        service.create_table_if_not_exists(table_name=table_name)
+        _provisioned.add(table_name)
+        logging.info("Tabla '%s' disponible", table_name)
+
+
+async def get_async_table_client(table_name: str):
+    """Variante asíncrona (`azure.data.tables.aio`) de `get_table_client`.
+
+    Los clientes asíncronos quedan ligados al bucle de eventos en el que se
+    crean, por eso se cachean por bucle.
+    """
+    local_backend = _local_backend()
+    if local_backend is not None:
+        from utils import table_backends
+
+        return table_backends.AsyncTableAdapter(table_backends.get_table_client(local_backend, table_name))
+
+    from azure.data.tables.aio import TableServiceClient as AsyncTableServiceClient
+
+    loop = asyncio.get_running_loop()
+    loop_clients = _async_table_clients.setdefault(loop, {})
+    table_client = loop_clients.get(table_name)
+    if table_client is not None:
+        return table_client
+
+    service = _async_service_clients.get(loop)
+    if service is None:
+        service = AsyncTableServiceClient.from_connection_string(conn_str=_connection_string())
+        _async_service_clients[loop] = service
+
+    if auto_create_enabled() and table_name not in _provisioned | _async_provisioned:
+        await service.create_table_if_not_exists(table_name=table_name)
+        _async_provisioned.add(table_name)
+
+    # Otra corrutina pudo registrarlo mientras se esperaba la creación de la tabla
+    # (los clientes de tabla comparten el transporte del de servicio: no hay que cerrar el sobrante)
+    return loop_clients.setdefault(table_name, service.get_table_client(table_name=table_name))
+
+
+def reset_clients() -> None:
+    """Olvida los clientes cacheados (pruebas o cambio de connection string)."""
+    global _service_client
+    with _lock:
+        for table_client in _table_clients.values():
+            table_client.close()
+        _table_clients.clear()
+        if _service_client is not None:
+            _service_client.close()
+        _service_client = None
+        _provisioned.clear()
+        _async_service_clients.clear()
+        _async_table_clients.clear()
+        _async_provisioned.clear()
+        if "utils.table_backends" in sys.modules:
+            sys.modules["utils.table_backends"].reset()
@@ -0,0 +1,210 @@
+"""Variante asíncrona de `utils.table_storage_sdk` sobre `azure.data.tables.aio`.
+
+Expone la misma API (`get_table_client`, `save_to_table`, `save_many_to_table`,
+`get_entity_by_order_code`) para usarse desde funciones `async def` sin bloquear
+un hilo del worker durante las llamadas a Table Storage. `save_entity` y
+`mark_failed` permiten guardar una entidad ya construida mientras se llama a
+RedSys y anularla después si la llamada falla.
+"""
+
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from utils import table_clients
+from utils.merchants import MerchantKey
+from utils.table_storage_sdk import (
+    INDEX_WRITE_MODE,
+    LOG_TABLE_NAME,
+    ORDER_INDEX_FIELDS,
+    ORDER_INDEX_TABLE_NAME,
+    ORDER_LOOKUP_FIELDS,
+    build_log_entity,
+    build_order_index_entity,
+    entity_owner,
+    legacy_order_queries,
+    order_index_entities,
+    order_index_keys,
+    order_lookup_keys,
+    resolves_order,
+    transaction_chunks,
+)
+
+
+async def get_table_client(table_name: str = LOG_TABLE_NAME):
+    """Cliente asíncrono compartido de la tabla (ver `utils.table_clients`)."""
+    return await table_clients.get_async_table_client(table_name)
+
+
+async def _write_order_index(order_code: str, entity: Dict[str, Any]) -> None:
+    try:
+        index_client = await get_table_client(ORDER_INDEX_TABLE_NAME)
+        await index_client.upsert_entity(entity=build_order_index_entity(order_code, entity), mode=INDEX_WRITE_MODE)
+    except Exception as e:  # pylint: disable=broad-except
+        logging.warning(f"No se pudo actualizar el índice de pedidos para '{order_code}': {str(e)}")
+
+
+async def _first_match(
+    table_client,
+    query_filter: str,
+    parameters: Dict[str, Any],
+    owner: Optional[MerchantKey],
+    accept_untagged: bool,
+) -> Optional[Dict[str, Any]]:
+    async for entity in table_client.query_entities(query_filter, parameters=parameters):
+        # Igual que en la variante síncrona: ni los registros con Error ni los de otro comercio
+        if resolves_order(entity, owner, accept_untagged):
+            return entity
+    return None
+
+
+async def get_entity_by_order_code(
+    order_code: str, owner: Optional[MerchantKey], accept_untagged: bool = False
+) -> Optional[Dict[str, Any]]:
+    """Recupera la entidad del pedido de `owner` (ver `table_storage_sdk.get_entity_by_order_code`)."""
+
+    try:
+        index_client = await get_table_client(ORDER_INDEX_TABLE_NAME)
+        for partition_key, row_key in order_lookup_keys(order_code, owner, accept_untagged):
+            try:
+                pointer = await index_client.get_entity(partition_key, row_key, select=list(ORDER_INDEX_FIELDS))
+                entity = await (await get_table_client()).get_entity(
+                    pointer["LogPartitionKey"], pointer["LogRowKey"], select=list(ORDER_LOOKUP_FIELDS)
+                )
+            except (ResourceNotFoundError, KeyError):
+                continue
+            if resolves_order(entity, owner, accept_untagged):
+                return entity
+    except Exception as e:  # pylint: disable=broad-except
+        logging.warning(f"No se pudo consultar el índice de pedidos: {str(e)}")
+
+    table_client = await get_table_client()
+    for query_filter, parameters in legacy_order_queries(order_code, owner, accept_untagged):
+        entity = await _first_match(table_client, query_filter, parameters, owner, accept_untagged)
+        if entity:
+            await _write_order_index(order_code, entity)
+            return entity
+    return None
+
+
+async def save_to_table(
+    url_bc: str,
+    auth_type: str,
+    user: str,
+    password: str,
+    encrypt_type: str,
+    encrypt_key: str,
+    ds_merchant_order: str | None = None,
+    redirect_url: str | None = None,
+    error: str | None = None,
+    merchant_code: str | None = None,
+    terminal: str | None = None,
+) -> str:
+    """Guarda una entidad en EncryptDataLogs. Devuelve su Id o None si falla."""
+    entity = build_log_entity(
+        url_bc=url_bc,
+        auth_type=auth_type,
+        user=user,
+        password=password,
+        encrypt_type=encrypt_type,
+        encrypt_key=encrypt_key,
+        ds_merchant_order=ds_merchant_order,
+        redirect_url=redirect_url,
+        error=error,
+        merchant_code=merchant_code,
+        terminal=terminal,
+    )
+    return entity["Id"] if await save_entity(entity) else None
+
+
+async def save_entity(entity: Dict[str, Any]) -> bool:
+    """Guarda una entidad de `build_log_entity` y su entrada del índice. Devuelve si se guardó.
+
+    Se puede repetir sin duplicar nada: la entidad ya trae sus claves.
+    """
+    try:
+        table_client = await get_table_client()
+        await table_client.upsert_entity(entity=entity)
+    except Exception as e:  # pylint: disable=broad-except
+        logging.error(f"Error al guardar en tabla: {str(e)}")
+        return False
+    order_code = entity.get("Ds_Merchant_Order")
+    if order_code and not entity.get("Error"):
+        await _write_order_index(order_code, entity)
+    return True
+
+
+async def mark_failed(entity: Dict[str, Any], error: str) -> bool:
+    """Marca como fallida una entidad ya guardada y la retira del índice de pedidos.
+
+    El registro se conserva (con `Error`, como los de las peticiones fallidas),
+    pero las notificaciones de ese pedido ya no lo encuentran por el índice.
+    """
+    from azure.data.tables import UpdateMode
+
+    try:
+        table_client = await get_table_client()
+        await table_client.update_entity(
+            entity={"PartitionKey": entity["PartitionKey"], "RowKey": entity["RowKey"], "Error": error},
+            mode=UpdateMode.MERGE,
+        )
+    except Exception as e:  # pylint: disable=broad-except
+        logging.error(f"No se pudo marcar como fallido el registro {entity['Id']}: {str(e)}")
+        return False
+
+    order_code = entity.get("Ds_Merchant_Order")
+    if order_code:
+        try:
+            index_client = await get_table_client(ORDER_INDEX_TABLE_NAME)
+            await index_client.delete_entity(*order_index_keys(order_code, entity_owner(entity)))
+        except ResourceNotFoundError:
+            pass
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning(f"No se pudo retirar '{order_code}' del índice de pedidos: {str(e)}")
+    return True
+
+
+async def _submit_in_transactions(
+    table_client, entities: Iterable[Dict[str, Any]], mode: str = "merge"
+) -> Set[Tuple[str, str]]:
+    """Versión asíncrona de `table_storage_sdk._submit_in_transactions`."""
+    saved: Set[Tuple[str, str]] = set()
+    for partition_key, chunk in transaction_chunks(entities):
+        try:
+            await table_client.submit_transaction([("upsert", entity, {"mode": mode}) for entity in chunk])
+            saved.update((partition_key, entity["RowKey"]) for entity in chunk)
+            continue
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning(f"Transacción fallida en la partición {partition_key}: {str(e)}")
+        for entity in chunk:
+            try:
+                await table_client.upsert_entity(entity=entity, mode=mode)
+                saved.add((partition_key, entity["RowKey"]))
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error(f"Error al guardar en tabla: {str(e)}")
+    return saved
+
+
+async def save_many_to_table(entities: List[Dict[str, Any]]) -> Set[str]:
+    """Guarda varias entidades de `build_log_entity`. Devuelve los `Id` guardados."""
+    if not entities:
+        return set()
+
+    try:
+        saved_keys = await _submit_in_transactions(await get_table_client(), entities)
+    except Exception as e:  # pylint: disable=broad-except
+        logging.error(f"Error al guardar en tabla: {str(e)}")
+        return set()
+
+    saved = [entity for entity in entities if (entity["PartitionKey"], entity["RowKey"]) in saved_keys]
+    index_entities = order_index_entities(saved)
+    if index_entities:
+        try:
+            await _submit_in_transactions(
+                await get_table_client(ORDER_INDEX_TABLE_NAME), index_entities, INDEX_WRITE_MODE
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning(f"No se pudo actualizar el índice de pedidos: {str(e)}")
+
+    return {entity["Id"] for entity in saved}
@@ -1,61 +1,221 @@
+from collections import defaultdict
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import hashlib
 import uuid
-import os
 import logging
-from azure.data.tables import TableServiceClient
 from azure.core.exceptions import ResourceNotFoundError
 
+from utils import table_clients
 from utils.crypto import encrypt_secret
+from utils.merchants import MerchantKey, merchant_key, optional_merchant_key
 
-def get_table_client():
+LOG_TABLE_NAME = "EncryptDataLogs"
+ORDER_INDEX_TABLE_NAME = "EncryptDataLogsOrderIndex"
+
+# La entidad índice solo apunta al registro de EncryptDataLogs: las credenciales
+# se leen siempre del registro, de modo que corregirlas o rotarlas allí vale para
+# las notificaciones siguientes y el secreto no queda copiado junto a su clave.
+ORDER_INDEX_FIELDS = ("LogPartitionKey", "LogRowKey")
+
+# Campos del registro que necesitan DecryptAndRedirect y DeliverNotification
+# (lectura puntual proyectada tras seguir el índice)
+ORDER_LOOKUP_FIELDS = (
+    "PartitionKey",
+    "RowKey",
+    "Id",
+    "URLBC",
+    "AuthType",
+    "User",
+    "Pass",
+    "PassEncrypted",
+    "EncryptType",
+    "EncryptKey",
+    "Ds_Merchant_Order",
+    "RedirectURL",
+    "BCPath",
+    "BCMethod",
+    "Ds_MerchantCode",
+    "Ds_Terminal",
+    "Error",
+)
+
+# Las entradas del índice se reemplazan enteras (no MERGE), así desaparecen los
+# campos que copiaban las versiones anteriores del índice
+INDEX_WRITE_MODE = "replace"
+
+# Consulta para pedidos sin índice de un comercio/terminal concreto
+MERCHANT_ORDER_FILTER = "Ds_Merchant_Order eq @order and Ds_MerchantCode eq @merchant and Ds_Terminal eq @terminal"
+
+# Consultas para registros sin comercio (anteriores a guardarlo), en orden de prioridad:
+# 1. nuevo campo Ds_Merchant_Order
+# 2. compatibilidad con registros antiguos (RowKey / Id)
+LEGACY_ORDER_FILTERS = (
+    "Ds_Merchant_Order eq @order",
+    "RowKey eq @order",
+    "Id eq @order",
+)
+
+# Máximo de operaciones por transacción (entity group transaction) de Table Storage
+TRANSACTION_MAX_OPERATIONS = 100
+
+# Caracteres no admitidos por Table Storage en PartitionKey/RowKey
+_FORBIDDEN_KEY_CHARS = set("/\\#?")
+
+
+def get_table_client(table_name: str = LOG_TABLE_NAME):
     """
     Obtiene el cliente de Table Storage usando la connection string de Azure.
+
+    El cliente se comparte entre invocaciones y la tabla solo se crea la
+    primera vez que se usa en el proceso (ver `utils.table_clients`).
     """
-    # Obtener la connection string de la variable de entorno
-    connection_string = os.environ.get("AzureWebJobsStorage")
-    
-    if not connection_string:
-        raise ValueError("AzureWebJobsStorage no está configurado")
-    
-    table_service = TableServiceClient.from_connection_string(conn_str=connection_string)
+    return table_clients.get_table_client(table_name)
 
-    # Asegurar que la tabla existe
-    table_service.create_table_if_not_exists(table_name="EncryptDataLogs")
 
-    table_client = table_service.get_table_client(table_name="EncryptDataLogs")
-    
-    return table_client
+def entity_owner(entity: Dict[str, Any]) -> Optional[MerchantKey]:
+    """(comercio, terminal) dueño del registro, o None si es anterior a guardarlo."""
+    return optional_merchant_key(entity.get("Ds_MerchantCode"), entity.get("Ds_Terminal"))
 
 
-def get_entity_by_order_code(order_code: str) -> Optional[Dict[str, Any]]:
-    """Recupera una entidad usando el código de pedido almacenado."""
+def owned_by(entity: Dict[str, Any], owner: Optional[MerchantKey], accept_untagged: bool) -> bool:
+    """True si el registro es del comercio `owner` (o no tiene comercio y se aceptan esos)."""
+    entity_key = entity_owner(entity)
+    if entity_key is None:
+        return accept_untagged
+    return entity_key == owner
 
-    table_client = get_table_client()
 
-    # Intento 1: nuevo campo Ds_Merchant_Order
-    query_filter = "Ds_Merchant_Order eq @order"
-    parameters = {"order": order_code}
-    results = list(table_client.query_entities(query_filter, parameters=parameters))
-    if results:
-        return results[0]
-
-    # Intento 2: compatibilidad con registros antiguos (RowKey / Id)
-    legacy_filter = "RowKey eq @legacy"
-    legacy_params = {"legacy": order_code}
-    results = list(table_client.query_entities(legacy_filter, parameters=legacy_params))
-    if results:
-        return results[0]
-
-    id_filter = "Id eq @identifier"
-    id_params = {"identifier": order_code}
-    results = list(table_client.query_entities(id_filter, parameters=id_params))
-    if results:
-        return results[0]
+def order_index_keys(order_code: str, owner: Optional[MerchantKey] = None) -> Tuple[str, str]:
+    """Devuelve (PartitionKey, RowKey) de la entidad índice de un código de pedido.
+
+    Los números de pedido de RedSys solo son únicos por comercio y terminal,
+    así que con `owner` la clave es (comercio, terminal, pedido). Sin él es la
+    del pedido solo (registros sin comercio y claves del ledger).
+
+    La partición se reparte en 256 cubos según el hash de la clave para no
+    concentrar todas las escrituras en una sola partición.
+    """
+    key = order_code if owner is None else f"{owner[0]}:{owner[1]}:{order_code}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    partition_key = f"ORD-{digest[:2]}"
+    if any(char in _FORBIDDEN_KEY_CHARS or ord(char) < 32 for char in key):
+        return partition_key, f"h-{digest}"
+    return partition_key, key
+
 
+def order_lookup_keys(
+    order_code: str, owner: Optional[MerchantKey], accept_untagged: bool
+) -> List[Tuple[str, str]]:
+    """Claves del índice donde puede estar el pedido de `owner`, por orden de prioridad."""
+    keys = [order_index_keys(order_code, owner)] if owner is not None else []
+    if accept_untagged:
+        keys.append(order_index_keys(order_code))
+    return keys
+
+
+def legacy_order_queries(
+    order_code: str, owner: Optional[MerchantKey], accept_untagged: bool
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """(filtro, parámetros) para buscar el pedido de `owner` sin índice, por orden de prioridad."""
+    queries: List[Tuple[str, Dict[str, Any]]] = []
+    if owner is not None:
+        queries.append((MERCHANT_ORDER_FILTER, {"order": order_code, "merchant": owner[0], "terminal": owner[1]}))
+    if accept_untagged:
+        queries.extend((query_filter, {"order": order_code}) for query_filter in LEGACY_ORDER_FILTERS)
+    return queries
+
+
+def build_order_index_entity(order_code: str, entity: Dict[str, Any]) -> Dict[str, Any]:
+    """Construye la entidad índice que apunta a `entity` en EncryptDataLogs."""
+    partition_key, row_key = order_index_keys(order_code, entity_owner(entity))
+    return {
+        "PartitionKey": partition_key,
+        "RowKey": row_key,
+        "LogPartitionKey": entity.get("PartitionKey"),
+        "LogRowKey": entity.get("RowKey"),
+    }
+
+
+def _write_order_index(order_code: str, entity: Dict[str, Any]) -> None:
+    try:
+        index_client = get_table_client(ORDER_INDEX_TABLE_NAME)
+        index_client.upsert_entity(entity=build_order_index_entity(order_code, entity), mode=INDEX_WRITE_MODE)
+    except Exception as e:  # pylint: disable=broad-except
+        # El índice es una optimización: la búsqueda sigue funcionando con el fallback
+        logging.warning(f"No se pudo actualizar el índice de pedidos para '{order_code}': {str(e)}")
+
+
+def resolves_order(entity: Dict[str, Any], owner: Optional[MerchantKey], accept_untagged: bool) -> bool:
+    # Un registro con Error (p. ej. la llamada a RedSys falló, ver `mark_failed`) o de
+    # otro comercio no resuelve el pedido
+    return not entity.get("Error") and owned_by(entity, owner, accept_untagged)
+
+
+def _first_match(
+    table_client,
+    query_filter: str,
+    parameters: Dict[str, Any],
+    owner: Optional[MerchantKey],
+    accept_untagged: bool,
+) -> Optional[Dict[str, Any]]:
+    # Página por defecto: cada fila con Error descartada no cuesta un viaje más a Table Storage
+    for entity in table_client.query_entities(query_filter, parameters=parameters):
+        if resolves_order(entity, owner, accept_untagged):
+            return entity
     return None
 
-def save_to_table(
+
+def _find_legacy_entity(
+    order_code: str, owner: Optional[MerchantKey], accept_untagged: bool = False
+) -> Optional[Dict[str, Any]]:
+    table_client = get_table_client()
+    for query_filter, parameters in legacy_order_queries(order_code, owner, accept_untagged):
+        entity = _first_match(table_client, query_filter, parameters, owner, accept_untagged)
+        if entity:
+            return entity
+    return None
+
+
+def get_entity_by_order_code(
+    order_code: str, owner: Optional[MerchantKey], accept_untagged: bool = False
+) -> Optional[Dict[str, Any]]:
+    """Recupera la entidad del pedido `order_code` del comercio `owner` (comercio, terminal).
+
+    Primero hace una lectura puntual sobre la tabla índice y otra, proyectada
+    a `ORDER_LOOKUP_FIELDS`, sobre el registro al que apunta; si el pedido no
+    está indexado (registros anteriores al índice) recurre a las consultas
+    sobre EncryptDataLogs (sin los registros marcados con Error) y, si
+    encuentra la entidad, la indexa.
+
+    Los registros de otro comercio nunca se devuelven. Los que no guardan
+    comercio (anteriores a guardarlo) solo con `accept_untagged`, es decir,
+    cuando la notificación se verificó con la clave por defecto
+    (`REDSYS_SHA256_KEY`), la única que se usaba entonces.
+    """
+
+    try:
+        index_client = get_table_client(ORDER_INDEX_TABLE_NAME)
+        for partition_key, row_key in order_lookup_keys(order_code, owner, accept_untagged):
+            try:
+                pointer = index_client.get_entity(partition_key, row_key, select=list(ORDER_INDEX_FIELDS))
+                entity = get_table_client().get_entity(
+                    pointer["LogPartitionKey"], pointer["LogRowKey"], select=list(ORDER_LOOKUP_FIELDS)
+                )
+            except (ResourceNotFoundError, KeyError):
+                # Sin entrada, o apunta a un registro ya borrado (p. ej. por la retención)
+                continue
+            if resolves_order(entity, owner, accept_untagged):
+                return entity
+    except Exception as e:  # pylint: disable=broad-except
+        logging.warning(f"No se pudo consultar el índice de pedidos: {str(e)}")
+
+    entity = _find_legacy_entity(order_code, owner, accept_untagged)
+    if entity:
+        _write_order_index(order_code, entity)
+    return entity
+
+def build_log_entity(
     url_bc: str,
     auth_type: str,
     user: str,
@@ -65,10 +225,12 @@ def save_to_table(
     ds_merchant_order: str | None = None,
     redirect_url: str | None = None,
     error: str | None = None,
-) -> str:
+    merchant_code: str | None = None,
+    terminal: str | None = None,
+) -> Dict[str, Any]:
     """
-    Guarda una entidad en Azure Table Storage usando el SDK directamente.
-    
+    Construye la entidad de EncryptDataLogs con la contraseña ya cifrada.
+
     Args:
         url_bc: URL de BC para reenviar datos después
         auth_type: Tipo de autenticación (Basic o oAuth)
@@ -77,9 +239,11 @@ def save_to_table(
         encrypt_type: Tipo de encriptación usado (SHA-256 o SHA-512)
         encrypt_key: Clave para encriptar/desencriptar
         error: Mensaje de error si hubo alguno (opcional)
+        merchant_code: Código de comercio RedSys dueño del pedido (opcional)
+        terminal: Terminal RedSys del pedido; se guarda normalizado (opcional)
     
     Returns:
-        ID único generado para la entidad
+        Entidad lista para insertar; su `Id` identifica el registro
     """
     now = datetime.utcnow()
     
@@ -118,19 +282,137 @@ def save_to_table(
 
     if redirect_url:
         entity["RedirectURL"] = redirect_url
+
+    # El pedido solo es único por comercio y terminal: las notificaciones lo buscan con ambos
+    if merchant_code and terminal not in (None, ""):
+        entity["Ds_MerchantCode"], entity["Ds_Terminal"] = merchant_key(merchant_code, terminal)
     
     # Agregar error si existe
     if error:
         entity["Error"] = error
-    
+
+    return entity
+
+
+def save_to_table(
+    url_bc: str,
+    auth_type: str,
+    user: str,
+    password: str,
+    encrypt_type: str,
+    encrypt_key: str,
+    ds_merchant_order: str | None = None,
+    redirect_url: str | None = None,
+    error: str | None = None,
+    merchant_code: str | None = None,
+    terminal: str | None = None,
+) -> str:
+    """
+    Guarda una entidad en Azure Table Storage usando el SDK directamente.
+
+    Los argumentos son los de `build_log_entity`.
+
+    Returns:
+        ID único generado para la entidad
+    """
+    entity = build_log_entity(
+        url_bc=url_bc,
+        auth_type=auth_type,
+        user=user,
+        password=password,
+        encrypt_type=encrypt_type,
+        encrypt_key=encrypt_key,
+        ds_merchant_order=ds_merchant_order,
+        redirect_url=redirect_url,
+        error=error,
+        merchant_code=merchant_code,
+        terminal=terminal,
+    )
+    unique_id = entity["Id"]
+
     try:
         table_client = get_table_client()
         table_client.upsert_entity(entity=entity)
+        if ds_merchant_order and not error:
+            _write_order_index(ds_merchant_order, entity)
         return unique_id
     except Exception as e:
         # Si falla, devolver None pero no romper la función
-        import logging
         logging.error(f"Error al guardar en tabla: {str(e)}")
         return None
 
 
+
+
+def transaction_chunks(entities: Iterable[Dict[str, Any]]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Agrupa las entidades por partición en bloques de hasta 100 (una transacción cada uno)."""
+    # Una transacción no admite dos operaciones sobre la misma entidad: gana la última
+    by_partition: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+    for entity in entities:
+        by_partition[entity["PartitionKey"]][entity["RowKey"]] = entity
+
+    for partition_key, rows in by_partition.items():
+        partition_rows = list(rows.values())
+        for start in range(0, len(partition_rows), TRANSACTION_MAX_OPERATIONS):
+            yield partition_key, partition_rows[start:start + TRANSACTION_MAX_OPERATIONS]
+
+
+def order_index_entities(saved: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Entradas del índice de pedidos para las entidades guardadas sin error."""
+    return [
+        build_order_index_entity(entity["Ds_Merchant_Order"], entity)
+        for entity in saved
+        if entity.get("Ds_Merchant_Order") and not entity.get("Error")
+    ]
+
+
+def _submit_in_transactions(
+    table_client, entities: Iterable[Dict[str, Any]], mode: str = "merge"
+) -> Set[Tuple[str, str]]:
+    """Hace upsert (`mode`: merge o replace) agrupando por partición en transacciones de hasta 100 entidades.
+
+    Si una transacción falla, sus entidades se reintentan una a una para que un
+    registro problemático no impida guardar el resto. Devuelve las claves
+    (PartitionKey, RowKey) guardadas.
+    """
+    saved: Set[Tuple[str, str]] = set()
+    for partition_key, chunk in transaction_chunks(entities):
+        try:
+            table_client.submit_transaction([("upsert", entity, {"mode": mode}) for entity in chunk])
+            saved.update((partition_key, entity["RowKey"]) for entity in chunk)
+            continue
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning(f"Transacción fallida en la partición {partition_key}: {str(e)}")
+        for entity in chunk:
+            try:
+                table_client.upsert_entity(entity=entity, mode=mode)
+                saved.add((partition_key, entity["RowKey"]))
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error(f"Error al guardar en tabla: {str(e)}")
+    return saved
+
+
+def save_many_to_table(entities: List[Dict[str, Any]]) -> Set[str]:
+    """Guarda varias entidades de `build_log_entity` y mantiene su índice de pedidos.
+
+    Returns:
+        Conjunto de `Id` que se han guardado correctamente
+    """
+    if not entities:
+        return set()
+
+    try:
+        saved_keys = _submit_in_transactions(get_table_client(), entities)
+    except Exception as e:  # pylint: disable=broad-except
+        logging.error(f"Error al guardar en tabla: {str(e)}")
+        return set()
+
+    saved = [entity for entity in entities if (entity["PartitionKey"], entity["RowKey"]) in saved_keys]
+    index_entities = order_index_entities(saved)
+    if index_entities:
+        try:
+            _submit_in_transactions(get_table_client(ORDER_INDEX_TABLE_NAME), index_entities, INDEX_WRITE_MODE)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning(f"No se pudo actualizar el índice de pedidos: {str(e)}")
+
+    return {entity["Id"] for entity in saved}
@@ -0,0 +1,170 @@
+"""Medición de latencia por etapas de las funciones.
+
+Con `STAGE_TIMING_ENABLED=true`, cada invocación instrumentada con
+`instrumented(...)` acumula la duración de sus etapas (`with stage("lookup")`)
+y al terminar:
+- escribe una línea de log `StageTiming` con las duraciones en ms (también en
+  `extra["custom_dimensions"]` para los handlers de Application Insights),
+- registra cada duración en el histograma OpenTelemetry
+  `suitech.stage.duration` si `opentelemetry` está instalado,
+- añade la cabecera `Server-Timing` a la respuesta si
+  `STAGE_TIMING_SERVER_HEADER=true`.
+
+Desactivado, `stage()` solo consulta una ContextVar y devuelve un contexto
+vacío compartido.
+
+Las etapas pueden anidarse (por ejemplo `token` dentro de `bc_post`); cada una
+mide su propio intervalo, así que las duraciones se solapan.
+"""
+
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+_NULL_CONTEXT = contextlib.nullcontext()
+_current: ContextVar[Optional["StageTimer"]] = ContextVar("stage_timer", default=None)
+_histogram: Any = None
+
+
+def _flag(name: str) -> bool:
+    return os.environ.get(name, "false").lower() in ("true", "1", "yes")
+
+
+class _Span:
+    __slots__ = ("_timer", "_name", "_start")
+
+    def __init__(self, timer: "StageTimer", name: str) -> None:
+        self._timer = timer
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> "_Span":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._timer.record(self._name, (time.perf_counter() - self._start) * 1000)
+
+
+class StageTimer:
+    """Acumula la duración (ms) de cada etapa de una invocación."""
+
+    def __init__(self, function_name: str) -> None:
+        self.function_name = function_name
+        self.stages: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        self._end: Optional[float] = None
+
+    def stage(self, name: str) -> _Span:
+        return _Span(self, name)
+
+    def record(self, name: str, duration_ms: float) -> None:
+        # Una etapa repetida (p. ej. dos subidas de streams) suma sus duraciones
+        self.stages[name] = self.stages.get(name, 0.0) + duration_ms
+
+    def stop(self) -> None:
+        self._end = time.perf_counter()
+
+    def total_ms(self) -> float:
+        end = self._end if self._end is not None else time.perf_counter()
+        return (end - self._start) * 1000
+
+    def server_timing(self) -> str:
+        entries = [f"{name};dur={duration:.2f}" for name, duration in self.stages.items()]
+        entries.append(f"total;dur={self.total_ms():.2f}")
+        return ", ".join(entries)
+
+    def emit(self) -> None:
+        durations = {name: round(duration, 2) for name, duration in self.stages.items()}
+        durations["total"] = round(self.total_ms(), 2)
+        logging.info(
+            "StageTiming %s",
+            json.dumps({"function": self.function_name, "stagesMs": durations}),
+            extra={"custom_dimensions": {"function": self.function_name, **{f"stage_{k}_ms": v for k, v in durations.items()}}},
+        )
+        histogram = _get_histogram()
+        if histogram is not None:
+            for name, duration in durations.items():
+                histogram.record(duration, {"function": self.function_name, "stage": name})
+
+
+def _get_histogram() -> Any:
+    global _histogram
+    if _histogram is None:
+        try:
+            from opentelemetry import metrics
+
+            _histogram = metrics.get_meter("suitech.redsys").create_histogram(
+                "suitech.stage.duration", unit="ms", description="Duración de cada etapa de las funciones"
+            )
+        except ImportError:
+            _histogram = False
+    return _histogram or None
+
+
+def stage(name: str):
+    """Context manager que mide la etapa `name` de la invocación en curso (si se mide)."""
+    timer = _current.get()
+    if timer is None:
+        return _NULL_CONTEXT
+    return timer.stage(name)
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _current.get()
+
+
+def _finish(timer: StageTimer, response: Any) -> None:
+    timer.stop()
+    timer.emit()
+    if _flag("STAGE_TIMING_SERVER_HEADER") and response is not None:
+        response.headers["Server-Timing"] = timer.server_timing()
+
+
+def instrumented(function_name: str) -> Callable:
+    """Decorador para el `main` (síncrono o `async def`) de una función HTTP que activa la medición por etapas."""
+
+    def decorator(handler: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(handler):
+
+            @functools.wraps(handler)
+            async def async_wrapper(req, *args: Any, **kwargs: Any):
+                if not _flag("STAGE_TIMING_ENABLED"):
+                    return await handler(req, *args, **kwargs)
+
+                timer = StageTimer(function_name)
+                token = _current.set(timer)
+                response = None
+                try:
+                    response = await handler(req, *args, **kwargs)
+                finally:
+                    _current.reset(token)
+                    _finish(timer, response)
+                return response
+
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(req, *args: Any, **kwargs: Any):
+            if not _flag("STAGE_TIMING_ENABLED"):
+                return handler(req, *args, **kwargs)
+
+            timer = StageTimer(function_name)
+            token = _current.set(timer)
+            response = None
+            try:
+                response = handler(req, *args, **kwargs)
+            finally:
+                _current.reset(token)
+                _finish(timer, response)
+            return response
+
+        return wrapper
+
+    return decorator
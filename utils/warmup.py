@@ -0,0 +1,159 @@
+"""Precalentamiento de una instancia nueva de la Function App.
+
+En los planes Premium/Elastic Premium el host ejecuta la función `Warmup`
+(`warmupTrigger`) en cada instancia nueva antes de enviarle peticiones. Desde
+ahí `warm_up` adelanta el trabajo que, si no, pagaría la primera notificación:
+
+- importa los paquetes que los módulos cargan de forma diferida (`aiohttp`,
+  `azure.data.tables`, `azure.storage.queue`);
+- crea los clientes de Table Storage y de la cola (síncronos y asíncronos) y
+  abre su conexión con una lectura que no devuelve nada;
+- abre conexiones keep-alive con los hosts de `WARMUP_URLS` (por defecto el
+  endpoint de tokens de Entra ID, la API de Business Central y la URL REST de
+  RedSys configurada), en los pools de `http_pool` y `http_pool_aio`;
+- carga el registro de comercios y prepara el firmador de `REDSYS_SHA256_KEY`.
+
+Los pasos se ejecutan a la vez y un fallo en uno no impide los demás: una
+instancia que no se ha podido precalentar funciona igual, solo que en frío. El
+plan de consumo no tiene warmup trigger; ahí solo se aprovechan las
+importaciones diferidas.
+"""
+
+import asyncio
+import importlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from urllib.parse import urlparse
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from utils import http_pool, http_pool_aio, merchants, table_clients
+from utils.crypto import get_signer
+from utils.idempotency import LEDGER_TABLE_NAME
+from utils.notification_queue import get_async_queue_client, get_queue_client
+from utils.table_storage_sdk import LOG_TABLE_NAME, ORDER_INDEX_TABLE_NAME
+
+# Paquetes que `http_pool_aio`, `table_clients` y `notification_queue` importan al usarse
+LAZY_MODULES = (
+    "aiohttp",
+    "azure.data.tables",
+    "azure.data.tables.aio",
+    "azure.storage.queue",
+    "azure.storage.queue.aio",
+)
+
+WARMUP_TABLES = (LOG_TABLE_NAME, ORDER_INDEX_TABLE_NAME, LEDGER_TABLE_NAME)
+
+DEFAULT_WARMUP_URLS = (
+    "https://login.microsoftonline.com/",
+    "https://api.businesscentral.dynamics.com/",
+)
+
+# Clave que no existe: basta para abrir la conexión sin leer datos
+_PROBE_KEYS = ("warmup", "warmup")
+
+
+def warmup_urls() -> List[str]:
+    configured = os.environ.get("WARMUP_URLS")
+    if configured is not None:
+        urls = [url.strip() for url in configured.split(",") if url.strip()]
+    else:
+        urls = list(DEFAULT_WARMUP_URLS)
+        rest_url = os.environ.get("PAYGOLD_REST_URL") or os.environ.get("REDSYS_REST_URL")
+        if rest_url:
+            urls.append(rest_url)
+    # Una petición por host: el pool reutiliza la conexión para cualquier ruta
+    by_host = {}
+    for url in urls:
+        parsed = urlparse(url)
+        by_host.setdefault((parsed.scheme, parsed.netloc), f"{parsed.scheme}://{parsed.netloc}/")
+    return list(by_host.values())
+
+
+def _import_lazy_modules() -> None:
+    for module_name in LAZY_MODULES:
+        importlib.import_module(module_name)
+
+
+def _probe_table(table_client) -> None:
+    try:
+        table_client.get_entity(*_PROBE_KEYS, select=["PartitionKey"])
+    except ResourceNotFoundError:
+        pass
+
+
+def _warm_tables() -> None:
+    for table_name in WARMUP_TABLES:
+        _probe_table(table_clients.get_table_client(table_name))
+
+
+async def _warm_tables_async() -> None:
+    async def probe(table_name: str) -> None:
+        table_client = await table_clients.get_async_table_client(table_name)
+        try:
+            await table_client.get_entity(*_PROBE_KEYS, select=["PartitionKey"])
+        except ResourceNotFoundError:
+            pass
+
+    await asyncio.gather(*(probe(table_name) for table_name in WARMUP_TABLES))
+
+
+def _warm_queue() -> None:
+    get_queue_client().get_queue_properties()
+
+
+async def _warm_queue_async() -> None:
+    queue_client = await get_async_queue_client()
+    await queue_client.get_queue_properties()
+
+
+def _warm_http() -> None:
+    for url in warmup_urls():
+        # El código de respuesta da igual: lo que interesa es la conexión TLS abierta
+        http_pool.request("HEAD", url, timeout=5).close()
+
+
+async def _warm_http_async() -> None:
+    await asyncio.gather(*(http_pool_aio.request("HEAD", url, timeout=5) for url in warmup_urls()))
+
+
+def _warm_signers() -> int:
+    registered = merchants.preload()
+    secret_key = os.environ.get("REDSYS_SHA256_KEY")
+    if secret_key:
+        get_signer(secret_key)
+    return registered
+
+
+async def _timed(name: str, step: Callable[[], Awaitable[Any]]) -> Tuple[str, Dict[str, Any]]:
+    started = time.perf_counter()
+    try:
+        result = await step()
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.warning("Warmup: el paso %s ha fallado: %s", name, exc)
+        outcome: Dict[str, Any] = {"ok": False, "error": str(exc)}
+    else:
+        outcome = {"ok": True}
+        if result is not None:
+            outcome["result"] = result
+    outcome["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return name, outcome
+
+
+async def warm_up() -> Dict[str, Dict[str, Any]]:
+    """Ejecuta los pasos de precalentamiento y devuelve su resultado y duración."""
+    # Las importaciones van primero: los demás pasos las necesitan y en paralelo
+    # solo competirían por el lock de importación
+    steps = [await _timed("imports", lambda: asyncio.to_thread(_import_lazy_modules))]
+    steps += await asyncio.gather(
+        _timed("tables", lambda: asyncio.to_thread(_warm_tables)),
+        _timed("tables_async", _warm_tables_async),
+        _timed("queue", lambda: asyncio.to_thread(_warm_queue)),
+        _timed("queue_async", _warm_queue_async),
+        _timed("http", lambda: asyncio.to_thread(_warm_http)),
+        _timed("http_async", _warm_http_async),
+        _timed("merchants", lambda: asyncio.to_thread(_warm_signers)),
+    )
+    return dict(steps)